@@ -0,0 +1,68 @@
+"""Scheduling jitter of the sequencer clock compared with the previous pygame millisecond waits.
+
+Schedules N events at a fixed interval and reports how late each one fired.
+
+    PYTHONPATH=src python bench/bench_clock.py
+"""
+import time
+
+import numpy as np
+
+from music21_addons.clock import MonotonicClock, NS_PER_MS
+
+N_EVENTS = 1000
+INTERVAL_MS = 7.3
+
+
+def monotonic_lateness(n, interval_ns):
+    clock = MonotonicClock()
+    lateness = np.empty(n)
+    start = clock.now_ns()
+    for i in range(n):
+        deadline = start + int(i * interval_ns)
+        clock.sleep_until(deadline)
+        lateness[i] = clock.now_ns() - deadline
+    return lateness
+
+
+def pygame_lateness(n, interval_ns):
+    """The pre-existing loop: millisecond ticks and waits relative to the last event."""
+    import pygame
+    pygame.init()
+    lateness = np.empty(n)
+    start = time.perf_counter_ns()
+    pos = 0
+    last_time = pygame.time.get_ticks()
+    i = 0
+    while i < n:
+        t_ms = i * interval_ns / NS_PER_MS
+        time_to_wait = int(t_ms - (pos + pygame.time.get_ticks() - last_time))
+        if time_to_wait <= 0:
+            lateness[i] = time.perf_counter_ns() - (start + i * interval_ns)
+            pos = int(t_ms)
+            last_time = pygame.time.get_ticks()
+            i += 1
+        else:
+            pygame.time.wait(time_to_wait)
+    return lateness
+
+
+def report(label, lateness):
+    us = lateness / 1000
+    p50, p90, p99 = np.percentile(us, [50, 90, 99])
+    print(f'{label:10s} lateness p50 {p50:9.1f}us  p90 {p90:9.1f}us  p99 {p99:9.1f}us  max {us.max():9.1f}us  '
+          f'last {us[-1]:9.1f}us')
+
+
+def main():
+    interval_ns = INTERVAL_MS * NS_PER_MS
+    print(f'{N_EVENTS} events every {INTERVAL_MS}ms')
+    report('monotonic', monotonic_lateness(N_EVENTS, interval_ns))
+    try:
+        report('pygame', pygame_lateness(N_EVENTS, interval_ns))
+    except ImportError:
+        print('pygame not installed, skipping the previous scheduler')
+
+
+if __name__ == '__main__':
+    main()
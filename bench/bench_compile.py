@@ -0,0 +1,52 @@
+"""Compile time of a 64 track project, in process and on process pools of 1 to N workers.
+
+    PYTHONPATH=src python bench/bench_compile.py
+
+Pools are started and warmed up (grammar loaded) before they are timed,
+as the application's shared pool would be after its first use.
+"""
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from music21_addons.compile_pool import compile_onetrack, compile_tracks
+from music21_addons.onetrack import parse_onetrack, to_events, to_tempo_changes
+
+from synthetic import random_onetrack
+
+N_TRACKS = 64
+N_NOTES = 1500
+
+
+def compile_in_process(texts):
+    for text in texts:
+        items = parse_onetrack(text)
+        to_events(items)
+        to_tempo_changes(items)
+
+
+def main():
+    texts = [random_onetrack(N_NOTES, seed=i) for i in range(N_TRACKS)]
+    compile_in_process(texts[:1])
+    start = time.perf_counter()
+    compile_in_process(texts)
+    serial = time.perf_counter() - start
+    print(f'{N_TRACKS} tracks of {N_NOTES} notes, {os.cpu_count()} core(s)')
+    print(f'in process           {serial * 1000:8.1f}ms')
+
+    workers = 1
+    while workers <= (os.cpu_count() or 1):
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            list(executor.map(compile_onetrack, texts[:workers]))
+            start = time.perf_counter()
+            compiled = list(compile_tracks(texts, executor))
+            for c in compiled:
+                c.events()
+            elapsed = time.perf_counter() - start
+        print(f'pool of {workers:2d} worker(s) {elapsed * 1000:8.1f}ms  speedup {serial / elapsed:5.2f}x')
+        workers *= 2
+
+
+if __name__ == '__main__':
+    main()
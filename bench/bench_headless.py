@@ -0,0 +1,44 @@
+"""Headless, virtual-clock playback of a ten minute score, as run on CI.
+
+    PYTHONPATH=src python bench/bench_headless.py
+"""
+import threading
+import time
+
+from music21_addons.clock import VirtualClock, NS_PER_SEC
+from music21_addons.onetrack import parse_onetrack, to_events
+from music21_addons.sequencer import MySequencer, RecordingSynth
+
+from synthetic import random_onetrack
+
+N_TRACKS = 64
+BPM = 120
+MINUTES = 10
+
+
+def ten_minute_track(seed):
+    events = to_events(parse_onetrack(random_onetrack(1500, seed=seed)))
+    beats = MINUTES * BPM
+    return [ev for ev in events if ev.offset + ev.duration <= beats]
+
+
+def main():
+    tracks = [(i, ten_minute_track(i)) for i in range(N_TRACKS)]
+    clock = VirtualClock()
+    synth = RecordingSynth(clock)
+    seq = MySequencer(synth, clock=clock)
+    finished = threading.Event()
+
+    start = time.perf_counter()
+    seq.play_events(tracks, BPM, finished_cb=lambda *args: finished.set())
+    finished.wait()
+    elapsed = time.perf_counter() - start
+    seq.close()
+
+    music = clock.now_ns() / NS_PER_SEC
+    print(f'{N_TRACKS} tracks, {len(synth.events)} synth calls, {music:.0f}s of music '
+          f'played in {elapsed:.3f}s ({music / elapsed:.0f}x real time)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""Tk time spent on now-playing highlights per second of playback, per event and batched per frame.
+
+    PYTHONPATH=src python bench/bench_highlight.py
+
+Needs a display. 32 tracks each move to their next item every 20 ms, so
+1600 highlight changes a second; a quarter of the tracks are scrolled
+into view.
+"""
+import time
+from tkinter import Tk, Frame, Text, TOP, X, TclError
+
+from composition.application import Observable
+from gui.highlighter import NowPlayingHighlighter, text_range
+from gui.tk_dispatcher import TkDispatcher
+from gui.vertically_scrollable_frame import VerticalScrolledFrame
+from music21_addons.onetrack import parse_onetrack
+
+from synthetic import random_onetrack
+
+N_TRACKS = 32
+NOTE_MS = 20
+SECONDS = 5
+
+
+def per_event_handler(text):
+    """The highlight handler as it was: recreate and restyle the tag on every change."""
+    def playing_item_changed(old_val, new_val):
+        text.tag_delete("playing")
+        if new_val is not None:
+            text.tag_add("playing", *text_range(new_val))
+            text.tag_config("playing", background="yellow", foreground="black")
+
+    return playing_item_changed
+
+
+def run(batched):
+    root = Tk()
+    root.geometry('800x600')
+    scrolled = VerticalScrolledFrame(root)
+    scrolled.pack(expand=True, fill='both')
+    dispatcher = TkDispatcher(root)
+    highlighter = NowPlayingHighlighter(dispatcher, scrolled.canvas)
+    tracks = []
+    busy = [0]
+    for i in range(N_TRACKS):
+        text_src = random_onetrack(400, seed=i)
+        frame = Frame(scrolled.interior)
+        text = Text(frame, height=6)
+        text.insert('1.0', text_src)
+        text.pack(side=TOP, fill=X)
+        frame.pack(side=TOP, fill=X)
+        on_item = Observable(None)
+        if batched:
+            highlighter.connect(on_item, text, frame)
+        else:
+            handler = per_event_handler(text)
+
+            def timed(old_value, new_value, handler=handler):
+                start = time.perf_counter_ns()
+                handler(old_value, new_value)
+                busy[0] += time.perf_counter_ns() - start
+
+            on_item.changed.register(timed)
+        tracks.append((on_item, [item.location() for item in parse_onetrack(text_src)]))
+
+    start = time.perf_counter() + 0.1
+    step = [0]
+
+    def play():
+        due = int((time.perf_counter() - start) * 1000 / NOTE_MS)
+        while step[0] < due:
+            for on_item, locations in tracks:
+                on_item.value = locations[step[0] % len(locations)]
+            step[0] += 1
+        if time.perf_counter() - start < SECONDS:
+            root.after(1, play)
+        else:
+            root.quit()
+
+    root.after(100, play)
+    root.mainloop()
+    root.destroy()
+    busy_ns = highlighter.busy_ns if batched else busy[0]
+    changes = step[0] * N_TRACKS
+    print(f'{"batched" if batched else "per event":10s} {busy_ns / 1e6 / SECONDS:7.1f}ms of Tk time per second, '
+          f'{changes} changes, {highlighter.moves if batched else changes} tag moves')
+
+
+def main():
+    try:
+        run(False)
+        run(True)
+    except TclError as e:
+        print('No display:', e)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Loading a 100 track project, one notification at a time and in a transaction.
+
+    PYTHONPATH=src python bench/bench_load.py
+
+A headless stand-in for the GUI redraws a track whenever one of its
+observables notifies.
+"""
+import time
+
+from composition.application import MultiTrack
+from music21_addons.sequencer import TextSynth
+from utils.midi_instrument_defs import get_flat_gm_instrument_map
+
+from synthetic import random_onetrack
+
+N_TRACKS = 100
+N_NOTES = 200
+REDRAW_MS = 0.2  # stand-in for the cost of redrawing a track frame
+
+
+class HeadlessGui():
+    def __init__(self):
+        self.redraws = 0
+
+    def track_added(self, multi_track, track):
+        for obs in (track.tiny, track.instrument, track.muted, track.soloed):
+            obs.changed.register(self.redraw)
+
+    def redraw(self, old_value, new_value):
+        self.redraws += 1
+        deadline = time.perf_counter() + REDRAW_MS / 1000
+        while time.perf_counter() < deadline:
+            pass
+
+
+def project():
+    names = [f'{group}:{name}' for group, name in get_flat_gm_instrument_map()]
+    return [(names[i % len(names)], random_onetrack(N_NOTES, seed=i), i % 10 == 0, False) for i in range(N_TRACKS)]
+
+
+def load_unbatched(multi_track, tracks):
+    for instrument_name, text, muted, soloed in tracks:
+        multi_track.add_track()
+        track = multi_track.tracks[-1]
+        track.instrument.value = instrument_name
+        track.tiny.value = text
+        track.muted.value = muted
+        track.soloed.value = soloed
+
+
+def measure(name, load):
+    gui = HeadlessGui()
+    multi_track = MultiTrack(gui, TextSynth())
+    start = time.perf_counter()
+    load(multi_track, project())
+    elapsed = time.perf_counter() - start
+    print(f'{name:12s} {elapsed * 1000:8.1f}ms  {gui.redraws:4d} redraws')
+    multi_track.player.sequencer.close()
+
+
+def main():
+    TextSynth.configure_instrument_map(get_flat_gm_instrument_map())
+    measure('unbatched', load_unbatched)
+    measure('transaction', lambda multi_track, tracks: multi_track.load(tracks))
+
+
+if __name__ == '__main__':
+    main()
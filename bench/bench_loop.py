@@ -0,0 +1,73 @@
+"""Memory held by the sequencer while it loops four bars for hours of virtual time.
+
+The growth is the few tens of kilobytes of updates in flight to the notifier, however many
+iterations have played.
+
+    PYTHONPATH=src python bench/bench_loop.py
+"""
+import threading
+import time
+import tracemalloc
+
+from music21_addons.clock import VirtualClock, NS_PER_SEC
+from music21_addons.onetrack import parse_onetrack, to_events
+from music21_addons.sequencer import MySequencer
+
+from bench_sequencer_commands import NullSynth
+from synthetic import random_onetrack
+
+N_TRACKS = 4
+BPM = 120
+LOOP_BEATS = 16
+WARMUP_SEC = 60
+HOUR_SEC = 3600
+HOURS = [1, 2, 4]
+
+
+class PausingClock(VirtualClock):
+    """Virtual clock that holds the sequencer at ``limit_ns`` until the limit is raised."""
+
+    def __init__(self):
+        super().__init__()
+        self.limit_ns = 0
+        self.reached = threading.Event()
+
+    def sleep_until(self, deadline_ns, interrupt=None):
+        if deadline_ns > self.limit_ns:
+            self.reached.set()
+            interrupt.wait()
+            return False
+        return super().sleep_until(deadline_ns, interrupt)
+
+
+def run_until(seq, clock, seconds):
+    clock.reached.clear()
+    clock.limit_ns = seconds * NS_PER_SEC
+    seq.wakeup.set()
+    clock.reached.wait()
+    time.sleep(0.2)  # let the notifier drain its queue
+
+
+def main():
+    tracks = [(i, to_events(parse_onetrack(random_onetrack(200, seed=i)))) for i in range(N_TRACKS)]
+    clock = PausingClock()
+    seq = MySequencer(NullSynth(), clock=clock)
+    loop_ms = LOOP_BEATS * 60000 // BPM
+    seq.set_loop(loop_ms, 2 * loop_ms)
+    seq.play_events(tracks, BPM)
+    run_until(seq, clock, WARMUP_SEC)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for hours in HOURS:
+        run_until(seq, clock, WARMUP_SEC + hours * HOUR_SEC)
+        after = tracemalloc.take_snapshot()
+        growth = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+        print(f'{hours}h, {hours * HOUR_SEC * 1000 // loop_ms} loop iterations: memory held grew by {growth} bytes')
+    tracemalloc.stop()
+    seq.stop()
+    seq.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""Onetrack parse throughput: per-Track Earley parser vs. the shared LALR parser.
+
+    PYTHONPATH=src python bench/bench_onetrack_parser.py
+"""
+import time
+
+from music21_addons.onetrack import onetrack_parser, onetrack_grammar, OneTrackTransformer
+from lark import Lark
+
+from synthetic import random_onetrack
+
+N_NOTES = 5000
+N_TRACKS = 4
+
+
+def count_notes(items):
+    return len([x for x in items if hasattr(x, 'duration')])
+
+
+def bench(label, make_parser, text, n_tracks):
+    start = time.perf_counter()
+    notes = 0
+    for _ in range(n_tracks):
+        parser = make_parser()
+        notes += count_notes(OneTrackTransformer().transform(parser.parse(text)))
+    elapsed = time.perf_counter() - start
+    print(f'{label:32s} {elapsed:8.3f}s  {notes / elapsed:12.0f} notes/s')
+    return elapsed
+
+
+def main():
+    text = random_onetrack(N_NOTES)
+    print(f'{N_TRACKS} tracks x {N_NOTES} notes')
+
+    def earley_per_track():
+        return Lark(onetrack_grammar(), start='part')
+
+    before = bench('earley, parser built per track', earley_per_track, text, N_TRACKS)
+    onetrack_parser()  # warm up: loads the grammar from the lark cache file
+    after = bench('lalr, shared cached parser', onetrack_parser, text, N_TRACKS)
+    print(f'speedup: {before / after:.1f}x')
+
+    start = time.perf_counter()
+    Lark(onetrack_grammar(), start='part', parser='lalr')
+    uncached = time.perf_counter() - start
+    start = time.perf_counter()
+    Lark(onetrack_grammar(), start='part', parser='lalr', cache=True)
+    cached = time.perf_counter() - start
+    print(f'lalr construction: {uncached * 1000:.1f}ms uncached, {cached * 1000:.1f}ms from cache')
+
+
+if __name__ == '__main__':
+    main()
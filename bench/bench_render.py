@@ -0,0 +1,30 @@
+"""Realtime factor of rendering a ten minute, 16 track score to WAV with fluidsynth, mixed and as stems.
+
+    PYTHONPATH=src python bench/bench_render.py /path/to/soundfont.sf2 [output dir]
+"""
+import os
+import sys
+import tempfile
+
+from music21_addons.render import render_wav, FluidBlockSynth
+from music21_addons.tempo_map import TempoMap
+from music21_addons.timeline import build_timeline
+
+from bench_headless import ten_minute_track, BPM
+
+N_TRACKS = 16
+
+
+def main():
+    soundfont = sys.argv[1]
+    out_dir = sys.argv[2] if len(sys.argv) > 2 else tempfile.mkdtemp()
+    timeline = build_timeline([(i, ten_minute_track(i)) for i in range(N_TRACKS)])
+    for stems in (False, True):
+        path = os.path.join(out_dir, 'stems.wav' if stems else 'mix.wav')
+        result = render_wav(timeline, TempoMap(BPM), path, lambda: FluidBlockSynth(soundfont), stems=stems)
+        print(f'{"stems" if stems else "mix  "}: {result["seconds"]:.0f}s of audio in {result["elapsed"]:.1f}s '
+              f'({result["realtime_factor"]:.0f}x real time)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Latency from sending play/pause/seek/stop to the sequencer worker handling them, for small and large scores.
+
+    PYTHONPATH=src python bench/bench_sequencer_commands.py
+"""
+import time
+
+from music21_addons.onetrack import parse_onetrack, to_events
+from music21_addons.sequencer import MySequencer, Synth
+
+from synthetic import random_onetrack
+
+CYCLES = 200
+
+
+class NullSynth(Synth):
+
+    @classmethod
+    def configure_instrument_map(cls, instrument_map):
+        pass
+
+    def note_on(self, notenum, chan, velocity):
+        pass
+
+    def note_off(self, notenum, chan, velocity):
+        pass
+
+    def program_change(self, chan, inst):
+        pass
+
+    def get_instrument_map(self):
+        return None
+
+
+def bench(n_tracks, n_notes):
+    events = to_events(parse_onetrack(random_onetrack(n_notes)))
+    seq = MySequencer(NullSynth())
+    seq.play_events([(i, events) for i in range(n_tracks)], 120)
+    seq.sync()
+    for i in range(CYCLES):
+        seq.pause()
+        seq.unpause()
+        seq.seek((i * 7919) % max(seq.length, 1))
+        time.sleep(0.002)
+    seq.stop()
+    seq.sync()
+    print(f'{len(seq.to_play.events):8d} events:', end='')
+    for command, (count, worst) in sorted(seq.latency_stats().items()):
+        print(f'  {command} worst {worst / 1000:7.0f}us', end='')
+    print()
+    seq.close()
+
+
+def main():
+    bench(1, 100)
+    bench(15, 5000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""Export and import of a 50k note Standard MIDI File, against music21's converter for the import.
+
+    PYTHONPATH=src python bench/bench_smf.py
+"""
+import os
+import tempfile
+import time
+import tracemalloc
+
+from music21 import converter
+
+from music21_addons.onetrack import parse_onetrack, to_events
+from music21_addons.smf import write_smf, read_smf
+from music21_addons.tempo_map import TempoMap
+from music21_addons.timeline import build_timeline
+
+from synthetic import random_onetrack
+
+N_TRACKS = 8
+N_NOTES = 50000
+
+
+def measure(name, fn, *args):
+    """Time ``fn`` on its own, then run it again under tracemalloc for its peak memory."""
+    start = time.perf_counter()
+    fn(*args)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    result = fn(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f'{name:24s} {elapsed * 1000:9.1f}ms  peak {peak / 2 ** 20:7.2f}MiB')
+    return result
+
+
+def main():
+    tracks = [(i, to_events(parse_onetrack(random_onetrack(N_NOTES // N_TRACKS, seed=i)))) for i in range(N_TRACKS)]
+    timeline = build_timeline(tracks)
+    path = os.path.join(tempfile.mkdtemp(), 'bench.mid')
+    print(f'{len(timeline.events) // 2} notes on {N_TRACKS} tracks')
+    measure('export (timeline->smf)', write_smf, timeline, TempoMap(120), path)
+    channels = measure('import (smf->onetrack)', read_smf, path)
+    assert len(channels) == N_TRACKS
+    measure('music21 converter.parse', converter.parse, path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Memory and throughput of the compiled playback timeline on a large synthetic score.
+
+Compares the structured-array Timeline with the previous representation, a SortedDict
+keyed by seconds holding (event, is_on, program, channel) tuples.
+
+    PYTHONPATH=src python bench/bench_timeline.py
+"""
+import time
+import tracemalloc
+
+from sortedcontainers import SortedDict
+
+from music21_addons.onetrack import parse_onetrack, to_events
+from music21_addons.channels import PORT_CHANNELS
+from music21_addons.timeline import build_timeline
+
+from synthetic import random_onetrack
+
+N_TRACKS = 15
+N_NOTES = 5000
+BPM = 120
+
+
+def legacy_timeline(tracks):
+    sd = SortedDict()
+    sec_per_beat = 60 / BPM
+    unused_channels = list(PORT_CHANNELS)
+    for inst, events in tracks:
+        chan = unused_channels.pop(0)
+        for ev in events:
+            sec_start = ev.offset * sec_per_beat
+            sec_end = sec_start + ev.duration * sec_per_beat
+            sd.setdefault(sec_start, []).append((ev, True, inst, chan))
+            sd.setdefault(sec_end, []).append((ev, False, inst, chan))
+    return sd
+
+
+def legacy_playback(sd):
+    sent = 0
+    channel_inst = [-1] * 16
+    for i in range(len(sd)):
+        t, to_play_list = sd.peekitem(i)
+        for ev, is_on, inst, chan in to_play_list:
+            if channel_inst[chan] != inst:
+                channel_inst[chan] = inst
+            sent += len(ev.pitches)
+    return sent
+
+
+def timeline_playback(tl):
+    sent = 0
+    channel_inst = [-1] * 16
+    for i in range(len(tl)):
+        for t, event_type, chan, notenum, velocity, program, track, source in tl.group(i).tolist():
+            if channel_inst[chan] != program:
+                channel_inst[chan] = program
+            sent += 1
+    return sent
+
+
+def measure(label, build, playback, tracks):
+    tracemalloc.start()
+    start = time.perf_counter()
+    compiled = build(tracks)
+    built = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    sent = playback(compiled)
+    played = time.perf_counter() - start
+    print(f'{label:10s} build {built * 1000:8.1f}ms  retained {current / 2 ** 20:7.2f}MiB  '
+          f'peak {peak / 2 ** 20:7.2f}MiB  playback pass {sent / played:10.0f} events/s')
+
+
+def main():
+    tracks = [(i, to_events(parse_onetrack(random_onetrack(N_NOTES, seed=i)))) for i in range(N_TRACKS)]
+    n_events = sum(len(ev.pitches) for _, events in tracks for ev in events) * 2
+    print(f'{N_TRACKS} tracks, {n_events} note-on/off events')
+    measure('sorteddict', legacy_timeline, legacy_playback, tracks)
+    measure('timeline', build_timeline, timeline_playback, tracks)
+
+
+if __name__ == '__main__':
+    main()
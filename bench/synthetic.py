@@ -0,0 +1,34 @@
+"""Synthetic onetrack material for the benchmarks in this directory.
+
+Run the benchmarks from the repository root with ``PYTHONPATH=src``.
+"""
+import random
+
+PITCHES = ['C', 'D', 'E', 'F', 'G', 'A', 'B', 'c', 'd', 'e', 'f', 'g', 'a', 'b']
+ACCIDENTALS = ['', '', '', '#', '-']
+DURATIONS = ['', 'q', 't', 's', 'h', 't.']
+
+
+def random_pitch(rnd):
+    return rnd.choice(PITCHES) + rnd.choice(ACCIDENTALS) + rnd.choice(['', '3', '4', '5'])
+
+
+def random_onetrack(n_notes, seed=0):
+    """Return onetrack text with roughly ``n_notes`` notes, chords, rests and volume changes."""
+    rnd = random.Random(seed)
+    items = []
+    for i in range(n_notes):
+        r = rnd.random()
+        if r < 0.05:
+            items.append('v:' + str(rnd.randint(30, 110)))
+        if r < 0.1:
+            items.append('r' + rnd.choice(DURATIONS))
+        elif r < 0.3:
+            pitches = ' '.join(random_pitch(rnd) for _ in range(rnd.randint(2, 4)))
+            items.append('[' + pitches + ']' + rnd.choice(DURATIONS))
+        else:
+            vel = ':' + str(rnd.randint(30, 110)) if rnd.random() < 0.1 else ''
+            items.append(random_pitch(rnd) + rnd.choice(DURATIONS) + vel)
+        if i % 16 == 15:
+            items.append('\n')
+    return ' '.join(items)
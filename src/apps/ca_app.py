@@ -6,8 +6,10 @@ from typing import Callable, Dict
 
 from composition.application import MultiTrack, AudioPlayer, Observable, Track, APSTATE_STOPPED, APSTATE_PLAYING, \
     APSTATE_PAUSED
+from gui.highlighter import NowPlayingHighlighter
 from gui.search_combobox import Combobox_Autocomplete
 from gui.text_with_var import TextWithVar
+from gui.tk_dispatcher import TkDispatcher
 from gui.vertically_scrollable_frame import VerticalScrolledFrame
 
 import logging
@@ -17,13 +19,13 @@ from utils.midi_instrument_defs import get_flat_gm_instrument_map
 logger = logging.getLogger(__name__)
 
 
-def connect_tvar_obs(tvar: Variable, obs: Observable, debug=False):
+def connect_tvar_obs(tvar: Variable, obs: Observable, dispatcher: TkDispatcher, debug=False):
     def cb(var, indx, mode):
         obs.value = tvar.get()
 
     tvar.trace_add('write', cb)
 
-    @obs.changed.register
+    @dispatcher.observe(obs)
     def obs_changed(old_value, new_value):
         if tvar.get() != new_value:
             tvar.set(new_value)
@@ -52,15 +54,21 @@ class AudioPlayerFrame(Frame):
         self.tempo_label.pack(side=LEFT)
         self.tempo.pack(side=LEFT)
 
-    def connect(self, audio_player: AudioPlayer, play_fn: Callable, stop_fn: Callable):
+    def connect(self, audio_player: AudioPlayer, play_fn: Callable, stop_fn: Callable, dispatcher: TkDispatcher):
         self.player = audio_player
         self.playbutton.configure(command=play_fn)
         self.stopbutton.configure(command=stop_fn)
 
-        connect_tvar_obs(self.cue_pos, audio_player.cue_pos)
-        connect_tvar_obs(self.tempo_value, audio_player.tempo)
+        connect_tvar_obs(self.cue_pos, audio_player.cue_pos, dispatcher)
+        connect_tvar_obs(self.tempo_value, audio_player.tempo, dispatcher)
 
-        @audio_player.state.changed.register
+        def scrub(event):
+            audio_player.seek(self.cue.get())
+
+        self.cue.bind('<B1-Motion>', scrub)
+        self.cue.bind('<ButtonRelease-1>', scrub)
+
+        @dispatcher.observe(audio_player.state)
         def state_changed(old_value, new_value):
             icon = None
             if new_value == APSTATE_STOPPED or new_value == APSTATE_PAUSED:
@@ -70,7 +78,7 @@ class AudioPlayerFrame(Frame):
 
             self.playbutton.configure(image=icon)
 
-        @audio_player.length.changed.register
+        @dispatcher.observe(audio_player.length)
         def length_changed(old_value, new_value):
             len = new_value
             self.cue.configure(to=len, tickinterval=int(len / 4))
@@ -84,13 +92,13 @@ class InstrumentChooserCombobox(Combobox_Autocomplete):
             list_of_items=list_of_items,
             textvariable=self.tvar, ignorecase_match=False, startswith_match=False)
 
-    def connect(self, obs: Observable):
+    def connect(self, obs: Observable, dispatcher: TkDispatcher):
         def cb(var, indx, mode):
             obs.value = self.tvar.get()
 
         self.tvar.trace_add('write', cb)
 
-        @obs.changed.register
+        @dispatcher.observe(obs)
         def change_selection(old_value, new_value):
             if self.get_value() != new_value:
                 self.set_value(new_value)
@@ -117,25 +125,17 @@ class TrackFrame(Frame):
         solo = Checkbutton(self.left_frame, text="Solo", variable=self.solovar)
         solo.pack(side=TOP, anchor=W)
 
-    def connect(self, track: Track):
+    def connect(self, track: Track, dispatcher: TkDispatcher, highlighter: NowPlayingHighlighter):
         self.track = track
-        self.instchooser.connect(track.instrument)
-        connect_tvar_obs(self.tnvar, track.tiny)
-        connect_tvar_obs(self.mutevar, track.muted)
-        connect_tvar_obs(self.solovar, track.soloed)
-
-        @track.on_item.changed.register
-        def playing_item_changed(old_val, new_val):
-            # elogger.info("playing item", new_val)
-            self.tn_entry.tag_delete("playing")
-            if new_val is not None:
-                sl, sc, el, ec = new_val
-                start = f'{sl}.{sc - 1}'
-                end = f'{el}.{ec - 1}'
-                self.tn_entry.tag_add("playing", start, end)
-                self.tn_entry.tag_config("playing", background="yellow", foreground="black")
+        self.instchooser.connect(track.instrument, dispatcher)
+        connect_tvar_obs(self.tnvar, track.tiny, dispatcher)
+        connect_tvar_obs(self.mutevar, track.muted, dispatcher)
+        connect_tvar_obs(self.solovar, track.soloed, dispatcher)
+        highlighter.connect(track.on_item, self.tn_entry, self)
+        self.tn_entry.on_edit = track.apply_edit
 
     def do_popup(self, event):
+        self.tn_entry.flush()
         try:
             _ = self.tn_entry.selection_get()
         except TclError:
@@ -169,18 +169,25 @@ class MultiTrackFrame(VerticalScrolledFrame):
         self.multitrack.add_track()
 
     def track_added(self, multi_track, new_track):
-        self.connect(multi_track)
+        self.connect(multi_track, self.dispatcher, self.highlighter)
 
-    def connect(self, multi_track: MultiTrack):
+    def connect(self, multi_track: MultiTrack, dispatcher: TkDispatcher, highlighter: NowPlayingHighlighter):
         self.multitrack = multi_track
+        self.dispatcher = dispatcher
+        self.highlighter = highlighter
         my_tracks = [track for track, trackframe in self.tracks]
         for track in multi_track.tracks:
             if track not in my_tracks:
                 frame = TrackFrame(self.interior, track.get_instrument_names())
-                frame.connect(track)
+                frame.connect(track, dispatcher, highlighter)
                 frame.pack(side=TOP, anchor=W, expand=True, fill='x')
                 self.tracks.append((track, frame))
 
+    def flush(self):
+        """Pass on the edits the track editors are still holding back."""
+        for track, frame in self.tracks:
+            frame.tn_entry.flush()
+
 
 class MainWindow(Frame):
 
@@ -191,6 +198,8 @@ class MainWindow(Frame):
         self.player.pack(side=TOP, anchor=NW, fill=X)
         self.multitrack_frame = MultiTrackFrame(self)
         self.multitrack_frame.pack(side=TOP, anchor=N, expand=True, fill='both')
+        self.dispatcher = TkDispatcher(self)
+        self.highlighter = NowPlayingHighlighter(self.dispatcher, self.multitrack_frame.canvas)
 
         self.master.title("Compose!")
 
@@ -207,10 +216,15 @@ class MainWindow(Frame):
     def track_added(self, multi_track, new_track):
         self.connect(multi_track)
 
+    def play(self):
+        # Play what is typed, not what the editors last passed on
+        self.multitrack_frame.flush()
+        self.multitrack.play()
+
     def connect(self, multi_track: MultiTrack):
         self.multitrack = multi_track
-        self.player.connect(multi_track.player, multi_track.play, multi_track.stop)
-        self.multitrack_frame.connect(self.multitrack)
+        self.player.connect(multi_track.player, self.play, multi_track.stop, self.dispatcher)
+        self.multitrack_frame.connect(self.multitrack, self.dispatcher, self.highlighter)
 
 
 def main(synth):
@@ -1,14 +1,28 @@
 import logging
 import threading
-from typing import Any, Dict, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Tuple, List, Optional
 
+from lark.exceptions import LarkError
 from music21 import stream, key, meter, instrument
 
-from music21_addons.onetrack import onetrack_parser, onetrack_to_part, part_to_onetrack
+from music21_addons.clock import Clock
+from music21_addons.compile_pool import CompiledTrack, compile_tracks, try_compile_onetrack, onetrack_prefix, \
+    pack_events
+from music21_addons.events import NoteEvent
+from music21_addons.onetrack import onetrack_parser, part_to_onetrack, to_part, OneTrackDocument, to_events, \
+    to_tempo_changes
+from music21_addons.render import render_wav, FluidBlockSynth
+from music21_addons.smf import write_smf, read_smf
 from music21_addons.sequencer import MySequencer, Synth
+from music21_addons.tempo_map import TempoMap
+from music21_addons.timeline import Timeline
 
 logger = logging.getLogger(__name__)
 
+_transactions = threading.local()
+
 
 class Event(object):
     def __init__(self):
@@ -23,11 +37,47 @@ class Event(object):
         return callback
 
 
+@contextmanager
+def transaction():
+    """Hold back change notifications made on this thread until the outermost transaction ends.
+
+    Then every Observable that changed notifies once, from its value before
+    the transaction to its final value (or not at all if it is back where it
+    started), and every Computed that went stale notifies once.
+    """
+    if getattr(_transactions, 'pending', None) is not None:
+        yield
+        return
+    pending = _transactions.pending = {}  # type: Dict[Any, Callable[[], None]]
+    try:
+        yield
+    finally:
+        _transactions.pending = None
+        for notify in pending.values():
+            notify()
+
+
+def defer(key, notify: Callable[[], None]) -> bool:
+    """Run ``notify`` when the current transaction ends, once per ``key``. False if there is no transaction."""
+    pending = getattr(_transactions, 'pending', None)
+    if pending is None:
+        return False
+    pending.setdefault(key, notify)
+    return True
+
+
 class Observable(object):
+    """A value that notifies ``changed`` with (old value, new value) when it is set to something else.
+
+    ``dependents`` is notified straight away even inside a transaction; it is
+    what Computed values derived from this one listen to.
+    """
+
     def __init__(self, v: Any, debug=False):
         self._value = v
         self.debug = debug
         self.changed = Event()
+        self.dependents = Event()
 
     @property
     def value(self):
@@ -40,10 +90,93 @@ class Observable(object):
             self._value = v
             if self.debug:
                 logger.info("Setting observable value: (thread:%s) %s", threading.get_ident(), v)
-            self.changed.notify(old_value, v)
+            self.dependents.notify(old_value, v)
+            if not defer(self, lambda: self.notify_since(old_value)):
+                self.changed.notify(old_value, v)
+
+    def notify_since(self, old_value):
+        if self._value != old_value:
+            self.changed.notify(old_value, self._value)
+
+
+class Computed(object):
+    """A value derived from Observables (or other Computeds), computed only when read after an input changed.
+
+    ``invalidated`` is notified, without arguments, when the value goes
+    stale; reading ``value`` computes it again. ``version`` counts the
+    invalidations, so a value worked out elsewhere (e.g. on another thread)
+    from inputs taken at ``version`` can be stored with ``set`` only if none
+    of them has changed since. ``hits`` and ``misses`` count reads served
+    from the stored value and reads that computed it.
+    """
+
+    def __init__(self, compute: Callable[[], Any], *inputs):
+        self.compute = compute
+        self.version = 0
+        self.fresh = False
+        self.hits = 0
+        self.misses = 0
+        self._value = None  # type: Any
+        self.lock = threading.Lock()
+        self.invalidated = Event()
+        self.dependents = Event()
+        self.depend_on(*inputs)
+
+    def depend_on(self, *inputs):
+        for obs in inputs:
+            obs.dependents.register(self.invalidate)
+
+    def invalidate(self, *args):
+        with self.lock:
+            self.version += 1
+            was_fresh, self.fresh = self.fresh, False
+        if was_fresh:
+            self.dependents.notify()
+            if not defer(self, self.invalidated.notify):
+                self.invalidated.notify()
+
+    @property
+    def value(self):
+        with self.lock:
+            if self.fresh:
+                self.hits += 1
+                return self._value
+            version = self.version
+        self.misses += 1
+        value = self.compute()
+        self.set(value, version)
+        return value
+
+    def peek(self):
+        """The stored value if it is up to date, None otherwise; never computes."""
+        with self.lock:
+            return self._value if self.fresh else None
+
+    def lookup(self):
+        """``peek``, counted as a read: a hit, or a miss to be computed elsewhere and stored with ``set``."""
+        with self.lock:
+            if self.fresh:
+                self.hits += 1
+                return self._value
+            self.misses += 1
+            return None
+
+    def set(self, value, version) -> bool:
+        with self.lock:
+            if version != self.version:
+                return False
+            self._value, self.fresh = value, True
+            return True
 
 
 class Track():
+    """One onetrack part of a MultiTrack.
+
+    ``compiled`` holds its events, location map and tempo changes, computed
+    again only after ``tiny``, ``instrument``, or the key or time signature
+    it shares with the other tracks change.
+    """
+
     def __init__(self, timesig, tkey, imap):
         self.timesig = timesig
         self.key = tkey
@@ -54,7 +187,60 @@ class Track():
         self.imap = imap
         self.menu = self.build_menu_map()
         self.parser = onetrack_parser()
+        self.document = OneTrackDocument(parser=self.parser)
         self.on_item = Observable(None)
+        self.compiled = Computed(self.compile_text, self.tiny, self.instrument, self.timesig, self.key)
+
+    @property
+    def cache_hits(self) -> int:
+        return self.compiled.hits
+
+    @property
+    def cache_misses(self) -> int:
+        return self.compiled.misses
+
+    def cached(self) -> Optional[Tuple[List[NoteEvent], Dict, List[Tuple[float, float]]]]:
+        """The compiled entry if it is up to date, or None, counting a cache hit or miss like ``compile``."""
+        return self.compiled.lookup()
+
+    def compile(self) -> Tuple[List[NoteEvent], Dict, List[Tuple[float, float]]]:
+        """(events, location map, tempo changes) of the current text, compiled at most once per change."""
+        return self.compiled.value
+
+    def compile_text(self) -> Tuple[List[NoteEvent], Dict, List[Tuple[float, float]]]:
+        self.document.update(self.tiny.value)
+        events = to_events(self.document.items)
+        notemap = {id(ev): (ev.source, self) for ev in events}
+        return events, notemap, to_tempo_changes(self.document.items)
+
+    def apply_edit(self, pos, removed, inserted):
+        """Replace ``removed`` at ``pos`` in the text with ``inserted``, re-parsing only around the edit.
+
+        Does nothing if the text does not have ``removed`` at ``pos``.
+        """
+        text = self.tiny.value
+        if text[pos:pos + len(removed)] != removed:
+            return
+        try:
+            self.document.update(text)
+            self.document.apply_edit(pos, removed, inserted)
+        except LarkError:
+            pass  # Not valid onetrack (yet): compiling the text reports it
+        self.tiny.value = text[:pos] + inserted + text[pos + len(removed):]
+
+    def unpack(self, compiled: CompiledTrack) -> Tuple[List[NoteEvent], Dict, List[Tuple[float, float]]]:
+        events = compiled.events()
+        return events, {id(ev): (ev.source, self) for ev in events}, compiled.tempo_changes
+
+    def use_compiled(self, version, compiled: CompiledTrack) -> Tuple[List[NoteEvent], Dict, List[Tuple[float, float]]]:
+        """Store a compile done elsewhere, e.g. by compile_tracks, of the text as it was at ``version``.
+
+        May be called from another thread. Returns the unpacked entry, which is
+        only stored if the track has not changed since ``version``.
+        """
+        entry = self.unpack(compiled)
+        self.compiled.set(entry, version)
+        return entry
 
     def flatten_instruments(self, gm_inst: Dict[Tuple[str, str], int]):
         return [t0 + ':' + t1 for t0, t1 in gm_inst.keys()]
@@ -63,13 +249,25 @@ class Track():
         return self.flatten_instruments(self.imap)
 
     def get_part(self) -> Tuple[stream.Part, Dict]:
-        part, notemap = onetrack_to_part(self.tiny.value, self.parser, id=self)
+        self.document.update(self.tiny.value)
+        part, notemap = to_part(self.document.items, self)
         # tnc = tinyNotation.Converter(self.tiny.value)
         # tnc.parse()
         # part = tnc.stream
         part.insert(0, self.get_instrument())
         return part, notemap
 
+    def get_events(self) -> Tuple[List[NoteEvent], Dict]:
+        events, notemap, tempo_changes = self.compile()
+        return events, notemap
+
+    def get_tempo_changes(self) -> List[Tuple[float, float]]:
+        return self.compile()[2]
+
+    def get_program(self) -> int:
+        [group, name] = self.instrument.value.split(':')
+        return self.imap[(group, name)]
+
     def get_instrument(self) -> instrument.Instrument:
         [group, name] = self.instrument.value.split(':')
         inst = instrument.Instrument(self.instrument.value)
@@ -138,15 +336,39 @@ class Track():
 APSTATE_PAUSED = 'Paused'
 APSTATE_STOPPED = 'Stopped'
 APSTATE_PLAYING = 'Playing'
+APSTATE_COMPILING = 'Compiling'
+
+PARALLEL_MIN_TRACKS = 4  # fewer out of date tracks than this compile faster in process
+PREFIX_CHARS = 2000  # text of each out of date track compiled before playback starts
 
 
 class AudioPlayer():
-    def __init__(self, synth: Synth):
+    def __init__(self, synth: Synth, clock: Optional[Clock] = None):
         self.state = Observable(APSTATE_STOPPED)
         self.tempo = Observable(60)
         self.length = Observable(60000)
         self.cue_pos = Observable(0)
-        self.sequencer = MySequencer(synth)
+        self.loop = Observable(None)  # (start, end) in ms, or None to play to the end
+        self.sequencer = MySequencer(synth, clock=clock)
+        self.tracks = []  # type: List[Track]
+        self.notemaps = {}  # type: Dict[int, Dict[int, Tuple[Any, Track]]]  # location map of each track played
+        self.compiler = ThreadPoolExecutor(max_workers=1, thread_name_prefix='compile')
+        self.compile_lock = threading.Lock()
+        self.cancelled = threading.Event()
+        self.gates = Computed(self.muted_track_indices)
+        self.gates.invalidated.register(self.update_gates)
+
+        @self.tempo.changed.register
+        def tempo_changed(old_value, new_value):
+            if new_value:
+                self.sequencer.set_tempo(new_value)
+
+        @self.loop.changed.register
+        def loop_changed(old_value, new_value):
+            if new_value:
+                self.sequencer.set_loop(*new_value)
+            else:
+                self.sequencer.clear_loop()
 
         # from music21_addons.sequencer import MidoSynth
         # self.sequencer = MySequencer(MidoSynth(True))
@@ -165,35 +387,163 @@ class AudioPlayer():
         elif self.state.value == APSTATE_STOPPED:
             self.play(tracks, timesig, self.tempo.value)
 
-    def play(self, tracks, timesig, bpm):
-        parts = []
+    def play(self, tracks, timesig, bpm) -> Future:
+        """Compile the tracks on the compile thread and start playing as soon as their beginnings are ready.
+
+        Tracks with an up to date cache play in full straight away. For the
+        others only the first PREFIX_CHARS of text are compiled before
+        playback starts; each is then compiled in full and swapped into the
+        running playback. The state is APSTATE_COMPILING until playback
+        starts. Returns a future that resolves to True once every track is
+        playing in full, or to False if stop() or an edit cancelled it.
+        """
+        self.cancel_compile()
         self.tracks = tracks
-        solo_tracks = [t for t in tracks if t.soloed.value]
-        solo_track = None if len(solo_tracks) == 0 else solo_tracks[0]
-        for t in tracks:
-            part = t.get_part()
-            if t.muted.value or (solo_track and t != solo_track):
-                part = (part[0].template(), {})  # Remove all notes and fill with rests, empty map
-            parts.append(part)
-        if len(parts) > 0:
-            cmap = {}
-            score = stream.Score()
-            for p, map in parts:
-                score.insert(0, p)
-                cmap.update(map)
-
-            def now_playing(playing_list):
-                for obj in playing_list:
-                    (lobj, track) = cmap[id(obj)]
-                    track.now_playing(lobj)
-
-            def progress_update(position, length):
-                self.cue_pos.value = position
-                self.length.value = length
-
-            self.sequencer.play(score, bpm, now_playing, progress_update, self.finished)
+        self.gates.invalidate()
+        self.notemaps = {}
+        self.cancelled = cancelled = threading.Event()
+        snapshot = [(t, t.tiny.value, t.get_program(), t.cached(), t.compiled.version) for t in tracks]
+        self.state.value = APSTATE_COMPILING
+        future = self.compiler.submit(self.compile_and_play, snapshot, bpm, cancelled)
+
+        @future.add_done_callback
+        def compiled(f):
+            if f.exception() is not None:
+                logger.warning('Compiling for playback failed: %s', f.exception())
+                if self.state.value == APSTATE_COMPILING:
+                    self.state.value = APSTATE_STOPPED
+
+        return future
+
+    def cancel_compile(self):
+        with self.compile_lock:
+            self.cancelled.set()
+
+    def compile_and_play(self, snapshot, bpm, cancelled: threading.Event) -> bool:
+        """Runs on the compile thread: see play."""
+        parts = []
+        stale = []
+        silent = set()
+        for i, (track, text, program, cached, version) in enumerate(snapshot):
+            if cached is None:
+                stale.append(i)
+                prefix, error = try_compile_onetrack(onetrack_prefix(text, PREFIX_CHARS))
+                if prefix is None:
+                    logger.warning('Track %d does not parse, it plays silent: %s', i + 1, error)
+                    silent.add(i)
+                cached = track.unpack(prefix if prefix is not None else pack_events([], []))
+            parts.append(cached)
+            if cancelled.is_set():
+                return False
+        self.start_playback([(snap[2], part) for snap, part in zip(snapshot, parts)], bpm, cancelled)
+
+        texts = [snapshot[i][1] for i in stale]
+        if len(stale) >= PARALLEL_MIN_TRACKS:
+            full = compile_tracks(texts)
+        else:
+            full = (try_compile_onetrack(text) for text in texts)
+        for i, (compiled, error) in zip(stale, full):
+            if cancelled.is_set():
+                return False
+            track, text, program, cached, version = snapshot[i]
+            if compiled is None and i not in silent:
+                logger.warning('Track %d does not parse, only its start plays: %s', i + 1, error)
+            if compiled is None or track.tiny.value != text:
+                continue  # Keeps playing the prefix, or track_edited has swapped in the new text already
+            parts[i] = events, notemap, tempo_changes = track.use_compiled(version, compiled)
+            self.notemaps[i] = notemap
+            self.sequencer.replace_track(i, program, events)
+        if stale:
+            self.sequencer.set_tempo_map(TempoMap(self.tempo.value, [c for part in parts for c in part[2]]))
+        return True
+
+    def start_playback(self, parts, bpm, cancelled: threading.Event):
+        """Play (program, (events, location map, tempo changes)) per track, unless cancelled."""
+        self.notemaps = {i: part[1] for i, (program, part) in enumerate(parts)}
+
+        def now_playing(playing_list):
+            notemaps = list(self.notemaps.values())
+            for obj in playing_list:
+                for notemap in notemaps:
+                    located = notemap.get(id(obj))
+                    if located is not None:  # None for an update from the playback this one replaced
+                        lobj, track = located
+                        track.now_playing(lobj)
+                        break
+
+        def progress_update(position, length):
+            self.cue_pos.value = position
+            self.length.value = length
+
+        with self.compile_lock:
+            if cancelled.is_set():
+                return
+            self.update_gates()
+            self.sequencer.play_events([(program, part[0]) for program, part in parts],
+                                       TempoMap(bpm, [c for program, part in parts for c in part[2]]),
+                                       now_playing, progress_update, self.finished)
             self.state.value = APSTATE_PLAYING
 
+    def precompile(self, tracks):
+        """Compile the tracks whose cache is out of date, in parallel on the compile pool."""
+        stale = [(t, t.compiled.version) for t in tracks if t.compiled.peek() is None]
+        if len(stale) < PARALLEL_MIN_TRACKS:
+            return
+        for (t, version), (compiled, error) in zip(stale, compile_tracks([t.tiny.value for t, version in stale])):
+            if compiled is not None:
+                t.use_compiled(version, compiled)
+
+    def watch(self, track: Track):
+        """Update the sequencer's gates whenever ``track`` is muted, unmuted, soloed or unsoloed."""
+        self.gates.depend_on(track.muted, track.soloed)
+
+    def muted_track_indices(self) -> frozenset:
+        """Tracks to silence: the muted ones, and the ones not soloed if there are any soloed."""
+        soloing = any(t.soloed.value for t in self.tracks)
+        return frozenset(i for i, t in enumerate(self.tracks) if t.muted.value or (soloing and not t.soloed.value))
+
+    def update_gates(self):
+        self.sequencer.set_muted_tracks(self.gates.value)
+
+    def track_edited(self, track):
+        """Swap the edited track into the running playback, leaving the other tracks alone.
+
+        An edit while the playback is still compiling starts the compile again.
+        """
+        if self.state.value == APSTATE_STOPPED or track not in self.tracks:
+            return
+        if self.state.value == APSTATE_COMPILING:
+            self.play(self.tracks, None, self.tempo.value)
+            return
+        try:
+            events, notemap = track.get_events()
+        except LarkError:
+            return  # Keep playing the last version that parsed
+        index = self.tracks.index(track)
+        self.notemaps[index] = notemap
+        # replace_track builds the new timeline, which takes a while for a long piece: keep it off the Tk thread
+        future = self.compiler.submit(self.sequencer.replace_track, index, track.get_program(), events)
+
+        @future.add_done_callback
+        def replaced(f):
+            if f.exception() is not None:
+                logger.warning('Swapping edited track %d into playback failed: %s', index + 1, f.exception())
+
+    def compile(self, tracks, bpm) -> Tuple[Timeline, TempoMap]:
+        """Timeline and tempo map of all the tracks, muted or not."""
+        self.precompile(tracks)
+        tempo_changes = [change for t in tracks for change in t.get_tempo_changes()]
+        timeline = self.sequencer.get_to_play_events([(t.get_program(), t.get_events()[0]) for t in tracks])
+        return timeline, TempoMap(bpm, tempo_changes)
+
+    def render(self, tracks, bpm, path, soundfont_file, stems=False) -> Dict[str, float]:
+        """Render the tracks to a WAV file at ``path`` (and one per track with ``stems``)."""
+        timeline, tempo_map = self.compile(tracks, bpm)
+        return render_wav(timeline, tempo_map, path, lambda: FluidBlockSynth(soundfont_file), stems=stems)
+
+    def export_midi(self, tracks, bpm, path):
+        write_smf(*self.compile(tracks, bpm), path)
+
     # def monitor(self):
     #     while self.sp and self.sp.pygame.mixer.music.get_busy():
     #         print("pos", self.sp.pygame.mixer.music.get_pos())
@@ -212,13 +562,23 @@ class AudioPlayer():
             self.sequencer.unpause()
 
     def stop(self):
-        self.sequencer.stop()
+        with self.compile_lock:
+            self.cancelled.set()
+            self.sequencer.stop()
         self.state.value = APSTATE_STOPPED
 
+    def seek(self, pos):
+        self.sequencer.seek(pos)
+        self.cue_pos.value = pos
+
     def finished(self, dummy=None):
         # print("Finished")
-        self.cue_pos.value = 0
-        self.state.value = APSTATE_STOPPED
+        # The lock makes a short piece that ends straight away wait for start_playback to set the state
+        with self.compile_lock:
+            if self.state.value == APSTATE_COMPILING:
+                return  # The end of the playback before, reported while the next one compiles
+            self.cue_pos.value = 0
+            self.state.value = APSTATE_STOPPED
         if self.tracks:
             for t in self.tracks:
                 t.now_playing(None)
@@ -237,11 +597,40 @@ class MultiTrack():
         new_track = Track(self.timesig, self.key,
                           self.player.sequencer.synth.get_instrument_map())
         self.tracks.append(new_track)
+        new_track.tiny.changed.register(lambda old, new: self.player.track_edited(new_track))
+        new_track.instrument.changed.register(lambda old, new: self.player.track_edited(new_track))
+        self.player.watch(new_track)
         self.gui.track_added(self, new_track)
         new_track.instrument.value = new_track.get_instrument_names()[0]
 
     def play(self):
         self.player.play_or_pause(self.tracks, self.timesig)
 
+    def render(self, path, soundfont_file, stems=False):
+        return self.player.render(self.tracks, self.player.tempo.value, path, soundfont_file, stems)
+
+    def export_midi(self, path):
+        self.player.export_midi(self.tracks, self.player.tempo.value, path)
+
+    def load(self, tracks: List[Tuple[str, str, bool, bool]]):
+        """Add a track for every (instrument, text, muted, soloed), in one transaction."""
+        with transaction():
+            for instrument_name, text, muted, soloed in tracks:
+                self.add_track()
+                track = self.tracks[-1]
+                if instrument_name:
+                    track.instrument.value = instrument_name
+                track.tiny.value = text
+                track.muted.value = muted
+                track.soloed.value = soloed
+
+    def import_midi(self, path):
+        """Add a track for every piece read_smf splits a MIDI file into."""
+        imap = self.player.sequencer.synth.get_instrument_map()
+        names = {}  # type: Dict[int, str]
+        for (group, name), program in imap.items():
+            names.setdefault(program, f'{group}:{name}')
+        self.load([(names.get(program, ''), text, False, False) for vchan, program, text in read_smf(path)])
+
     def stop(self):
         self.player.stop()
@@ -0,0 +1,68 @@
+import time
+from tkinter import Canvas, Text, Widget
+from typing import Dict, Optional, Tuple
+
+from composition.application import Observable
+from gui.tk_dispatcher import TkDispatcher
+
+TAG = 'playing'
+
+Location = Tuple[int, int, int, int]  # start line, start column, end line, end column, columns from 1
+
+
+def text_range(location: Location) -> Tuple[str, str]:
+    sl, sc, el, ec = location
+    return f'{sl}.{sc - 1}', f'{el}.{ec - 1}'
+
+
+class NowPlayingHighlighter():
+    """Draws the now-playing highlight of every track once per frame.
+
+    Tracks only record the item they are on as it changes; after each
+    dispatcher frame, the highlights of the tracks that changed are moved
+    in one pass. The ``playing`` tag is configured once per text widget and
+    then only moved; it is removed wherever it is, since it moves with the
+    text when the track is edited during playback. Tracks scrolled out of the ``canvas`` view are left
+    alone until they come back into view. ``busy_ns`` adds up the time spent
+    drawing, ``moves`` and ``frames`` count the tag moves and the frames that
+    had any.
+    """
+
+    def __init__(self, dispatcher: TkDispatcher, canvas: Canvas):
+        self.canvas = canvas
+        self.pending = {}  # type: Dict[Text, Tuple[Widget, Optional[Location]]]
+        self.busy_ns = 0
+        self.moves = 0
+        self.frames = 0
+        self.dispatcher = dispatcher
+        dispatcher.on_frame(self.draw)
+
+    def connect(self, on_item: Observable, text: Text, frame: Widget):
+        """Highlight ``on_item`` in ``text``; ``frame`` is the widget whose position in the canvas decides
+        whether the track is in view."""
+        text.tag_config(TAG, background="yellow", foreground="black")
+
+        @self.dispatcher.observe(on_item)
+        def playing_item_changed(old_value, new_value):
+            self.pending[text] = (frame, new_value)
+
+    def visible_range(self) -> Tuple[float, float]:
+        top = self.canvas.canvasy(0)
+        return top, top + self.canvas.winfo_height()
+
+    def draw(self):
+        if not self.pending:
+            return
+        start = time.perf_counter_ns()
+        top, bottom = self.visible_range()
+        for text, (frame, location) in list(self.pending.items()):
+            y = frame.winfo_y()
+            if y + frame.winfo_height() < top or y > bottom:
+                continue
+            del self.pending[text]
+            text.tag_remove(TAG, '1.0', 'end')
+            if location is not None:
+                text.tag_add(TAG, *text_range(location))
+            self.moves += 1
+        self.frames += 1
+        self.busy_ns += time.perf_counter_ns() - start
@@ -1,21 +1,60 @@
+import difflib
+import re
 import tkinter as tk
+from itertools import accumulate
+from typing import List, Tuple
+
+from music21_addons.onetrack import text_diff
+
+DEBOUNCE_MS = 100
+TOKEN = re.compile(r'\s+|\S+')
+MAX_DIFF_TOKENS = 2000  # larger changed regions are replaced in one edit
+
+
+def token_edits(old, new) -> List[Tuple[int, str, str]]:
+    '''(position, removed, inserted) edits turning ``old`` into ``new`` token by token, last edit first.
+
+    Only the region between the common prefix and suffix is diffed, so
+    applying the edits in order leaves every unchanged token in place.
+    '''
+    pos, removed, inserted = text_diff(old, new)
+    a, b = TOKEN.findall(removed), TOKEN.findall(inserted)
+    if len(a) + len(b) > MAX_DIFF_TOKENS:
+        return [(pos, removed, inserted)] if removed or inserted else []
+    starts = [pos + n for n in accumulate((len(t) for t in a), initial=0)]
+    edits = [(starts[i1], ''.join(a[i1:i2]), ''.join(b[j1:j2]))
+             for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes()
+             if tag != 'equal']
+    return edits[::-1]
 
 
 class TextWithVar(tk.Text):
-    '''A text widget that accepts a 'textvariable' option'''
+    '''A text widget that accepts a 'textvariable' option
+
+    Typing is passed on after a pause of ``debounce_ms``: ``on_edit`` (if
+    set) gets the (position, removed, inserted) edit since the last time,
+    then the variable gets the whole text. A new value of the variable is
+    applied to the widget as the smallest token edits, which keeps the
+    cursor, marks and undo history of the unchanged text.
+    '''
 
     def __init__(self, parent, *args, **kwargs):
         try:
             self._textvariable = kwargs.pop("textvariable")
         except KeyError:
             self._textvariable = None
+        self.on_edit = kwargs.pop("on_edit", None)
+        self.debounce_ms = kwargs.pop("debounce_ms", DEBOUNCE_MS)
+        self._flush_id = None
+        self._synced = ''
 
         tk.Text.__init__(self, parent, *args, **kwargs)
 
         # if the variable has data in it, use it to initialize
         # the widget
         if self._textvariable is not None:
-            self.insert("1.0", self._textvariable.get())
+            self._synced = self._textvariable.get()
+            self.insert("1.0", self._synced)
 
         # this defines an internal proxy which generates a
         # virtual event whenever text is inserted or deleted
@@ -54,17 +93,36 @@ class TextWithVar(tk.Text):
 
         # only change the widget if something actually
         # changed, otherwise we'll get into an endless
-        # loop
+        # loop; the new value wins over typing not passed on yet
         text_current = self.get("1.0", "end-1c")
         var_current = self._textvariable.get()
+        self._synced = var_current
         if text_current != var_current:
-            self.delete("1.0", "end")
-            self.insert("1.0", var_current)
+            for pos, removed, inserted in token_edits(text_current, var_current):
+                start = f'1.0 + {pos} chars'
+                self.delete(start, f'1.0 + {pos + len(removed)} chars')
+                self.insert(start, inserted)
 
     def _on_widget_change(self, event=None):
-        '''Change the variable when the widget changes'''
+        '''Pass the change on once typing pauses'''
+        if self._flush_id is not None:
+            self.after_cancel(self._flush_id)
+        self._flush_id = self.after(self.debounce_ms, self.flush)
+
+    def flush(self):
+        '''Pass on the edit since the last flush now'''
+        if self._flush_id is not None:
+            self.after_cancel(self._flush_id)
+            self._flush_id = None
+        text = self.get("1.0", "end-1c")
+        if text == self._synced:
+            return
+        edit = text_diff(self._synced, text)
+        self._synced = text
+        if self.on_edit is not None:
+            self.on_edit(*edit)
         if self._textvariable is not None:
-            self._textvariable.set(self.get("1.0", "end-1c"))
+            self._textvariable.set(text)
 
 
 class Example(tk.Frame):
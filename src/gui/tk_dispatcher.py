@@ -0,0 +1,75 @@
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Tuple
+
+from composition.application import Observable
+
+logger = logging.getLogger(__name__)
+
+FRAME_MS = 16  # pump interval, about one display frame
+
+
+class TkDispatcher():
+    """Runs Observable callbacks on the Tk main loop, however many threads set the observables.
+
+    A change made on the Tk thread is handled straight away. A change made on
+    any other thread is queued, and a single ``after()`` pump on the Tk thread
+    runs the queue once per frame. Changes queued for the same callback in
+    the meantime collapse into one, from the first old value to the latest
+    new value, so a burst of updates from playback costs one widget update
+    per frame. Callbacks added with ``on_frame`` run after every frame's
+    updates. A callback that raises is logged, and the frame carries on.
+    """
+
+    def __init__(self, widget, frame_ms=FRAME_MS):
+        self.widget = widget
+        self.frame_ms = frame_ms
+        self.tk_thread = threading.get_ident()
+        self.lock = threading.Lock()
+        self.pending = {}  # type: Dict[int, Tuple[Callable, Any, Any]]
+        self.dispatched = 0
+        self.collapsed = 0
+        self.frame_callbacks = []  # type: List[Callable[[], None]]
+        self.widget.after(self.frame_ms, self.pump)
+
+    def observe(self, obs: Observable) -> Callable[[Callable], Callable]:
+        """Decorator registering an (old_value, new_value) callback on ``obs`` that runs on the Tk thread."""
+        def register(callback):
+            obs.changed.register(lambda old_value, new_value: self.post(callback, old_value, new_value))
+            return callback
+
+        return register
+
+    def on_frame(self, callback: Callable[[], None]):
+        self.frame_callbacks.append(callback)
+
+    def post(self, callback, old_value, new_value):
+        key = id(callback)
+        if threading.get_ident() == self.tk_thread:
+            with self.lock:
+                queued = self.pending.pop(key, None)
+            callback(queued[1] if queued else old_value, new_value)
+            self.dispatched += 1
+            return
+        with self.lock:
+            queued = self.pending.get(key)
+            if queued:
+                old_value = queued[1]
+                self.collapsed += 1
+            self.pending[key] = (callback, old_value, new_value)
+
+    def pump(self):
+        self.widget.after(self.frame_ms, self.pump)
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for callback, old_value, new_value in pending.values():
+            self.safe_call(callback, old_value, new_value)
+        self.dispatched += len(pending)
+        for frame_callback in self.frame_callbacks:
+            self.safe_call(frame_callback)
+
+    def safe_call(self, fn, *args):
+        try:
+            fn(*args)
+        except Exception as e:
+            logger.exception(e, exc_info=True)
@@ -0,0 +1,139 @@
+from typing import Dict, List, Optional, Tuple
+
+from music21_addons.events import NoteEvent
+
+CHANNELS_PER_PORT = 16
+PORT_CHANNELS = [0, 1, 2, 3, 4, 5, 6, 7, 8, 10, 11, 12, 13, 14, 15]  # channel 9 is left to percussion
+MAX_PORTS = 16  # virtual channels must fit the u1 chan column of a timeline
+
+
+def virtual_channel(port, chan) -> int:
+    return port * CHANNELS_PER_PORT + chan
+
+
+def split_channel(vchan) -> Tuple[int, int]:
+    """(port, channel) of a virtual channel."""
+    return vchan // CHANNELS_PER_PORT, vchan % CHANNELS_PER_PORT
+
+
+def note_spans(events: List[NoteEvent]) -> Dict[int, List[Tuple[float, float]]]:
+    """(start, end) beats of the notes of ``events``, by pitch."""
+    spans = {}  # type: Dict[int, List[Tuple[float, float]]]
+    for ev in sorted(events, key=lambda ev: ev.offset):
+        for pitch in ev.pitches:
+            spans.setdefault(pitch, []).append((ev.offset, ev.offset + ev.duration))
+    return spans
+
+
+def notes_span(notes: Dict[int, List[Tuple[float, float]]]) -> Optional[Tuple[float, float]]:
+    if not notes:
+        return None
+    return (min(spans[0][0] for spans in notes.values()),
+            max(end for spans in notes.values() for start, end in spans))
+
+
+def pitches_clash(a: Dict[int, List[Tuple[float, float]]], b: Dict[int, List[Tuple[float, float]]]) -> bool:
+    """Whether the two sets of notes sound the same pitch at the same time."""
+    for pitch in a.keys() & b.keys():
+        ends = [float('-inf'), float('-inf')]
+        for start, end, which in sorted([(start, end, 0) for start, end in a[pitch]] +
+                                        [(start, end, 1) for start, end in b[pitch]]):
+            if start < ends[1 - which]:
+                return True
+            ends[which] = max(ends[which], end)
+    return False
+
+
+class ChannelMap():
+    """Which virtual channel (``port * 16 + channel``) every track plays on.
+
+    Every track gets a channel of its own while the port being filled has
+    channels left. Once it is full, a track shares a channel if it fits next
+    to the tracks already there: tracks of the same program must never sound
+    the same pitch at the same time, and tracks of other programs must not
+    sound at all while it does. ``track_notes`` holds the notes of each track
+    by pitch (see note_spans) to check that. Tracks without notes get no
+    channel (-1).
+    """
+
+    def __init__(self, track_channels: List[int], track_programs: List[int],
+                 track_notes: List[Dict[int, List[Tuple[float, float]]]]):
+        self.track_channels = track_channels
+        self.track_programs = track_programs
+        self.track_notes = track_notes
+
+    @property
+    def channels(self) -> List[int]:
+        """The virtual channels in use."""
+        return sorted(set(vchan for vchan in self.track_channels if vchan >= 0))
+
+    @property
+    def num_ports(self) -> int:
+        return max((vchan // CHANNELS_PER_PORT for vchan in self.channels), default=0) + 1
+
+    def fits(self, program, notes: Dict[int, List[Tuple[float, float]]], tracks: List[int]) -> bool:
+        """Whether a track of ``program`` playing ``notes`` can share a channel with ``tracks``."""
+        start, end = notes_span(notes)
+        for track in tracks:
+            span = notes_span(self.track_notes[track])
+            if span is None or not (start < span[1] and span[0] < end):
+                continue
+            if program != self.track_programs[track] or pitches_clash(notes, self.track_notes[track]):
+                return False
+        return True
+
+    def with_track(self, track, program, events: List[NoteEvent]) -> Optional['ChannelMap']:
+        """The map after ``track`` changes to ``events``, or None if that needs a new allocation."""
+        vchan = self.track_channels[track]
+        notes = note_spans(events)
+        if not notes:
+            return self
+        if vchan < 0 or program != self.track_programs[track]:
+            return None
+        others = [other for other, other_vchan in enumerate(self.track_channels)
+                  if other_vchan == vchan and other != track]
+        if not self.fits(program, notes, others):
+            return None
+        track_notes = list(self.track_notes)
+        track_notes[track] = notes
+        return ChannelMap(self.track_channels, self.track_programs, track_notes)
+
+    def report(self) -> str:
+        lines = [f'{len(self.track_channels)} tracks on {len(self.channels)} channels, '
+                 f'{self.num_ports} port(s):']
+        for track, (vchan, program) in enumerate(zip(self.track_channels, self.track_programs)):
+            if vchan < 0:
+                lines.append(f'  track {track:3d}: no notes')
+            else:
+                port, chan = split_channel(vchan)
+                lines.append(f'  track {track:3d}: port {port} ch {chan:2d} program {program}')
+        return '\n'.join(lines)
+
+
+def allocate_channels(tracks: List[Tuple[int, List[NoteEvent]]]) -> ChannelMap:
+    """Give every (program, events) track a virtual channel.
+
+    Tracks are placed by start beat. A track opens a new channel while the
+    last port opened has channels left; after that it goes on the first
+    channel it fits (see ChannelMap), and only opens a new port if it fits
+    none.
+    """
+    track_notes = [note_spans(events) for program, events in tracks]
+    cmap = ChannelMap([-1] * len(tracks), [program for program, events in tracks], track_notes)
+    channel_tracks = {}  # type: Dict[int, List[int]]
+    placed = sorted((track for track, notes in enumerate(track_notes) if notes),
+                    key=lambda track: (notes_span(track_notes[track])[0], track))
+    for track in placed:
+        n = len(channel_tracks)
+        vchan = None
+        if n and n % len(PORT_CHANNELS) == 0:
+            vchan = next((c for c, others in channel_tracks.items()
+                          if cmap.fits(cmap.track_programs[track], track_notes[track], others)), None)
+        if vchan is None:
+            port = n // len(PORT_CHANNELS)
+            if port >= MAX_PORTS:
+                raise ValueError(f'More than {MAX_PORTS * len(PORT_CHANNELS)} channels needed')
+            vchan = virtual_channel(port, PORT_CHANNELS[n % len(PORT_CHANNELS)])
+        channel_tracks.setdefault(vchan, []).append(track)
+        cmap.track_channels[track] = vchan
+    return cmap
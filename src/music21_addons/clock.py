@@ -0,0 +1,62 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Optional
+
+NS_PER_SEC = 1000000000
+NS_PER_MS = 1000000
+
+
+class Clock(ABC):
+
+    @abstractmethod
+    def now_ns(self) -> int:
+        pass
+
+    @abstractmethod
+    def sleep_until(self, deadline_ns: int, interrupt: Optional[threading.Event] = None) -> bool:
+        """Wait until ``deadline_ns``. Returns False if ``interrupt`` was set before the deadline."""
+        pass
+
+
+class MonotonicClock(Clock):
+    """Real-time clock on ``time.perf_counter_ns``, which is monotonic and has the best resolution on every platform.
+
+    Waits sleep until ``spin_ns`` before the deadline and busy-wait the rest,
+    since OS sleeps routinely overshoot by a millisecond or more.
+    """
+
+    def __init__(self, spin_ns=NS_PER_MS):
+        self.spin_ns = spin_ns
+
+    def now_ns(self) -> int:
+        return time.perf_counter_ns()
+
+    def sleep_until(self, deadline_ns: int, interrupt: Optional[threading.Event] = None) -> bool:
+        remaining = deadline_ns - time.perf_counter_ns() - self.spin_ns
+        if remaining > 0:
+            if interrupt is not None:
+                if interrupt.wait(remaining / NS_PER_SEC):
+                    return False
+            else:
+                time.sleep(remaining / NS_PER_SEC)
+        while time.perf_counter_ns() < deadline_ns:
+            if interrupt is not None and interrupt.is_set():
+                return False
+        return True
+
+
+class VirtualClock(Clock):
+    """Clock that jumps straight to each deadline, for running the sequencer faster than real time."""
+
+    def __init__(self, start_ns=0):
+        self.t = start_ns
+
+    def now_ns(self) -> int:
+        return self.t
+
+    def sleep_until(self, deadline_ns: int, interrupt: Optional[threading.Event] = None) -> bool:
+        if interrupt is not None and interrupt.is_set():
+            return False
+        self.t = max(self.t, deadline_ns)
+        return True
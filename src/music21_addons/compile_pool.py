@@ -0,0 +1,113 @@
+import multiprocessing
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+from lark.exceptions import LarkError
+
+from music21_addons.events import NoteEvent
+from music21_addons.onetrack import Located, parse_onetrack, to_events, to_tempo_changes
+
+_pool = None  # type: Optional[ProcessPoolExecutor]
+_pool_lock = threading.Lock()
+
+
+class CompiledTrack():
+    """The events and tempo changes of one onetrack text, as flat arrays that pickle cheaply.
+
+    Event ``i`` plays ``pitches[pitch_starts[i]:pitch_starts[i + 1]]`` and was
+    compiled from the item at ``locations[i]`` (start line, start column,
+    end line, end column) of the text.
+    """
+
+    def __init__(self, offsets: np.ndarray, durations: np.ndarray, velocities: np.ndarray,
+                 pitch_starts: np.ndarray, pitches: np.ndarray, locations: np.ndarray,
+                 tempo_changes: List[Tuple[float, float]]):
+        self.offsets = offsets
+        self.durations = durations
+        self.velocities = velocities
+        self.pitch_starts = pitch_starts
+        self.pitches = pitches
+        self.locations = locations
+        self.tempo_changes = tempo_changes
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def events(self) -> List[NoteEvent]:
+        """The NoteEvents again, each with a Located source holding the location of its item."""
+        bounds = self.pitch_starts.tolist()
+        pitches = self.pitches.tolist()
+        return [NoteEvent(offset, duration, tuple(pitches[bounds[i]:bounds[i + 1]]), velocity, Located(*location))
+                for i, (offset, duration, velocity, location) in enumerate(zip(
+                    self.offsets.tolist(), self.durations.tolist(), self.velocities.tolist(),
+                    self.locations.tolist()))]
+
+
+def pack_events(events: List[NoteEvent], tempo_changes: List[Tuple[float, float]]) -> CompiledTrack:
+    n = len(events)
+    npitches = np.fromiter((len(ev.pitches) for ev in events), dtype=np.intp, count=n)
+    return CompiledTrack(
+        np.fromiter((ev.offset for ev in events), dtype='f8', count=n),
+        np.fromiter((ev.duration for ev in events), dtype='f8', count=n),
+        np.fromiter((ev.velocity for ev in events), dtype='u1', count=n),
+        np.r_[0, np.cumsum(npitches)],
+        np.fromiter((p for ev in events for p in ev.pitches), dtype='u1', count=int(npitches.sum())),
+        np.array([ev.source.location() for ev in events], dtype='i4').reshape(n, 4),
+        tempo_changes)
+
+
+def compile_onetrack(text) -> CompiledTrack:
+    """Parse onetrack text and compile it to a CompiledTrack. Runs in the worker processes."""
+    items = parse_onetrack(text)
+    return pack_events(to_events(items), to_tempo_changes(items))
+
+
+def try_compile_onetrack(text) -> Tuple[Optional[CompiledTrack], Optional[str]]:
+    """(compile_onetrack, None), or (None, the parse error) if the text does not parse."""
+    try:
+        return compile_onetrack(text), None
+    except LarkError as e:
+        return None, str(e)
+
+
+def onetrack_prefix(text, chars) -> str:
+    """The items of ``text`` within its first ``chars`` characters, or all of it if it is shorter.
+
+    The text is cut at the last whitespace in range that is not inside a chord.
+    """
+    if len(text) <= chars:
+        return text
+    head = text[:chars]
+    cut = max(head.rfind(c) for c in ' \t\r\n')
+    chord = head.rfind('[', 0, cut)
+    if chord > head.rfind(']', 0, cut):
+        cut = chord
+    return text[:max(cut, 0)]
+
+
+def compile_pool() -> ProcessPoolExecutor:
+    """Return the process-wide pool of compile workers, one per core, started on first use.
+
+    Workers are spawned rather than forked, since the application forking
+    itself would copy its playback and synth threads' state.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def compile_tracks(texts: List[str], executor: Optional[Executor] = None) \
+        -> Iterator[Tuple[Optional[CompiledTrack], Optional[str]]]:
+    """Compile onetrack texts on ``executor`` (the shared compile pool by default), in parallel.
+
+    Results are yielded in the order of ``texts`` as they become ready, as
+    try_compile_onetrack returns them. Closing the iterator early cancels the
+    compiles that have not started.
+    """
+    executor = executor if executor is not None else compile_pool()
+    return executor.map(try_compile_onetrack, texts)
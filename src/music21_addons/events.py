@@ -0,0 +1,44 @@
+from dataclasses import dataclass
+from typing import Tuple, Any, List
+
+from music21 import stream, note, chord
+
+DEFAULT_VELOCITY = 60
+
+
+@dataclass
+class NoteEvent():
+    """A note or chord ready for playback: offsets and durations are in quarter notes, pitches are midi numbers
+    and velocity is the midi velocity sent for each pitch."""
+    offset: float
+    duration: float
+    pitches: Tuple[int, ...]
+    velocity: int
+    source: Any = None
+
+
+def compute_velocity(volume, default):
+    if volume is None or volume.velocity is None:
+        return default
+    else:
+        return volume.velocity
+
+
+def part_to_events(part: stream.Part) -> List[NoteEvent]:
+    events = []
+    for ncr in part.flat.getElementsByClass(['Note', 'Chord']):
+        if isinstance(ncr, note.Note):
+            velocity = compute_velocity(ncr.volume, DEFAULT_VELOCITY)
+            pitches = (ncr.pitch.midi,)
+        elif isinstance(ncr, chord.Chord):
+            num_pitches = len(ncr.pitches)
+            chord_velocity = compute_velocity(ncr.volume, None)
+            if chord_velocity is not None:
+                velocity = int(chord_velocity / num_pitches)
+            else:
+                velocity = compute_velocity(ncr.notes[0].volume, DEFAULT_VELOCITY / num_pitches)
+            pitches = tuple(p.midi for p in ncr.pitches)
+        else:
+            continue
+        events.append(NoteEvent(float(ncr.offset), float(ncr.quarterLength), pitches, int(velocity), ncr))
+    return events
@@ -0,0 +1,93 @@
+import logging
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Histogram bin edges, in microseconds
+LATENCY_BINS_US = np.array([0, 50, 100, 250, 500, 1000, 2000, 5000, 10000, 50000, np.inf])
+
+RECORD_DTYPE = np.dtype([
+    ('scheduled', 'i8'),  # clock time the event was due, ns
+    ('sent', 'i8'),  # clock time the synth call was made, ns
+    ('call', 'i8'),  # time spent inside the synth call, ns
+    ('chan', 'u1'),
+    ('backend', 'u1'),  # index into PlaybackStats.backends
+])
+
+
+class PlaybackStats():
+    """Per-event playback timing kept in a preallocated ring buffer.
+
+    Recording an event is a single row write, cheap enough to leave enabled.
+    Only the most recent ``capacity`` events are kept; histograms and
+    summaries are computed from them on demand.
+    """
+
+    def __init__(self, capacity=1 << 16):
+        self.records = np.zeros(capacity, dtype=RECORD_DTYPE)
+        self.capacity = capacity
+        self.count = 0
+        self.backends = []  # type: List[str]
+
+    def backend_id(self, name) -> int:
+        if name not in self.backends:
+            self.backends.append(name)
+        return self.backends.index(name)
+
+    def record(self, scheduled_ns, sent_ns, call_ns, chan, backend):
+        self.records[self.count % self.capacity] = (scheduled_ns, sent_ns, call_ns, chan, backend)
+        self.count += 1
+
+    def clear(self):
+        self.count = 0
+
+    def recent(self) -> np.ndarray:
+        return self.records[:min(self.count, self.capacity)]
+
+    def groups(self) -> Dict[Tuple[str, int], np.ndarray]:
+        rows = self.recent()
+        keys = np.unique(rows[['backend', 'chan']])
+        return {(self.backends[b], c): rows[(rows['backend'] == b) & (rows['chan'] == c)]
+                for b, c in keys.tolist()}
+
+    def histograms(self) -> Dict[Tuple[str, int], Dict[str, np.ndarray]]:
+        """Counts per LATENCY_BINS_US bin of lateness (sent - scheduled) and synth call time, per (backend, channel)."""
+        hists = {}
+        for key, rows in self.groups().items():
+            lateness_us = (rows['sent'] - rows['scheduled']) / 1000
+            hists[key] = {
+                'lateness': np.histogram(lateness_us, LATENCY_BINS_US)[0],
+                'call': np.histogram(rows['call'] / 1000, LATENCY_BINS_US)[0],
+            }
+        return hists
+
+    def summary(self) -> Dict[Tuple[str, int], Dict[str, float]]:
+        """Event count, lateness percentiles and jitter (std of lateness) in microseconds, per (backend, channel)."""
+        result = {}
+        for key, rows in self.groups().items():
+            lateness_us = (rows['sent'] - rows['scheduled']) / 1000
+            p50, p99 = np.percentile(lateness_us, [50, 99])
+            result[key] = {
+                'events': len(rows),
+                'lateness_p50': float(p50),
+                'lateness_p99': float(p99),
+                'lateness_max': float(lateness_us.max()),
+                'jitter': float(lateness_us.std()),
+                'call_p99': float(np.percentile(rows['call'] / 1000, 99)),
+            }
+        return result
+
+    def report(self) -> str:
+        lines = [f'Playback timing, last {len(self.recent())} of {self.count} events (us):']
+        for (backend, chan), s in sorted(self.summary().items()):
+            lines.append(f'  {backend} ch{chan:2d}: {s["events"]:7d} events  late p50 {s["lateness_p50"]:8.1f}  '
+                         f'p99 {s["lateness_p99"]:8.1f}  max {s["lateness_max"]:8.1f}  jitter {s["jitter"]:8.1f}  '
+                         f'call p99 {s["call_p99"]:8.1f}')
+        return '\n'.join(lines)
+
+    def dump(self):
+        """Log the report at INFO level; it is only built if that level is enabled."""
+        if self.count and logger.isEnabledFor(logging.INFO):
+            logger.info(self.report())
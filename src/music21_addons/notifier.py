@@ -0,0 +1,86 @@
+import logging
+import queue
+import threading
+import time
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+_UPDATE = 0
+_CALL = 1
+_CLOSE = 2
+
+
+class PlaybackNotifier():
+    """Delivers playback state to UI callbacks from a single long-lived thread.
+
+    The playback loop posts updates and calls without ever blocking: an
+    update is dropped when ``maxsize`` entries are already queued, while
+    calls are always queued. The notifier thread only delivers the latest
+    of the updates queued since its last delivery, and no more than
+    ``max_rate`` times per second. Calls posted with ``call`` are run in
+    order, after the updates posted before them.
+    """
+
+    def __init__(self, deliver: Callable, max_rate=30, maxsize=256):
+        self.deliver = deliver
+        self.min_interval = 1 / max_rate
+        self.maxsize = maxsize
+        self.queue = queue.Queue()  # type: queue.Queue
+        self.posted = 0
+        self.delivered = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.run, name='playback-notifier', daemon=True)
+        self.thread.start()
+
+    def post(self, *args):
+        self.posted += 1
+        if self.queue.qsize() >= self.maxsize:
+            self.dropped += 1
+            return
+        self.queue.put_nowait((_UPDATE, None, args))
+
+    def call(self, fn: Callable, *args):
+        self.queue.put_nowait((_CALL, fn, args))
+
+    def close(self):
+        self.queue.put((_CLOSE, None, ()))
+        self.thread.join()
+
+    def stats(self):
+        return {'posted': self.posted, 'delivered': self.delivered,
+                'coalesced': self.coalesced, 'dropped': self.dropped}
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            latest = None
+            for kind, fn, args in batch:
+                if kind == _UPDATE:
+                    if latest is not None:
+                        self.coalesced += 1
+                    latest = args
+                    continue
+                if latest is not None:
+                    self.safe_deliver(self.deliver, latest)
+                    latest = None
+                if kind == _CLOSE:
+                    return
+                self.safe_deliver(fn, args)
+            if latest is not None:
+                self.safe_deliver(self.deliver, latest)
+                time.sleep(self.min_interval)
+
+    def safe_deliver(self, fn, args):
+        try:
+            fn(*args)
+        except Exception as e:
+            logger.exception(e, exc_info=True)
+        if fn is self.deliver:
+            self.delivered += 1
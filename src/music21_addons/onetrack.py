@@ -1,10 +1,15 @@
+import bisect
 import fractions
 import os
+import threading
 from dataclasses import dataclass
 from typing import Optional, List, Dict, Union, Tuple, Any
 
 from lark import Lark, Transformer, Token, ParseError
-from music21 import volume, stream, duration, chord, midi, note
+from lark.exceptions import LarkError
+from music21 import volume, stream, duration, chord, midi, note, tempo
+
+from music21_addons.events import NoteEvent
 
 import logging
 
@@ -14,6 +19,8 @@ DEFAULT_VOLUME = 60
 DEFAULT_DURATION = 'q'
 DEFAULT_OCTAVE = 4
 QL_MAP = {'w': 4, 'h': 2, 'q': 1, 't': 0.5, 's': 0.25}
+PITCH_CLASSES = {'c': 0, 'd': 2, 'e': 4, 'f': 5, 'g': 7, 'a': 9, 'b': 11}
+ACCIDENTALS = {'#': 1, '-': -1}
 REVERSE_QL_MAP = {v: k for k, v in QL_MAP.items()}
 
 
@@ -46,16 +53,35 @@ def get_location(*args):
         return ssl, ssc, eel, eec
 
 
-def onetrack_parser():
+_parsers = {}  # type: Dict[Tuple[str, bool], Lark]
+_parser_lock = threading.Lock()
+
+
+def onetrack_grammar() -> str:
     __location__ = os.path.realpath(
         os.path.join(os.getcwd(), os.path.dirname(__file__)))
     grammar_file = os.path.join(__location__, 'onetrack.grammar')
     with open(grammar_file, 'r') as gf:
         grammar = gf.read()
-    # print(grammar)
+    return grammar
+
+
+def onetrack_parser(parser='lalr', cache=True) -> Lark:
+    """Return the process-wide onetrack parser for these options.
 
-    parser = Lark(grammar, start='part')
-    return parser
+    Each combination of ``parser`` type and ``cache`` is built once and then
+    shared by every caller asking for it. With ``cache``, an LALR parser's
+    analysed grammar is serialized by Lark to a cache file in the temp
+    directory, keyed by the md5 of the grammar and options, so later
+    processes skip the grammar analysis altogether.
+    """
+    key = (parser, cache)
+    if key not in _parsers:
+        with _parser_lock:
+            if key not in _parsers:
+                _parsers[key] = Lark(onetrack_grammar(), start='part', parser=parser,
+                                     cache=cache and parser == 'lalr', propagate_positions=True)
+    return _parsers[key]
 
 
 class PNote(Located):
@@ -112,6 +138,19 @@ class SetVol(Located):
         return 'v:' + str(self.velocity)
 
 
+class SetTempo(Located):
+    def __init__(self, bpm: Token):
+        self.bpm = bpm
+        self.start_line, self.start_column, self.end_line, self.end_column = \
+            get_location(self.bpm)
+
+    def __repr__(self):
+        return f'T{self.bpm}[{self._loc()}]'
+
+    def __str__(self):
+        return 'tempo:' + str(self.bpm)
+
+
 def get_ql(dur):
     if dur is None:
         dur = DEFAULT_DURATION
@@ -187,6 +226,11 @@ class OneTrackTransformer(Transformer):
         sv = SetVol(token)
         return sv
 
+    def settempo(self, bpm):
+        self.debug("settempo:", bpm, "ret", bpm[0])
+        type, token = bpm[0]
+        return SetTempo(token)
+
     def item(self, i):
         self.debug('item:', i, "ret", i[0])
         return i[0]
@@ -232,11 +276,66 @@ def to_part(obj_list, track=None) -> Tuple[stream.Part, Dict[int, Tuple[Union[PC
             map[id(ch)] = (cn, track)
         elif isinstance(cn, SetVol):
             curr_vel = int(cn.velocity)
+        elif isinstance(cn, SetTempo):
+            part.append(tempo.MetronomeMark(number=int(cn.bpm)))
         else:
             raise ParseError("Unknown object", cn.__class__)
     return part, map
 
 
+def pitch_to_midi(pitch: str) -> int:
+    midi_num = PITCH_CLASSES[pitch[0].lower()]
+    octave = DEFAULT_OCTAVE
+    for c in pitch[1:]:
+        if c in ACCIDENTALS:
+            midi_num += ACCIDENTALS[c]
+        else:
+            octave = int(c)
+    return midi_num + 12 * (octave + 1)
+
+
+def to_events(obj_list) -> List[NoteEvent]:
+    """Compile parsed items straight to playback events, without building music21 objects.
+
+    Produces the same offsets, pitches and velocities as ``part_to_events(to_part(obj_list)[0])``.
+    """
+    events = []  # type: List[NoteEvent]
+    curr_vel = DEFAULT_VOLUME
+    offset = 0.0
+    for cn in obj_list:
+        if isinstance(cn, PNote):
+            ql = get_ql(cn.duration)
+            if cn.pitch.lower() != "r":
+                vel = get_velocity(cn.velocity, default=curr_vel)
+                events.append(NoteEvent(offset, ql, (pitch_to_midi(cn.pitch),), vel, cn))
+            offset += ql
+        elif isinstance(cn, PChord):
+            ql = get_ql(cn.duration)
+            vel = get_velocity(cn.velocity, default=curr_vel)
+            pitches = tuple(pitch_to_midi(p) for p in cn.pitches)
+            events.append(NoteEvent(offset, ql, pitches, int(vel / len(pitches)), cn))
+            offset += ql
+        elif isinstance(cn, SetVol):
+            curr_vel = int(cn.velocity)
+        elif isinstance(cn, SetTempo):
+            pass
+        else:
+            raise ParseError("Unknown object", cn.__class__)
+    return events
+
+
+def to_tempo_changes(obj_list) -> List[Tuple[float, float]]:
+    """(offset, bpm) of every tempo change, offsets in quarter notes."""
+    changes = []
+    offset = 0.0
+    for cn in obj_list:
+        if isinstance(cn, (PNote, PChord)):
+            offset += get_ql(cn.duration)
+        elif isinstance(cn, SetTempo):
+            changes.append((offset, float(cn.bpm)))
+    return changes
+
+
 def parse_onetrack(text) -> List:
     parser = onetrack_parser()
     tree = parser.parse(text)
@@ -250,6 +349,151 @@ def onetrack_to_part(text, parser, id=None):
     return to_part(nl, id)
 
 
+def text_diff(old, new) -> Tuple[int, str, str]:
+    """(position, removed, inserted) of the one edit turning ``old`` into ``new``.
+
+    The edit spans everything between the common prefix and the common
+    suffix, which are found by bisection on slice comparisons rather than
+    character by character.
+    """
+    limit = min(len(old), len(new))
+    lo, hi = 0, limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if old[:mid] == new[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    prefix = lo
+    lo, hi = 0, limit - prefix
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if old[len(old) - mid:] == new[len(new) - mid:]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return prefix, old[prefix:len(old) - lo], new[prefix:len(new) - lo]
+
+
+def _line_col(text, offset):
+    line = text.count('\n', 0, offset) + 1
+    column = offset - text.rfind('\n', 0, offset)
+    return line, column
+
+
+class OneTrackDocument():
+    """Onetrack text with its parsed items, kept up to date incrementally.
+
+    ``items`` is the PNote/PChord/SetVol list a full parse would produce,
+    ``spans`` the (start, end) character offsets of each item (chords include
+    their brackets) and ``velocities`` the running velocity in effect at each
+    item, i.e. what ``to_part`` would use for a note without its own volume.
+
+    ``apply_edit`` re-parses only the items around the edited range and
+    splices the result into the existing lists.
+    """
+
+    def __init__(self, text='', parser=None):
+        self.parser = parser if parser is not None else onetrack_parser()
+        self.text = ''
+        self.items = []  # type: List[Located]
+        self.spans = []  # type: List[Tuple[int, int]]
+        self.velocities = []  # type: List[int]
+        self.full_parses = 0
+        self.partial_parses = 0
+        self.set_text(text)
+
+    def set_text(self, text):
+        items, spans = self._parse_region(text, 0)
+        self.text = text
+        self.items, self.spans = items, spans
+        self.velocities = [0] * len(items)
+        self._update_velocities(0, len(items))
+        self.full_parses += 1
+
+    def update(self, text):
+        """Bring the document in line with ``text``, re-parsing only what changed."""
+        if text != self.text:
+            self.apply_edit(*text_diff(self.text, text))
+
+    def apply_edit(self, pos, removed, inserted):
+        """Replace ``removed`` at character offset ``pos`` with ``inserted``."""
+        old = self.text
+        old_end = pos + len(removed)
+        if old[pos:old_end] != removed:
+            raise ValueError(f'Edit does not match document text at {pos}: {removed!r}')
+        text = old[:pos] + inserted + old[old_end:]
+        if not self.items:
+            self.set_text(text)
+            return
+
+        # Damaged items, plus one item of context on each side: a note can
+        # pick up a duration or volume typed after it.
+        starts = [s for s, e in self.spans]
+        ends = [e for s, e in self.spans]
+        first = max(bisect.bisect_left(ends, pos) - 1, 0)
+        last = min(bisect.bisect_right(starts, old_end), len(self.items) - 1)
+        region_start = min(starts[first], pos)
+        old_region_end = max(ends[last], old_end)
+        delta = len(inserted) - len(removed)
+        region_end = old_region_end + delta
+        try:
+            items, spans = self._parse_region(text[region_start:region_end], region_start, text)
+        except LarkError:
+            self.set_text(text)
+            return
+
+        old_end_line, old_end_col = _line_col(old, old_region_end)
+        new_end_line, new_end_col = _line_col(text, region_end)
+        line_delta = new_end_line - old_end_line
+        col_delta = new_end_col - old_end_col
+        following = last + 1
+        for i in range(following, len(self.items)):
+            item = self.items[i]
+            if item.start_line == old_end_line:
+                item.start_column += col_delta
+            if item.end_line == old_end_line:
+                item.end_column += col_delta
+            item.start_line += line_delta
+            item.end_line += line_delta
+            s, e = self.spans[i]
+            self.spans[i] = (s + delta, e + delta)
+
+        self.text = text
+        self.items[first:following] = items
+        self.spans[first:following] = spans
+        self.velocities[first:following] = [0] * len(items)
+        self._update_velocities(first, first + len(items))
+        self.partial_parses += 1
+
+    def _parse_region(self, region, offset, text=None):
+        """Parse ``region``, which starts at ``offset`` in ``text``, into items and absolute spans."""
+        tree = self.parser.parse(region)
+        items = OneTrackTransformer().transform(tree)  # type: List
+        spans = [(c.meta.start_pos + offset, c.meta.end_pos + offset) for c in tree.children]
+        if offset:
+            base_line, base_col = _line_col(text, offset)
+            for item in items:
+                if item.start_line == 1:
+                    item.start_column += base_col - 1
+                if item.end_line == 1:
+                    item.end_column += base_col - 1
+                item.start_line += base_line - 1
+                item.end_line += base_line - 1
+        return items, spans
+
+    def _update_velocities(self, start, changed_end):
+        """Recompute running velocities from ``start`` until they agree with the old values past ``changed_end``."""
+        vel = self.velocities[start - 1] if start > 0 else DEFAULT_VOLUME
+        for i in range(start, len(self.items)):
+            item = self.items[i]
+            if isinstance(item, SetVol):
+                vel = int(item.velocity)
+            if i >= changed_end and self.velocities[i] == vel:
+                break
+            self.velocities[i] = vel
+
+
 def get_duration_string(dur):
     if dur is None:
         return ''
@@ -272,7 +516,11 @@ def part_to_onetrack(part: stream.Part):
     part.makeRests()
     symbols = []  # type: List[str]
     current_velocity = 0
-    for ncr in part.flat.getElementsByClass(['Note', 'Chord', 'Rest']):
+    for ncr in part.flat.getElementsByClass(['Note', 'Chord', 'Rest', 'MetronomeMark']):
+        if isinstance(ncr, tempo.MetronomeMark):
+            symbols.append('tempo:' + str(int(ncr.number)))
+            symbols.append(' ')
+            continue
         ds = get_duration_string(ncr.duration)
         if isinstance(ncr, note.Rest):
             symbols.append('r' + ds)
@@ -0,0 +1,146 @@
+import logging
+import os
+import time
+import wave
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List
+
+import fluidsynth
+import numpy as np
+
+from music21_addons.tempo_map import TempoMap
+from music21_addons.timeline import Timeline, NOTE_ON
+
+logger = logging.getLogger(__name__)
+
+BLOCK_FRAMES = 4096
+
+
+class BlockSynth(ABC):
+    """Synth that renders audio on demand, block by block, instead of playing it in real time.
+
+    Channels are the virtual channels of a Timeline.
+    """
+
+    @abstractmethod
+    def note_on(self, notenum, chan, velocity):
+        pass
+
+    @abstractmethod
+    def note_off(self, notenum, chan, velocity):
+        pass
+
+    @abstractmethod
+    def program_change(self, chan, inst):
+        pass
+
+    @abstractmethod
+    def render(self, frames) -> np.ndarray:
+        """The next ``frames`` frames of audio, as int16 of shape (frames, 2)."""
+        pass
+
+    def close(self):
+        pass
+
+
+class FluidBlockSynth(BlockSynth):
+    """A fluidsynth instance of its own with no audio driver, pulled with get_samples.
+
+    fluidsynth has 256 MIDI channels, enough for every virtual channel.
+    """
+
+    def __init__(self, soundfont_file, samplerate=44100, gain=0.2):
+        self.fs = fluidsynth.Synth(gain=gain, samplerate=samplerate)
+        self.sfid = self.fs.sfload(soundfont_file)
+
+    def note_on(self, notenum, chan, velocity):
+        self.fs.noteon(chan, notenum, velocity)
+
+    def note_off(self, notenum, chan, velocity):
+        self.fs.noteoff(chan, notenum)
+
+    def program_change(self, chan, inst):
+        self.fs.program_select(chan, self.sfid, 0, inst)
+
+    def render(self, frames) -> np.ndarray:
+        return self.fs.get_samples(frames).reshape(-1, 2)
+
+    def close(self):
+        self.fs.delete()
+
+
+def stem_path(path, track) -> str:
+    root, ext = os.path.splitext(path)
+    return f'{root}-track{track + 1}{ext}'
+
+
+def open_wav(path, samplerate) -> wave.Wave_write:
+    out = wave.open(path, 'wb')
+    out.setnchannels(2)
+    out.setsampwidth(2)
+    out.setframerate(samplerate)
+    return out
+
+
+def render_wav(timeline: Timeline, tempo_map: TempoMap, path, synth_factory: Callable[[], BlockSynth],
+               samplerate=44100, stems=False, tail_sec=2.0) -> Dict[str, float]:
+    """Render ``timeline`` to a 16 bit stereo WAV file at ``path`` as fast as the synth allows.
+
+    With ``stems``, every track is rendered on a synth of its own and also
+    written to ``stem_path(path, track)``; the mix is then the sum of the
+    stems. ``tail_sec`` of audio after the last note-off lets notes ring out.
+    Returns the length of audio rendered, the time it took and their ratio.
+    """
+    start = time.perf_counter()
+    n_tracks = len(timeline.channels.track_programs)
+    synths = [synth_factory() for _ in range(n_tracks if stems else 1)]  # type: List[BlockSynth]
+    track_synths = synths if stems else synths * n_tracks
+    programs = [[-1] * timeline.num_channels for _ in synths]
+    track_programs = programs if stems else programs * n_tracks
+    mix = open_wav(path, samplerate)
+    stem_outs = [open_wav(stem_path(path, track), samplerate) for track in range(n_tracks)] if stems else []
+    group_frames = np.rint(tempo_map.beat_to_seconds(timeline.group_times) * samplerate).astype(np.int64).tolist()
+
+    def advance(frames):
+        while frames > 0:
+            block = min(frames, BLOCK_FRAMES)
+            if stems:
+                total = np.zeros((block, 2), dtype=np.int32)
+                for synth, out in zip(synths, stem_outs):
+                    samples = synth.render(block)
+                    out.writeframes(samples.astype('<i2').tobytes())
+                    total += samples
+                samples = np.clip(total, -32768, 32767)
+            else:
+                samples = synths[0].render(block)
+            mix.writeframes(samples.astype('<i2').tobytes())
+            frames -= block
+
+    try:
+        pos = 0
+        for i, frame in enumerate(group_frames):
+            advance(frame - pos)
+            pos = frame
+            for t, event_type, chan, notenum, velocity, program, track, source in timeline.group(i).tolist():
+                synth, synth_programs = track_synths[track], track_programs[track]
+                if synth_programs[chan] != program:
+                    synth.program_change(chan, program)
+                    synth_programs[chan] = program
+                if event_type == NOTE_ON:
+                    synth.note_on(notenum, chan, velocity)
+                else:
+                    synth.note_off(notenum, chan, velocity)
+        tail = int(tail_sec * samplerate)
+        advance(tail)
+    finally:
+        for out in [mix] + stem_outs:
+            out.close()
+        for synth in synths:
+            synth.close()
+
+    elapsed = time.perf_counter() - start
+    seconds = (pos + tail) / samplerate
+    result = {'seconds': seconds, 'elapsed': elapsed, 'realtime_factor': seconds / elapsed if elapsed else 0.0}
+    logger.info('Rendered %.1fs of audio to %s in %.2fs (%.0fx real time)', seconds, path, elapsed,
+                result['realtime_factor'])
+    return result
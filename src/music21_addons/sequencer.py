@@ -1,18 +1,32 @@
+import itertools
 import logging
+import queue
 import threading
 from abc import ABC, abstractmethod
 from threading import Thread
-from typing import Dict, Tuple, Optional
+from typing import Dict, Tuple, Optional, List, Union, Iterable
 
 import fluidsynth
 import mido
-import pygame
+import numpy as np
 from mido import Message
-from music21 import tempo, note, chord
-from sortedcontainers import SortedDict
+from music21 import stream
+
+from music21_addons.channels import CHANNELS_PER_PORT
+from music21_addons.clock import Clock, MonotonicClock, NS_PER_MS, NS_PER_SEC
+from music21_addons.events import NoteEvent, part_to_events
+from music21_addons.instrumentation import PlaybackStats
+from music21_addons.notifier import PlaybackNotifier
+from music21_addons.tempo_map import TempoMap
+from music21_addons.timeline import Timeline, TrackSwap, build_timeline, note_key, NOTE_ON, NOTE_OFF
 
 logger = logging.getLogger(__name__)
 
+# Status bytes of the MIDI messages in a Synth.send_batch, or'ed with the channel
+NOTE_OFF_STATUS = 0x80
+NOTE_ON_STATUS = 0x90
+PROGRAM_CHANGE_STATUS = 0xC0
+
 
 class Synth(ABC):
 
@@ -37,8 +51,34 @@ class Synth(ABC):
     def get_instrument_map(self) -> Optional[Dict[Tuple[str, str], int]]:
         pass
 
+    def port(self, index) -> 'Synth':
+        """Synth for MIDI port ``index``, used for channels past the first 16. Port 0 is this synth."""
+        if index == 0:
+            return self
+        raise ValueError(f'{type(self).__name__} has a single port')
+
+    def send_batch(self, events: List[Tuple[int, int, int]]):
+        """Send every (status, data1, data2) MIDI message due at the same time, in order.
+
+        Backends with a cheaper way to send several messages at once override this;
+        the sequencer only batches for those.
+        """
+        for status, data1, data2 in events:
+            kind, chan = status & 0xF0, status & 0x0F
+            if kind == NOTE_ON_STATUS:
+                self.note_on(data1, chan, data2)
+            elif kind == NOTE_OFF_STATUS:
+                self.note_off(data1, chan, data2)
+            elif kind == PROGRAM_CHANGE_STATUS:
+                self.program_change(chan, data1)
+
 
 class TextSynth(Synth):
+    _instrument_map = None
+
+    @classmethod
+    def configure_instrument_map(cls, instrument_map: Dict[Tuple[str, str], int]):
+        TextSynth._instrument_map = instrument_map
 
     def note_on(self, notenum, chan, velocity):
         logger.debug("note_on: %s %s %s ", notenum, chan, velocity)
@@ -49,6 +89,36 @@ class TextSynth(Synth):
     def program_change(self, chan, inst):
         logger.debug("program_change: %s %s", chan, inst)
 
+    def get_instrument_map(self) -> Optional[Dict[Tuple[str, str], int]]:
+        return TextSynth._instrument_map
+
+    def port(self, index) -> Synth:
+        return self
+
+
+class RecordingSynth(TextSynth):
+    """Records every call with the time it was made, for tests and headless runs.
+
+    All ports record into the same ``events``, with channels numbered ``port * 16 + channel``.
+    """
+
+    def __init__(self, clock: Clock, port_index=0, events: Optional[List[Tuple]] = None):
+        self.clock = clock
+        self.chan_offset = port_index * CHANNELS_PER_PORT
+        self.events = events if events is not None else []  # type: List[Tuple]
+
+    def note_on(self, notenum, chan, velocity):
+        self.events.append((self.clock.now_ns(), 'note_on', chan + self.chan_offset, notenum, velocity))
+
+    def note_off(self, notenum, chan, velocity):
+        self.events.append((self.clock.now_ns(), 'note_off', chan + self.chan_offset, notenum, velocity))
+
+    def program_change(self, chan, inst):
+        self.events.append((self.clock.now_ns(), 'program_change', chan + self.chan_offset, inst))
+
+    def port(self, index) -> Synth:
+        return RecordingSynth(self.clock, index, self.events)
+
 
 class PyFluidSynth(Synth):
     fs = None
@@ -67,22 +137,39 @@ class PyFluidSynth(Synth):
         cls.fs.start()
         cls.sfid = cls.fs.sfload(soundfont_file)
 
-    def __init__(self):
-        pass
+    def __init__(self, port_index=0):
+        # fluidsynth has 256 MIDI channels, so each port is just the next 16 of them
+        self.chan_offset = port_index * CHANNELS_PER_PORT
 
     def note_on(self, notenum, chan, velocity):
         logger.debug("note_on: %s %s %s ", notenum, chan, velocity)
-        PyFluidSynth.fs.noteon(chan, notenum, velocity)
+        PyFluidSynth.fs.noteon(chan + self.chan_offset, notenum, velocity)
 
     def note_off(self, notenum, chan, velocity):
         logger.debug("note_off: %s %s %s ", notenum, chan, velocity)
-        PyFluidSynth.fs.noteoff(chan, notenum)
+        PyFluidSynth.fs.noteoff(chan + self.chan_offset, notenum)
 
     def program_change(self, chan, inst):
         logger.debug("program_change: %s %s", chan, inst)
         bank = 0
         preset = inst
-        PyFluidSynth.fs.program_select(chan, PyFluidSynth.sfid, bank, preset)
+        PyFluidSynth.fs.program_select(chan + self.chan_offset, PyFluidSynth.sfid, bank, preset)
+
+    def port(self, index) -> Synth:
+        return PyFluidSynth(index)
+
+    def send_batch(self, events: List[Tuple[int, int, int]]):
+        logger.debug("batch: %s", events)
+        synth, sfid = PyFluidSynth.fs.synth, PyFluidSynth.sfid
+        noteon, noteoff = fluidsynth.fluid_synth_noteon, fluidsynth.fluid_synth_noteoff
+        for status, data1, data2 in events:
+            kind, chan = status & 0xF0, (status & 0x0F) + self.chan_offset
+            if kind == NOTE_ON_STATUS:
+                noteon(synth, chan, data1, data2)
+            elif kind == NOTE_OFF_STATUS:
+                noteoff(synth, chan, data1)
+            elif kind == PROGRAM_CHANGE_STATUS:
+                fluidsynth.fluid_synth_program_select(synth, chan, sfid, 0, data1)
 
     def get_instrument_map(self) -> Optional[Dict[Tuple[str, str], int]]:
         return PyFluidSynth._instrument_map
@@ -95,216 +182,511 @@ class MidoSynth(Synth):
     def configure_instrument_map(cls, instrument_map: Dict[Tuple[str, str], int]):
         MidoSynth._instrument_map = instrument_map
 
-    def __init__(self):
+    def __init__(self, port_index=0):
         mido.set_backend('mido.backends.pygame')
-        pname = mido.get_output_names()[0]
-        self.port = mido.open_output(pname)
+        pname = mido.get_output_names()[port_index]
+        self.output = mido.open_output(pname)
 
     def __del__(self):
-        self.port.close()
+        self.output.close()
 
     def note_on(self, notenum, chan, velocity):
         logger.debug("note_on: %s %s %s ", notenum, chan, velocity)
         msg = Message('note_on', note=notenum, channel=chan, velocity=velocity)
-        self.port.send(msg)
+        self.output.send(msg)
 
     def note_off(self, notenum, chan, velocity):
         logger.debug("note_off: %s %s %s ", notenum, chan, velocity)
         msg = Message('note_off', note=notenum, channel=chan, velocity=velocity)
-        self.port.send(msg)
+        self.output.send(msg)
 
     def program_change(self, chan, inst):
         logger.debug("program_change: %s %s", chan, inst)
         msg = Message('program_change', channel=chan, program=inst)
-        self.port.send(msg)
+        self.output.send(msg)
+
+    def send_batch(self, events: List[Tuple[int, int, int]]):
+        logger.debug("batch: %s", events)
+        lock = getattr(self.output, '_lock', None)
+        pm_output = getattr(self.output, '_port', None)
+        if lock is not None and hasattr(pm_output, 'write'):
+            # pygame.midi writes up to 1024 messages in one Pm_Write
+            messages = [[[status, data1, data2], 0] for status, data1, data2 in events]
+            with lock:
+                for i in range(0, len(messages), 1024):
+                    pm_output.write(messages[i:i + 1024])
+            return
+        # Any other mido backend or version: public sends, one message at a time
+        for status, data1, data2 in events:
+            data = [status, data1] if status & 0xF0 == PROGRAM_CHANGE_STATUS else [status, data1, data2]
+            self.output.send(Message.from_bytes(data))
 
     def get_instrument_map(self) -> Optional[Dict[Tuple[str, str], int]]:
         return MidoSynth._instrument_map
 
+    def port(self, index) -> Synth:
+        """Opens the ``index``-th MIDI output of the system."""
+        return self if index == 0 else MidoSynth(index)
+
 
 def noop(*args):
     pass
 
 
-DEFAULT_VELOCITY = 60
+CMD_PLAY = 'play'
+CMD_PAUSE = 'pause'
+CMD_SEEK = 'seek'
+CMD_SET_TEMPO = 'set-tempo'
+CMD_SET_TEMPO_MAP = 'set-tempo-map'
+CMD_SET_LOOP = 'set-loop'
+CMD_SET_MUTED = 'set-muted'
+CMD_STOP = 'stop'
+CMD_REPLACE_TIMELINE = 'replace-timeline'
+CMD_REPLACE_TRACK = 'replace-track'
+CMD_SYNC = 'sync'
+CMD_QUIT = 'quit'
 
 
 class MySequencer():
+    """Plays a compiled Timeline through a Synth.
+
+    All playback happens on one persistent worker thread. The public methods
+    only queue a command and wake the worker, which handles it between
+    events, so they return immediately and never race with the playback loop.
+    """
 
-    def __init__(self, synth):
+    def __init__(self, synth, notify_rate=30, clock: Optional[Clock] = None, max_lateness_ms=50,
+                 stats: Optional[PlaybackStats] = None):
         self.synth = synth
+        self.stats = stats if stats is not None else PlaybackStats()
+        self.backend = self.stats.backend_id(type(synth).__name__)
+        self.batching = type(synth).send_batch is not Synth.send_batch
+        self.ports = [synth]  # type: List[Synth]
+        self.batches = [[]]  # type: List[List[Tuple[int, int, int]]]
+        self.chan_synths = [synth] * CHANNELS_PER_PORT  # type: List[Synth]
+        self.deadline_ns = 0
+        self.clock = clock if clock is not None else MonotonicClock()
+        self.max_lateness_ns = max_lateness_ms * NS_PER_MS
         self.playing = False
         self.pos = 0
         self.length = 0
-        self.pos_lock = threading.Lock()
-        self.play_lock = threading.Lock()
+        self.now_playing = noop
+        self.progress_update = noop
+        self.finished_cb = noop
+        self.generations = itertools.count(1)
+        self.generation = 0  # of the latest play_events
+        self.playing_generation = 0  # of the timeline the worker has
+        self.to_play = build_timeline([])
+        self.latest = self.to_play  # the timeline the worker will have once it has handled every command sent
+        self.edit_lock = threading.Lock()
+        self.unstarted = np.zeros(0, dtype=np.int64)  # note_keys of notes swapped in after they should have started
+        self.tempo_map = TempoMap(60)
+        self.to_play_ptr = 0
+        self.start_ns = 0
+        self.loop = None  # type: Optional[Tuple[float, float]]
+        self.loop_start_ptr = 0
+        self.loop_end_ptr = 0
+        self.loop_start_ns = 0
+        self.loop_end_ns = 0
+        self.channel_inst = [-1] * CHANNELS_PER_PORT
+        self.muted_tracks = frozenset()  # type: frozenset
+        self.track_muted = np.zeros(0, dtype=bool)
+        self.on_items = {}  # type: Dict[Tuple[int, int], int]
+        self.command_latency_ns = {}  # type: Dict[str, List[int]]
+        self.notifier = PlaybackNotifier(self.deliver_update, max_rate=notify_rate)
+        self.commands = queue.Queue()  # type: queue.Queue
+        self.wakeup = threading.Event()
+        self.worker = Thread(target=self.run, name='sequencer', daemon=True)
+        self.worker.start()
 
     def play(self, score, tempo, now_playing=noop, progress_update=noop, finished_cb=noop):
-        self.now_playing = now_playing
-        self.progress_update = progress_update
-        self.finished_cb = finished_cb
-        self.to_play = self.get_to_play(score, tempo)
-        self.channel_inst = [-1] * 16
-        t, _ = self.to_play.peekitem(-1)
-        self.length = int(t * 1000)
-        self.on_items = {}
+        marks = score.flat.getElementsByClass('MetronomeMark')
+        tempo_map = TempoMap(tempo, [(mm.offset, mm.number) for mm in marks])
+        self.play_events(self.score_to_tracks(score), tempo_map, now_playing, progress_update, finished_cb)
+
+    def play_events(self, tracks: List[Tuple[int, List[NoteEvent]]], tempo: Union[float, TempoMap],
+                    now_playing=noop, progress_update=noop, finished_cb=noop):
+        """Play (program, events) per track. ``tempo`` is a bpm or a TempoMap."""
+        tempo_map = tempo if isinstance(tempo, TempoMap) else TempoMap(tempo)
+        timeline = self.get_to_play_events(tracks)
+        with self.edit_lock:
+            self.latest = timeline
+            self.generation = next(self.generations)
+            self.send(CMD_REPLACE_TIMELINE, timeline, tempo_map, now_playing, progress_update, finished_cb,
+                      self.generation)
         self.start()
 
-    def start(self):
+    def replace_track(self, track, program, events: List[NoteEvent]):
+        """Replace the events of one track of the current timeline from the playing position on.
 
-        self.playing = True
-
-        def continue_playing():
-            to_play_ptr = self.move_to_pos()
-            last_time = pygame.time.get_ticks()
-            while self.playing and to_play_ptr < len(self.to_play):
-                self.play_lock.acquire()
-                t, to_play_list = self.to_play.peekitem(to_play_ptr)
-                now = pygame.time.get_ticks()
-                time_since_start = now - last_time
-                time_to_wait = int(t * 1000 - (self.pos + time_since_start))
-                if time_to_wait <= 0:
-                    self.pos = int(t * 1000)
-                    self.process(to_play_list, True)
-                    to_play_ptr += 1
-                    last_time = pygame.time.get_ticks()
-                else:
-                    pygame.time.wait(time_to_wait)
-                self.play_lock.release()
-            self.stop_all_playing_notes()
-            if to_play_ptr >= len(self.to_play):
-                self.stop()
+        Notes of the track that are sounding keep sounding if ``events`` has
+        the same note, and are stopped otherwise. The new timeline is built on
+        the calling thread; the playback thread only carries the sounding
+        notes over to it.
+        """
+        with self.edit_lock:
+            swap = self.latest.with_track(track, program, events)
+            self.latest = swap.timeline
+            self.send(CMD_REPLACE_TRACK, swap)
 
-        thr = Thread(target=continue_playing)
-        thr.start()
+    def set_muted_tracks(self, tracks: Iterable[int]):
+        """Silence the given tracks (and only them) until the next call, without recompiling.
 
-    def move_to_pos(self):
-        to_play_ptr = 0
-        t, to_play_list = self.to_play.peekitem(to_play_ptr)
-        while t * 1000 < self.pos:
-            self.process(to_play_list, False)
-            to_play_ptr += 1
-            t, _ = self.to_play.peekitem(to_play_ptr)
-        return to_play_ptr
-
-    def process(self, to_play_list, send_notes):
-        for ncr, is_on, inst, chan in to_play_list:
-            self.process_one(ncr, is_on, inst, chan, send_notes)
-        if (send_notes):
-            now_on = [ncr for (ncr, inst, chan) in self.on_items.values()]
-            thr = Thread(target=self.now_playing, args=[now_on])
-            thr.start()
-            thr = Thread(target=self.update_progress, args=[self.pos, self.length])
-            thr.start()
-
-    def update_progress(self, pos, length):
-        self.pos_lock.acquire()
-        self.progress_update(pos, length)
-        self.pos_lock.release()
-
-    def process_one(self, ncr, is_on, inst, chan, send_notes):
-        # logger.info("processing:", ncr, is_on, send_notes)
-        if self.channel_inst[chan] != inst:
-            self.synth.program_change(chan, inst)
-            self.channel_inst[chan] = inst
-        if send_notes:
-            if is_on:
-                note_fn = self.synth.note_on
-                on_fn = self.add_to_on
-            else:
-                note_fn = self.synth.note_off
-                on_fn = self.remove_from_on
-
-            if isinstance(ncr, note.Note):
-                velocity = self.compute_velocity(ncr.volume, DEFAULT_VELOCITY)
-                note_fn(ncr.pitch.midi, chan, velocity)
-                on_fn(id(ncr), ncr, inst, chan)
-            elif isinstance(ncr, chord.Chord):
-                chord_velocity = self.compute_velocity(ncr.volume, None)
-                num_pitches = len(ncr.pitches)
-                for n in ncr.notes:
-                    velocity = int(chord_velocity / num_pitches) if chord_velocity is not None else \
-                        self.compute_velocity(n.volume, DEFAULT_VELOCITY / num_pitches)
-                    note_fn(n.pitch.midi, chan, velocity)
-                on_fn(id(ncr), ncr, inst, chan)
-
-    def compute_velocity(self, volume, default):
-        if volume is None or volume.velocity is None:
-            return default
-        else:
-            return volume.velocity
+        Notes of newly muted tracks that are sounding are stopped at once.
+        """
+        self.send(CMD_SET_MUTED, frozenset(tracks))
 
-    def add_to_on(self, id, ncr, inst, chan):
-        # logger.info(self.on_items)
-        self.on_items[id] = (ncr, inst, chan)
+    def send(self, command, *args):
+        self.commands.put((command, args, self.clock.now_ns()))
+        self.wakeup.set()
 
-    def remove_from_on(self, id, ncr, inst, chan):
-        # logger.info(self.on_items)
-        if id in self.on_items:
-            self.on_items.pop(id)
+    def start(self):
+        self.send(CMD_PLAY)
 
     def pause(self):
-        if self.playing:
-            self.playing = False
+        self.send(CMD_PAUSE)
 
     def unpause(self):
-        if not self.playing:
-            self.playing = True
-            self.start()
+        self.send(CMD_PLAY)
 
     def stop(self):
-        self.playing = False
-        self.play_lock.acquire()
-        self.pos_lock.acquire()
-        self.play_lock.release()
-        self.pos_lock.release()
-        self.set_pos(0)
-        self.finished_cb()
+        self.send(CMD_STOP)
+
+    def seek(self, pos):
+        self.send(CMD_SEEK, pos)
+
+    def set_tempo(self, bpm):
+        """Change the tempo before the first tempo change of the piece, keeping the current beat position."""
+        self.send(CMD_SET_TEMPO, bpm)
+
+    def set_tempo_map(self, tempo_map: TempoMap):
+        """Replace the tempo map, keeping the playing position on the same beat."""
+        self.send(CMD_SET_TEMPO_MAP, tempo_map)
+
+    def set_loop(self, start, end):
+        """Loop between the ``start`` and ``end`` positions (ms) instead of stopping at the end."""
+        self.send(CMD_SET_LOOP, start, end)
+
+    def clear_loop(self):
+        self.send(CMD_SET_LOOP, None, None)
+
+    def sync(self, timeout=None) -> bool:
+        """Wait until every command sent so far has been handled."""
+        done = threading.Event()
+        self.send(CMD_SYNC, done)
+        return done.wait(timeout)
+
+    def close(self):
+        self.send(CMD_QUIT)
+        self.worker.join()
+        self.notifier.close()
 
     def get_pos(self):
         return self.pos
 
     def set_pos(self, pos):
-        self.pos = pos
+        self.seek(pos)
 
     def rewind(self):
-        self.set_pos(0)
-
-    def get_to_play(self, score, bpm):
-        sd = SortedDict()  # : type Dict[float, Any]
-        mm = tempo.MetronomeMark(number=bpm)
-        # mm.durationToSeconds(offset)
-        unused_channels = [0, 1, 2, 3, 4, 5, 6, 7, 8, 10, 11, 12, 13, 14, 15]
-        for part in score.parts:
-            inst, chan = self.get_instrument_number(part, unused_channels)
-            for ncr in part.flat.getElementsByClass(['Note', 'Chord', 'Rest']):
-                sec_start = mm.durationToSeconds(ncr.offset)
-                sec_end = sec_start + mm.durationToSeconds(ncr.duration)
-                self.add_to_dict_list(sd, sec_start, (ncr, True, inst, chan))
-                self.add_to_dict_list(sd, sec_end, (ncr, False, inst, chan))
-
-        return sd
-
-    def get_instrument_number(self, part, unused_channels):
+        self.seek(0)
+
+    def run(self):
+        while True:
+            try:
+                if not self.step():
+                    return
+            except Exception as e:
+                # A failing synth or command costs the events or command at hand, not the rest of the session
+                logger.exception(e, exc_info=True)
+
+    def step(self) -> bool:
+        """Handle the next command, or play the next group of events once it is due. False to quit."""
+        if not self.playing:
+            return self.handle(*self.commands.get())
+        if self.loop is not None and self.to_play_ptr >= self.loop_end_ptr:
+            return self.wrap_loop()
+        if self.to_play_ptr >= len(self.to_play):
+            self.finish()
+            return True
+        t = float(self.tempo_map.beat_to_seconds(self.to_play.group_times[self.to_play_ptr]))
+        deadline = self.start_ns + int(t * NS_PER_SEC)
+        if not self.clock.sleep_until(deadline, self.wakeup):
+            self.wakeup.clear()
+            return self.handle_pending()
+        late = self.clock.now_ns() - deadline
+        if late > self.max_lateness_ns:
+            # We stalled (e.g. the process was suspended): shift the remaining events instead of rushing them.
+            self.start_ns += late
+        self.pos = int(t * 1000)
+        self.deadline_ns = deadline
+        self.to_play_ptr += 1
+        self.process(self.to_play.group(self.to_play_ptr - 1))
+        return True
+
+    def wrap_loop(self) -> bool:
+        """Wait for the loop end, then carry on from the loop start without a gap.
+
+        Everything the wrap needs was worked out when the loop was set, so it only moves the pointer and the
+        schedule: the first group of the loop is due at the very deadline the loop ended on.
+        """
+        deadline = self.start_ns + self.loop_end_ns
+        if not self.clock.sleep_until(deadline, self.wakeup):
+            self.wakeup.clear()
+            return self.handle_pending()
+        late = self.clock.now_ns() - deadline
+        if late > self.max_lateness_ns:
+            self.start_ns += late
+        self.stop_all_playing_notes()
+        self.unstarted = self.unstarted[:0]
+        self.start_ns += self.loop_end_ns - self.loop_start_ns
+        self.to_play_ptr = self.loop_start_ptr
+        return True
+
+    def handle_pending(self) -> bool:
+        while True:
+            try:
+                command = self.commands.get_nowait()
+            except queue.Empty:
+                return True
+            if not self.handle(*command):
+                return False
+
+    def handle(self, command, args, sent_ns) -> bool:
+        if command == CMD_PLAY:
+            if not self.playing:
+                self.playing = True
+                self.move_to_pos()
+        elif command == CMD_PAUSE:
+            if self.playing:
+                self.playing = False
+                self.stop_all_playing_notes()
+        elif command == CMD_SEEK:
+            self.pos = args[0]
+            if self.playing:
+                self.stop_all_playing_notes()
+                self.move_to_pos()
+        elif command == CMD_STOP:
+            self.finish()
+        elif command == CMD_SET_TEMPO:
+            self.change_tempo_map(self.tempo_map.with_base_tempo(args[0]))
+        elif command == CMD_SET_TEMPO_MAP:
+            self.change_tempo_map(args[0])
+        elif command == CMD_SET_LOOP:
+            start, end = args
+            if start is None or end <= start:
+                self.loop = None
+            else:
+                self.loop = (float(self.tempo_map.seconds_to_beat(start / 1000)),
+                             float(self.tempo_map.seconds_to_beat(end / 1000)))
+                self.update_loop()
+        elif command == CMD_SET_MUTED:
+            self.mute_tracks(args[0])
+        elif command == CMD_REPLACE_TIMELINE:
+            self.stop_all_playing_notes()
+            (timeline, self.tempo_map, self.now_playing, self.progress_update, self.finished_cb,
+             self.playing_generation) = args
+            self.set_timeline(timeline)
+            self.length = int(self.tempo_map.beat_to_seconds(self.to_play.length) * 1000)
+            self.update_loop()
+            if self.playing:
+                self.move_to_pos()
+        elif command == CMD_REPLACE_TRACK:
+            self.swap_track(*args)
+        elif command == CMD_SYNC:
+            args[0].set()
+        elif command == CMD_QUIT:
+            self.stop_all_playing_notes()
+            return False
+        self.command_latency_ns.setdefault(command, []).append(self.clock.now_ns() - sent_ns)
+        return True
+
+    def finish(self):
+        self.playing = False
+        self.stop_all_playing_notes()
+        self.pos = 0
+        # Building the report takes a while with a full buffer: not on the playback thread
+        self.notifier.call(self.stats.dump)
+        self.notifier.call(self.deliver_finished, self.playing_generation, self.finished_cb)
+
+    def deliver_finished(self, generation, finished_cb):
+        # A play_events sent since this playback ended or was stopped owns the callbacks' state now
+        if generation == self.generation:
+            finished_cb()
+
+    def latency_stats(self) -> Dict[str, Tuple[int, int]]:
+        """(count, worst latency in ns) from sending to handling, per command."""
+        return {command: (len(lat), max(lat)) for command, lat in self.command_latency_ns.items()}
+
+    def change_tempo_map(self, tempo_map: TempoMap):
+        if self.playing:
+            beat = self.tempo_map.seconds_to_beat((self.clock.now_ns() - self.start_ns) / NS_PER_SEC)
+            self.start_ns = self.clock.now_ns() - int(tempo_map.beat_to_seconds(beat) * NS_PER_SEC)
+        else:
+            beat = self.tempo_map.seconds_to_beat(self.pos / 1000)
+            self.pos = int(tempo_map.beat_to_seconds(beat) * 1000)
+        self.tempo_map = tempo_map
+        self.length = int(tempo_map.beat_to_seconds(self.to_play.length) * 1000)
+        self.update_loop()
+
+    def update_loop(self):
+        if self.loop is None:
+            return
+        start, end = self.loop
+        self.loop_start_ptr = self.to_play.group_at(start)
+        self.loop_end_ptr = self.to_play.group_at(end)
+        self.loop_start_ns = int(self.tempo_map.beat_to_seconds(start) * NS_PER_SEC)
+        self.loop_end_ns = int(self.tempo_map.beat_to_seconds(end) * NS_PER_SEC)
+
+    def set_timeline(self, timeline: Timeline):
+        """Play ``timeline`` from now on, opening the synth ports its channels need."""
+        logger.info(timeline.channels.report())
+        while len(self.ports) < timeline.channels.num_ports:
+            self.ports.append(self.synth.port(len(self.ports)))
+            self.batches.append([])
+        self.chan_synths = [self.ports[chan // CHANNELS_PER_PORT] for chan in range(timeline.num_channels)]
+        self.channel_inst = [-1] * timeline.num_channels
+        self.to_play = timeline
+        self.unstarted = self.unstarted[:0]
+        self.update_mute_mask()
+
+    def mute_tracks(self, tracks: frozenset):
+        self.muted_tracks = tracks
+        self.update_mute_mask()
+        if not tracks or not self.on_items:
+            return
+        source_tracks = self.to_play.source_tracks(set(self.on_items.values()))
+        for (chan, notenum), source in list(self.on_items.items()):
+            if source_tracks.get(source) in tracks:
+                self.chan_synths[chan].note_off(notenum, chan % CHANNELS_PER_PORT, 0)
+                del self.on_items[(chan, notenum)]
+
+    def update_mute_mask(self):
+        """``track_muted[track]`` is True for the tracks of the timeline that are muted."""
+        self.track_muted = np.zeros(len(self.to_play.channels.track_programs), dtype=bool)
+        self.track_muted[[track for track in self.muted_tracks if track < len(self.track_muted)]] = True
+
+    def swap_track(self, swap: TrackSwap):
+        if self.playing:
+            # The group at to_play_ptr is the next one due, so nothing from its beat on has been played yet
+            ptr = self.to_play_ptr
+            beat = self.to_play.group_times[ptr] if ptr < len(self.to_play) else self.to_play.length
+        else:
+            beat = self.tempo_map.seconds_to_beat(self.pos / 1000)
+        old = self.to_play
+        carried = []
+        for (chan, notenum), source in list(self.on_items.items()):
+            new = swap.carry(old, source, notenum)
+            if new is None:
+                self.chan_synths[chan].note_off(notenum, chan % CHANNELS_PER_PORT, 0)
+                del self.on_items[(chan, notenum)]
+            else:
+                self.on_items[(chan, notenum)] = new
+                carried.append((new, notenum))
+        unstarted = np.union1d(swap.remap_keys(self.unstarted), swap.unstarted(beat, carried))
+        if swap.rebuilt:
+            # Channels that keep their number keep their program: the rows say when it has to change
+            channel_inst = self.channel_inst
+            self.set_timeline(swap.timeline)
+            self.channel_inst[:len(channel_inst)] = channel_inst[:len(self.channel_inst)]
+        else:
+            self.to_play = swap.timeline
+        self.unstarted = unstarted
+        self.to_play_ptr = self.to_play.group_at(beat)
+        self.length = int(self.tempo_map.beat_to_seconds(self.to_play.length) * 1000)
+        self.update_loop()
+
+    def move_to_pos(self):
+        self.unstarted = self.unstarted[:0]
+        if self.loop is not None and self.pos * NS_PER_MS >= self.loop_end_ns:
+            self.pos = self.loop_start_ns // NS_PER_MS
+        self.to_play_ptr = self.to_play.group_at(self.tempo_map.seconds_to_beat(self.pos / 1000))
+        # Deadlines are absolute, relative to where the cue position was when playback (re)started,
+        # so waking up late for one event does not delay the following ones.
+        self.start_ns = self.clock.now_ns() - self.pos * NS_PER_MS
+        programs = self.to_play.programs_at(self.to_play.group_bounds[self.to_play_ptr])
+        for chan, program in enumerate(programs):
+            if program >= 0 and self.channel_inst[chan] != program:
+                self.chan_synths[chan].program_change(chan % CHANNELS_PER_PORT, program)
+                self.channel_inst[chan] = program
+
+    def process(self, rows):
+        if self.muted_tracks:
+            rows = rows[~self.track_muted[rows['track']]]
+        if len(self.unstarted):
+            rows = rows[~((rows['type'] == NOTE_OFF) & np.isin(note_key(rows), self.unstarted))]
+        if self.batching:
+            self.process_batch(rows)
+        else:
+            for t, event_type, chan, notenum, velocity, program, track, source in rows.tolist():
+                self.process_one(event_type, chan, notenum, velocity, program, source)
+        sources = self.to_play.sources
+        now_on = [sources[s] for s in set(self.on_items.values())]
+        self.notifier.post(now_on, self.pos, self.length)
+
+    def deliver_update(self, now_on, pos, length):
+        self.now_playing(now_on)
+        self.progress_update(pos, length)
+
+    def process_one(self, event_type, chan, notenum, velocity, program, source):
+        synth, midi_chan = self.chan_synths[chan], chan % CHANNELS_PER_PORT
+        if self.channel_inst[chan] != program:
+            synth.program_change(midi_chan, program)
+            self.channel_inst[chan] = program
+        sent = self.clock.now_ns()
+        if event_type == NOTE_ON:
+            synth.note_on(notenum, midi_chan, velocity)
+            self.on_items[(chan, notenum)] = source
+        else:
+            synth.note_off(notenum, midi_chan, velocity)
+            self.on_items.pop((chan, notenum), None)
+        self.stats.record(self.deadline_ns, sent, self.clock.now_ns() - sent, chan, self.backend)
+
+    def process_batch(self, rows):
+        """Send the rows with one send_batch per port."""
+        for batch in self.batches:
+            batch.clear()
+        for t, event_type, chan, notenum, velocity, program, track, source in rows.tolist():
+            batch, midi_chan = self.batches[chan // CHANNELS_PER_PORT], chan % CHANNELS_PER_PORT
+            if self.channel_inst[chan] != program:
+                batch.append((PROGRAM_CHANGE_STATUS | midi_chan, program, 0))
+                self.channel_inst[chan] = program
+            if event_type == NOTE_ON:
+                batch.append((NOTE_ON_STATUS | midi_chan, notenum, velocity))
+                self.on_items[(chan, notenum)] = source
+            else:
+                batch.append((NOTE_OFF_STATUS | midi_chan, notenum, velocity))
+                self.on_items.pop((chan, notenum), None)
+        for port, batch in enumerate(self.batches):
+            if not batch:
+                continue
+            sent = self.clock.now_ns()
+            self.ports[port].send_batch(batch)
+            call = self.clock.now_ns() - sent
+            for status, data1, data2 in batch:
+                if status & 0xF0 != PROGRAM_CHANGE_STATUS:
+                    self.stats.record(self.deadline_ns, sent, call, port * CHANNELS_PER_PORT + (status & 0x0F),
+                                      self.backend)
+
+    def get_to_play(self, score):
+        return self.get_to_play_events(self.score_to_tracks(score))
+
+    def get_to_play_events(self, tracks) -> Timeline:
+        return build_timeline(tracks)
+
+    def score_to_tracks(self, score: stream.Score) -> List[Tuple[int, List[NoteEvent]]]:
+        return [(self.get_instrument_number(part), part_to_events(part)) for part in score.parts]
+
+    def get_instrument_number(self, part):
         insts = part.getElementsByClass('Instrument')
         inum = 0
         if insts is not None and len(insts) > 0:
             inst = insts[0]
             inum = inst.midiProgram if inst.midiProgram is not None else 0
-        chan = unused_channels[0]
-        unused_channels.remove(chan)
-        return inum, chan
-
-    def add_to_dict_list(self, sd, key, param):
-        if key in sd:
-            sd[key].append(param)
-        else:
-            sd[key] = [param]
+        return inum
 
     def stop_all_playing_notes(self):
-        on = [(ncr, inst, chan) for (ncr, inst, chan) in self.on_items.values()]
-        for (ncr, inst, chan) in on:
-            self.process_one(ncr, False, inst, chan, True)
+        for chan, notenum in self.on_items:
+            self.chan_synths[chan].note_off(notenum, chan % CHANNELS_PER_PORT, 0)
         self.on_items.clear()
 
 
@@ -0,0 +1,216 @@
+import bisect
+import struct
+from typing import Dict, List, Tuple
+
+import mido
+import numpy as np
+from mido.midifiles.meta import encode_variable_int
+from mido.midifiles.midifiles import write_chunk
+
+from music21_addons.channels import split_channel, virtual_channel
+from music21_addons.tempo_map import TempoMap
+from music21_addons.timeline import Timeline, NOTE_ON
+
+TICKS_PER_BEAT = 480
+GRID = 4  # imported notes are quantized to 1/GRID of a beat (sixteenths)
+# Grid lengths that onetrack can write as one item, longest first, with their duration strings
+ITEM_LENGTHS = [(16, 'w'), (12, 'h.'), (8, 'h'), (6, 'q.'), (4, ''), (3, 't.'), (2, 't'), (1, 's')]
+NOTE_NAMES = ['C', 'C#', 'D', 'E-', 'E', 'F', 'F#', 'G', 'A-', 'A', 'B-', 'B']
+MIN_NOTE, MAX_NOTE = 12, 119  # C0 and B8, the range onetrack octaves cover
+END_OF_TRACK = mido.MetaMessage('end_of_track')
+
+
+def encode_messages(messages) -> bytes:
+    """MTrk data for mido messages, each with its delta time."""
+    data = bytearray()
+    for msg in messages:
+        data.extend(encode_variable_int(msg.time))
+        data.extend(msg.bytes())
+    return bytes(data)
+
+
+def encode_notes(ticks: np.ndarray, status: np.ndarray, notes: np.ndarray, velocities: np.ndarray,
+                 start=0) -> bytes:
+    """MTrk data for three byte channel messages at absolute ``ticks``, following a message at ``start``.
+
+    The messages are encoded all at once with numpy.
+
+    Each message is its delta time as a variable length quantity of up to
+    four bytes, then its three bytes; the rows are built padded to seven
+    bytes and the padding masked out.
+    """
+    deltas = np.diff(ticks, prepend=start)
+    sizes = 1 + (deltas >= 1 << 7) + (deltas >= 1 << 14) + (deltas >= 1 << 21)
+    rows = np.empty((len(ticks), 7), dtype=np.uint8)
+    for k in range(4):
+        rows[:, k] = ((deltas >> (7 * (3 - k))) & 0x7F) | (0x80 if k < 3 else 0)
+    rows[:, 4] = status
+    rows[:, 5] = notes
+    rows[:, 6] = velocities
+    return rows[np.arange(7) >= (4 - sizes)[:, None]].tobytes()
+
+
+def write_smf(timeline: Timeline, tempo_map: TempoMap, path, ticks_per_beat=TICKS_PER_BEAT):
+    """Write a type 1 Standard MIDI File straight from the compiled timeline.
+
+    Track 0 holds the tempo map, then there is one MIDI track per timeline
+    track. Tracks on ports past the first get a midi_port meta message.
+    Each track sets its program right before its first note, since tracks
+    that never sound together may share a channel.
+    Meta and program change messages are encoded by mido; the notes, which
+    are nearly all of the file, are encoded from the timeline columns in
+    one go rather than as a mido message each.
+    """
+    conductor = []
+    last = 0
+    for beat, bpm in zip(tempo_map.beats.tolist(), (60 / tempo_map.sec_per_beat).tolist()):
+        tick = int(round(beat * ticks_per_beat))
+        conductor.append(mido.MetaMessage('set_tempo', tempo=mido.bpm2tempo(bpm), time=tick - last))
+        last = tick
+    chunks = [encode_messages(conductor + [END_OF_TRACK])]
+
+    events = timeline.events
+    for track, vchan in enumerate(timeline.channels.track_channels):
+        port, chan = split_channel(max(vchan, 0))
+        header = [mido.MetaMessage('track_name', name=f'Track {track + 1}')]
+        if port:
+            header.append(mido.MetaMessage('midi_port', port=port))
+        rows = events[events['track'] == track]
+        ticks = np.rint(rows['time'] * ticks_per_beat).astype(np.int64)
+        start = 0
+        if vchan >= 0 and len(rows):
+            start = int(ticks[0])
+            header.append(mido.Message('program_change', channel=chan, program=int(rows['program'][0]), time=start))
+        status = np.where(rows['type'] == NOTE_ON, 0x90, 0x80) | chan
+        notes = encode_notes(ticks, status, np.minimum(rows['note'], 127), np.minimum(rows['velocity'], 127), start)
+        end = [END_OF_TRACK.copy(time=0)]
+        chunks.append(encode_messages(header) + notes + encode_messages(end))
+
+    with open(path, 'wb') as f:
+        write_chunk(f, b'MThd', struct.pack('>hhh', 1, len(chunks), ticks_per_beat))
+        for chunk in chunks:
+            write_chunk(f, b'MTrk', chunk)
+
+
+def pitch_name(note) -> str:
+    while note < MIN_NOTE:
+        note += 12
+    while note > MAX_NOTE:
+        note -= 12
+    octave = note // 12 - 1
+    return NOTE_NAMES[note % 12] + ('' if octave == 4 else str(octave))
+
+
+def split_length(length) -> List[Tuple[int, str]]:
+    """Grid ``length`` as the longest item lengths adding up to it."""
+    pieces = []
+    for item_length, name in ITEM_LENGTHS:
+        while length >= item_length:
+            pieces.append((item_length, name))
+            length -= item_length
+    return pieces
+
+
+def notes_to_onetrack(notes: List[Tuple[int, int, int, int]], tempos: List[Tuple[int, float]]) -> str:
+    """Onetrack text for (start, end, note, velocity) notes and (start, bpm) tempo changes, in grid units.
+
+    Notes starting together become a chord. Each note or chord lasts until
+    the next one starts at most, with rests filling any gaps, and is cut to
+    the longest single item length that fits. Tempo changes go in at the
+    first item boundary at or after their time.
+    """
+    onsets = {}  # type: Dict[int, List[Tuple[int, int, int, int]]]
+    for n in notes:
+        onsets.setdefault(n[0], []).append(n)
+    starts = sorted(onsets)
+    tempos = sorted(tempos)
+    items = []  # type: List[str]
+    cursor = 0
+    velocity = None
+    t = 0
+
+    def rest(until):
+        nonlocal cursor
+        for length, name in split_length(until - cursor):
+            items.append('r' + name)
+        cursor = max(cursor, until)
+
+    for i, start in enumerate(starts + [None]):
+        while t < len(tempos) and (start is None or tempos[t][0] <= start):
+            if tempos[t][0] > cursor:
+                rest(tempos[t][0])
+            items.append(f'tempo:{int(round(tempos[t][1]))}')
+            t += 1
+        if start is None:
+            break
+        rest(start)
+        group = sorted(onsets[start], key=lambda n: n[2])
+        end = max(n[1] for n in group)
+        if i + 1 < len(starts):
+            end = min(end, starts[i + 1])
+        pieces = split_length(max(end - start, 1))
+        length, name = pieces[0]
+        pitches = list(dict.fromkeys(pitch_name(n[2]) for n in group))
+        group_velocity = max(n[3] for n in group)
+        if len(pitches) == 1:
+            if group_velocity != velocity:
+                items.append(f'v:{group_velocity}')
+                velocity = group_velocity
+            items.append(pitches[0] + name)
+        else:
+            # to_events shares a chord's volume between its pitches
+            items.append('[' + ' '.join(pitches) + ']' + name + f':{group_velocity * len(pitches)}')
+        cursor = start + length
+    return '\n'.join(' '.join(items[i:i + 16]) for i in range(0, len(items), 16))
+
+
+def read_smf(path) -> List[Tuple[int, int, str]]:
+    """(virtual channel, program, onetrack text) for the notes of every track, channel and program of a MIDI file.
+
+    Messages are read with mido and turned into text directly. The notes of
+    a MIDI track are split by channel, and by the program the channel had
+    when each note started, so that every piece plays on one instrument.
+    Times are quantized to 1/GRID of a beat. Tempo changes go into the text
+    of the first piece.
+    """
+    mid = mido.MidiFile(path)
+    ticks_per_grid = mid.ticks_per_beat / GRID
+    played = []  # type: List[Tuple[int, int, int, int, int, int]]
+    changes = {}  # type: Dict[int, List[Tuple[int, int]]]
+    tempos = []  # type: List[Tuple[int, float]]
+    for track_index, track in enumerate(mid.tracks):
+        tick = 0
+        port = 0
+        sounding = {}  # type: Dict[Tuple[int, int], Tuple[int, int]]
+        for msg in track:
+            tick += msg.time
+            kind = msg.type
+            if kind == 'note_on' and msg.velocity > 0:
+                sounding[(msg.channel, msg.note)] = (tick, msg.velocity)
+            elif kind == 'note_off' or kind == 'note_on':
+                started = sounding.pop((msg.channel, msg.note), None)
+                if started is not None:
+                    played.append((track_index, virtual_channel(port, msg.channel), started[0], tick, msg.note,
+                                   started[1]))
+            elif kind == 'program_change':
+                changes.setdefault(virtual_channel(port, msg.channel), []).append((tick, msg.program))
+            elif kind == 'set_tempo':
+                tempos.append((int(round(tick / ticks_per_grid)), mido.tempo2bpm(msg.tempo)))
+            elif kind == 'midi_port':
+                port = msg.port
+
+    # A channel's program is shared by all tracks, so it is looked up by time once every track is read
+    for vchan_changes in changes.values():
+        vchan_changes.sort(key=lambda change: change[0])
+    change_ticks = {vchan: [tick for tick, program in vchan_changes] for vchan, vchan_changes in changes.items()}
+    notes = {}  # type: Dict[Tuple[int, int, int], List[Tuple[int, int, int, int]]]
+    for track_index, vchan, start, end, note, velocity in played:
+        i = bisect.bisect_right(change_ticks.get(vchan, []), start)
+        program = changes[vchan][i - 1][1] if i else 0
+        notes.setdefault((track_index, vchan, program), []).append(
+            (int(round(start / ticks_per_grid)), int(round(end / ticks_per_grid)), note, velocity))
+    result = []
+    for i, (track_index, vchan, program) in enumerate(sorted(notes, key=lambda k: (k[0], k[1], min(notes[k])))):
+        text = notes_to_onetrack(notes[(track_index, vchan, program)], tempos if i == 0 else [])
+        result.append((vchan, program, text))
+    return result
@@ -0,0 +1,38 @@
+from typing import Iterable, Tuple
+
+import numpy as np
+
+
+class TempoMap():
+    """Piecewise-constant tempo: ``bpm`` from beat 0, then each (beat, bpm) change in turn.
+
+    ``seconds[i]`` is the time at which segment ``i`` starts, so converting a
+    beat to seconds is a binary search for its segment plus one multiply.
+    A change at beat 0 overrides ``bpm``.
+    """
+
+    def __init__(self, bpm, changes: Iterable[Tuple[float, float]] = ()):
+        self.bpm = bpm
+        self.changes = sorted((float(beat), float(change_bpm)) for beat, change_bpm in changes)
+        beats = [0.0]
+        tempos = [float(bpm)]
+        for beat, change_bpm in self.changes:
+            if beat <= beats[-1]:
+                tempos[-1] = change_bpm
+            else:
+                beats.append(beat)
+                tempos.append(change_bpm)
+        self.beats = np.array(beats)
+        self.sec_per_beat = 60 / np.array(tempos)
+        self.seconds = np.r_[0.0, np.cumsum(np.diff(self.beats) * self.sec_per_beat[:-1])]
+
+    def with_base_tempo(self, bpm) -> 'TempoMap':
+        return TempoMap(bpm, self.changes)
+
+    def beat_to_seconds(self, beat):
+        i = np.searchsorted(self.beats, beat, side='right') - 1
+        return self.seconds[i] + (beat - self.beats[i]) * self.sec_per_beat[i]
+
+    def seconds_to_beat(self, seconds):
+        i = np.searchsorted(self.seconds, seconds, side='right') - 1
+        return self.beats[i] + (seconds - self.seconds[i]) / self.sec_per_beat[i]
@@ -0,0 +1,248 @@
+import itertools
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from music21_addons.channels import ChannelMap, allocate_channels, CHANNELS_PER_PORT
+from music21_addons.events import NoteEvent
+
+NOTE_OFF = 0
+NOTE_ON = 1
+
+EVENT_DTYPE = np.dtype([
+    ('time', 'f8'),  # beats (quarter notes) from the start of the piece
+    ('type', 'u1'),  # NOTE_OFF or NOTE_ON
+    ('chan', 'u1'),  # virtual channel, port * 16 + MIDI channel
+    ('note', 'u1'),
+    ('velocity', 'u1'),
+    ('program', 'u1'),
+    ('track', 'u2'),  # index of the track the event came from
+    ('source', 'i4'),  # index into Timeline.sources
+])
+
+SNAPSHOT_INTERVAL = 64  # rows between channel program snapshots
+
+
+class Timeline():
+    """Compiled playback timeline.
+
+    ``events`` holds one row per note-on/note-off, sorted by time with note-offs
+    ahead of note-ons at the same time. Rows with the same time form a group;
+    group ``i`` is ``events[group_starts[i]:group_starts[i + 1]]`` and plays at
+    ``group_times[i]``. ``sources`` maps the ``source`` column back to the
+    NoteEvent the row was compiled from, and ``channels`` is the ChannelMap
+    the tracks were compiled with; ``source_track`` is the track of each
+    source (-1 for events without notes).
+
+    ``program_snapshots[k]`` is the program of every virtual channel just before row
+    ``k * SNAPSHOT_INTERVAL`` (-1 if nothing has played on it yet), so the
+    channel state at any position can be restored without replaying the
+    timeline from the start.
+    """
+
+    def __init__(self, events: np.ndarray, sources: List[NoteEvent], channels: ChannelMap):
+        self.events = events
+        self.sources = sources
+        self.channels = channels
+        self.num_channels = channels.num_ports * CHANNELS_PER_PORT
+        times = events['time']
+        if len(events):
+            self.group_starts = np.flatnonzero(np.r_[True, times[1:] != times[:-1]])
+        else:
+            self.group_starts = np.zeros(0, dtype=np.intp)
+        self.group_times = times[self.group_starts]
+        self.group_bounds = np.r_[self.group_starts, len(events)]
+        self.program_snapshots = self.build_program_snapshots()
+        self.source_track = np.full(len(sources), -1, dtype='i4')
+        self.source_track[events['source']] = events['track']
+
+    def __len__(self):
+        return len(self.group_starts)
+
+    @property
+    def length(self) -> float:
+        """Beat at which the last note ends."""
+        return float(self.events['time'][-1]) if len(self.events) else 0.0
+
+    def group(self, i) -> np.ndarray:
+        return self.events[self.group_bounds[i]:self.group_bounds[i + 1]]
+
+    def group_at(self, beat) -> int:
+        """Index of the first group playing at or after ``beat``."""
+        return int(np.searchsorted(self.group_times, beat, side='left'))
+
+    def build_program_snapshots(self) -> np.ndarray:
+        boundaries = np.arange(0, len(self.events) + 1, SNAPSHOT_INTERVAL)
+        snapshots = np.full((len(boundaries), self.num_channels), -1, dtype='i2')
+        chans = self.events['chan']
+        for chan in np.unique(chans):
+            rows = np.flatnonzero(chans == chan)
+            last = np.searchsorted(rows, boundaries, side='left') - 1
+            played = last >= 0
+            snapshots[played, chan] = self.events['program'][rows[last[played]]]
+        return snapshots
+
+    def programs_at(self, row) -> List[int]:
+        """Program of every channel after playing all rows before ``row``."""
+        k = row // SNAPSHOT_INTERVAL
+        programs = self.program_snapshots[k].tolist()
+        for chan, program in self.events[['chan', 'program']][k * SNAPSHOT_INTERVAL:row].tolist():
+            programs[chan] = program
+        return programs
+
+    def tracks(self) -> List[Tuple[int, List[NoteEvent]]]:
+        """The (program, events) per track this timeline was compiled from."""
+        result = []
+        for track, program in enumerate(self.channels.track_programs):
+            sources = np.unique(self.events['source'][self.events['track'] == track])
+            result.append((program, [self.sources[s] for s in sources.tolist()]))
+        return result
+
+    def source_tracks(self, sources) -> Dict[int, int]:
+        """Track of each of the given sources."""
+        sources = list(sources)
+        return dict(zip(sources, self.source_track[sources].tolist()))
+
+    def with_track(self, track, program, events: List[NoteEvent]) -> 'TrackSwap':
+        """A copy of this timeline with all the events of ``track`` replaced, for MySequencer to swap in.
+
+        This does all the work that grows with the size of the piece, so that
+        it can run off the playback thread: the sources of the old events are
+        dropped and the others renumbered, so editing does not grow the
+        timeline. If the events no longer fit the track's channel (a new
+        program, or clashing with another track sharing the channel), the
+        channels of the whole piece are allocated again, and the rows of the
+        other tracks moved to their new channels.
+        """
+        channels = self.channels.with_track(track, program, events)
+        rebuilt = channels is None
+        if rebuilt:
+            tracks = self.tracks()
+            tracks[track] = (program, events)
+            channels = allocate_channels(tracks)
+        keep = (self.source_track >= 0) & (self.source_track != track)
+        source_remap = np.cumsum(keep, dtype='i4') - 1
+        source_remap[~keep] = -1
+        sources = list(itertools.compress(self.sources, keep.tolist()))
+        kept = self.events[self.events['track'] != track]
+        kept['source'] = source_remap[kept['source']]
+        if rebuilt:
+            kept['chan'] = np.maximum(np.array(channels.track_channels, dtype=np.intp), 0)[kept['track']]
+        new_rows = track_rows(events, max(channels.track_channels[track], 0), program, track, len(sources))
+        rows = new_rows[np.lexsort((new_rows['type'], new_rows['time']))]
+        # Rows at the same time are ordered by type, then track, as in build_timeline
+        ties = kept['type'].astype(np.int64) << 16 | kept['track']
+        row_ties = (rows['type'].astype(np.int64) << 16 | track).tolist()
+        at = np.searchsorted(kept['time'], rows['time'], side='left')
+        ends = np.searchsorted(kept['time'], rows['time'], side='right')
+        for i, (lo, hi) in enumerate(zip(at.tolist(), ends.tolist())):
+            if hi > lo:
+                at[i] = lo + int(np.searchsorted(ties[lo:hi], row_ties[i]))
+        timeline = Timeline(np.insert(kept, at, rows), sources + events, channels)
+        return TrackSwap(track, timeline, source_remap, new_rows, rebuilt)
+
+
+class TrackSwap():
+    """A Timeline with the events of one track replaced, and how to carry the playback state over to it.
+
+    ``source_remap[s]`` is the source in ``timeline`` of source ``s`` of the
+    timeline it was made from, or -1 for the replaced track's sources, and
+    ``rows`` are the track_rows of the new events. ``rebuilt`` is True if the
+    channels were allocated again, so that tracks may have moved channel.
+    """
+
+    def __init__(self, track, timeline: Timeline, source_remap: np.ndarray, rows: np.ndarray, rebuilt=False):
+        self.track = track
+        self.timeline = timeline
+        self.source_remap = source_remap
+        self.rows = rows
+        self.rebuilt = rebuilt
+        self.new_sources = {}  # type: Dict[Tuple[float, float, int], int]
+        first_source = int(source_remap.max(initial=-1)) + 1
+        for i, ev in enumerate(timeline.sources[first_source:], first_source):
+            for pitch in ev.pitches:
+                self.new_sources.setdefault((ev.offset, ev.duration, pitch), i)
+
+    def carry(self, old: Timeline, source, note) -> Optional[int]:
+        """Source in the new timeline of sounding ``note`` of ``source`` in ``old``.
+
+        A sounding note of the replaced track carries on as an identical note
+        of the new events if there is one, and the notes of the other tracks
+        carry on as themselves, unless their track moved to another channel.
+        None means the note must be stopped.
+        """
+        if self.source_remap[source] >= 0:
+            new = int(self.source_remap[source])
+        else:
+            ev = old.sources[source]
+            new = self.new_sources.get((ev.offset, ev.duration, note))
+        if new is None or self.timeline.channels.track_channels[self.timeline.source_track[new]] != \
+                old.channels.track_channels[old.source_track[source]]:
+            return None
+        return new
+
+    def unstarted(self, beat, sounding: Iterable[Tuple[int, int]]) -> np.ndarray:
+        """``note_key``s of the new notes that started before ``beat`` and end at or after it.
+
+        Playing on from ``beat`` never starts them, so their note-offs are not
+        to be sent, except for the (source, note) pairs in ``sounding`` that
+        carried on from a sounding note.
+        """
+        total = len(self.rows) // 2
+        on, off = self.rows[:total], self.rows[total:]
+        across = note_key(off[(on['time'] < beat) & (off['time'] >= beat)])
+        carried = np.array([source << 8 | note for source, note in sounding], dtype=np.int64)
+        return np.setdiff1d(across, carried)
+
+    def remap_keys(self, keys: np.ndarray) -> np.ndarray:
+        """``note_key``s of the old timeline as keys of the new one, leaving out the replaced track's."""
+        if not len(keys):
+            return np.zeros(0, dtype=np.int64)
+        sources = self.source_remap[keys >> 8].astype(np.int64)
+        return (sources << 8 | keys & 0xFF)[sources >= 0]
+
+
+def note_key(rows: np.ndarray) -> np.ndarray:
+    """One int64 per row identifying its (source, note)."""
+    return rows['source'].astype(np.int64) << 8 | rows['note']
+
+
+def track_rows(events: List[NoteEvent], chan, program, track, first_source) -> np.ndarray:
+    npitches = np.fromiter((len(ev.pitches) for ev in events), dtype=np.intp, count=len(events))
+    offsets = np.fromiter((ev.offset for ev in events), dtype='f8', count=len(events))
+    durations = np.fromiter((ev.duration for ev in events), dtype='f8', count=len(events))
+    velocities = np.fromiter((ev.velocity for ev in events), dtype='u1', count=len(events))
+    total = int(npitches.sum())
+    notes = np.fromiter(itertools.chain.from_iterable(ev.pitches for ev in events), dtype='u1', count=total)
+
+    rows = np.empty(2 * total, dtype=EVENT_DTYPE)
+    on, off = rows[:total], rows[total:]
+    on['time'] = np.repeat(offsets, npitches)
+    off['time'] = np.repeat(offsets + durations, npitches)
+    on['type'] = NOTE_ON
+    off['type'] = NOTE_OFF
+    on['velocity'] = off['velocity'] = np.repeat(velocities, npitches)
+    sources = np.repeat(np.arange(first_source, first_source + len(events), dtype='i4'), npitches)
+    for half in (on, off):
+        half['note'] = notes
+        half['source'] = sources
+    rows['chan'] = chan
+    rows['program'] = program
+    rows['track'] = track
+    return rows
+
+
+def build_timeline(tracks: List[Tuple[int, List[NoteEvent]]]) -> Timeline:
+    """Compile (program, events) per track into a Timeline, on the channels allocate_channels picks.
+
+    Times stay in beats, so the tempo can change without recompiling.
+    """
+    channels = allocate_channels(tracks)
+    sources = []  # type: List[NoteEvent]
+    parts = [np.zeros(0, dtype=EVENT_DTYPE)]
+    for track, (program, events) in enumerate(tracks):
+        parts.append(track_rows(events, max(channels.track_channels[track], 0), program, track, len(sources)))
+        sources.extend(events)
+    rows = np.concatenate(parts)
+    order = np.lexsort((rows['type'], rows['time']))
+    return Timeline(rows[order], sources, channels)
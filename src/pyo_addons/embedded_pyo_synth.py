@@ -161,6 +161,10 @@ class PyoSynth(Synth):
     def get_instrument_map(self) -> Optional[Dict[Tuple[str, str], int]]:
         return PyoSynth._instrument_map
 
+    def port(self, index) -> Synth:
+        """Another set of channels on the same pyo server."""
+        return self if index == 0 else PyoSynth()
+
     def create_inst(self, program):
         return PyoSynth._instrument_creator_map[program]()
 
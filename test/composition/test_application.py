@@ -0,0 +1,188 @@
+import logging
+import threading
+
+from music21 import key, meter
+
+from composition.application import Observable, Computed, Track, AudioPlayer, transaction, APSTATE_PLAYING, \
+    APSTATE_STOPPED, PREFIX_CHARS
+from music21_addons.clock import VirtualClock
+from music21_addons.sequencer import RecordingSynth
+
+IMAP = {('Piano', 'Acoustic Grand Piano'): 0, ('Strings', 'Violin'): 40}
+
+
+def recorder(obs):
+    calls = []
+    obs.changed.register(lambda old, new: calls.append((old, new)))
+    return calls
+
+
+def test_transaction_notifies_once_per_observable():
+    a, b, c = Observable(0), Observable('x'), Observable(1)
+    calls_a, calls_b, calls_c = recorder(a), recorder(b), recorder(c)
+    with transaction():
+        for i in range(1, 10):
+            a.value = i
+        b.value = 'y'
+        with transaction():
+            b.value = 'z'
+        c.value = 2
+        c.value = 1
+        assert calls_a == [] and calls_b == []
+    assert calls_a == [(0, 9)]
+    assert calls_b == [('x', 'z')]
+    assert calls_c == []
+    a.value = 10
+    assert calls_a == [(0, 9), (9, 10)]
+
+
+def test_computed_is_lazy_and_memoized():
+    a, b = Observable(1), Observable(2)
+    total = Computed(lambda: a.value + b.value, a, b)
+    invalidations = []
+    total.invalidated.register(lambda: invalidations.append(total.version))
+    assert total.value == 3 and total.value == 3
+    assert (total.misses, total.hits) == (1, 1)
+    a.value = 10
+    b.value = 20
+    assert invalidations == [1]  # stale after the first change, nothing more to report after the second
+    assert total.value == 30
+    assert total.misses == 2
+
+
+def test_computed_in_transaction():
+    a = Observable(1)
+    double = Computed(lambda: a.value * 2, a)
+    invalidations = []
+    double.invalidated.register(lambda: invalidations.append(double.value))
+    assert double.value == 2
+    with transaction():
+        a.value = 2
+        assert double.value == 4  # reads inside the transaction are up to date
+        a.value = 3
+        assert invalidations == []
+    assert invalidations == [6]
+
+
+def test_computed_set_checks_version():
+    a = Observable(1)
+    square = Computed(lambda: a.value ** 2, a)
+    version = square.version
+    a.value = 5
+    assert not square.set(1, version)
+    assert square.peek() is None
+    assert square.set(25, square.version)
+    assert square.value == 25 and square.misses == 0
+
+
+def test_track_compile_cache():
+    timesig, tkey = Observable(meter.TimeSignature('4/4')), Observable(key.Key('C'))
+    track = Track(timesig, tkey, IMAP)
+    track.instrument.value = 'Piano:Acoustic Grand Piano'
+    track.tiny.value = 'C D E'
+    events = track.get_events()[0]
+    assert [ev.pitches for ev in events] == [(60,), (62,), (64,)]
+    assert track.get_events()[0] is events
+    assert (track.cache_hits, track.cache_misses) == (1, 1)
+
+    changes = [(track.tiny, 'C D F'), (track.instrument, 'Strings:Violin'), (tkey, key.Key('G')),
+               (timesig, meter.TimeSignature('3/4'))]
+    for misses, (obs, value) in enumerate(changes, 2):
+        obs.value = value
+        assert track.compiled.peek() is None
+        track.get_events()
+        assert (track.cache_hits, track.cache_misses) == (1, misses)
+
+
+def headless_player():
+    clock = VirtualClock()
+    synth = RecordingSynth(clock)
+    return AudioPlayer(synth, clock=clock), synth
+
+
+def new_track(text, timesig=None, tkey=None):
+    track = Track(timesig or Observable(meter.TimeSignature('4/4')), tkey or Observable(key.Key('C')), IMAP)
+    track.instrument.value = 'Piano:Acoustic Grand Piano'
+    track.tiny.value = text
+    return track
+
+
+def block_compiler(player):
+    """Keep the compile thread busy until the returned event is set."""
+    release = threading.Event()
+    player.compiler.submit(release.wait)
+    return release
+
+
+def play_to_end(player, tracks):
+    """Play on the virtual clock, which gets to the end at once; returns the future of play."""
+    states = []
+    stopped = threading.Event()
+
+    @player.state.changed.register
+    def state_changed(old_value, new_value):
+        states.append(new_value)
+        if new_value == APSTATE_STOPPED:
+            stopped.set()
+
+    future = player.play(tracks, None, 60)
+    assert future.result(5)
+    assert stopped.wait(5)
+    assert APSTATE_PLAYING in states
+    return future
+
+
+def test_play_compiles_in_background():
+    player, synth = headless_player()
+    long_line = ' '.join(['C', 'D', 'E', 'F'] * (PREFIX_CHARS // 4))
+    tracks = [new_track('C D E'), new_track(long_line)]
+    play_to_end(player, tracks)
+    assert [(t.cache_hits, t.cache_misses) for t in tracks] == [(0, 1), (0, 1)]
+    # the long track, which has no line break, started playing from the prefix compiled before playback
+    assert [e[3] for e in synth.events if e[1] == 'note_on' and e[2] == 1][:2] == [60, 62]
+    assert tracks[1].compiled.peek() is not None  # the full compile was kept
+
+    del synth.events[:]
+    play_to_end(player, tracks)
+    assert [(t.cache_hits, t.cache_misses) for t in tracks] == [(1, 1), (1, 1)]
+    assert len([e for e in synth.events if e[1] == 'note_on']) == 3 + len(long_line.split())
+
+
+def test_play_warns_about_tracks_that_do_not_parse(caplog):
+    player, synth = headless_player()
+    long_line = ' '.join(['C', 'D'] * (PREFIX_CHARS // 2))
+    tracks = [new_track('C D ]'), new_track(long_line + ' ]'), new_track('E')]
+    with caplog.at_level(logging.WARNING, logger='composition.application'):
+        play_to_end(player, tracks)
+    warnings = [r.getMessage() for r in caplog.records if r.levelno == logging.WARNING]
+    assert len(warnings) == 2
+    assert warnings[0].startswith('Track 1 does not parse, it plays silent: ')
+    assert warnings[1].startswith('Track 2 does not parse, only its start plays: ')
+    assert 64 in [e[3] for e in synth.events if e[1] == 'note_on']
+
+
+def test_stop_cancels_compile():
+    player, synth = headless_player()
+    release = block_compiler(player)
+    future = player.play([new_track('C D E')], None, 60)
+    player.stop()
+    release.set()
+    assert future.result(5) is False
+    assert player.state.value == APSTATE_STOPPED
+    assert player.sequencer.sync(5)
+    assert synth.events == []
+
+
+def test_edit_while_compiling_restarts_compile():
+    player, synth = headless_player()
+    track = new_track('C D E')
+    stopped = threading.Event()
+    player.state.changed.register(lambda old_value, new_value: old_value == APSTATE_PLAYING and stopped.set())
+    release = block_compiler(player)
+    future = player.play([track], None, 60)
+    track.tiny.value = 'G A'
+    player.track_edited(track)
+    release.set()
+    assert future.result(5) is False
+    assert stopped.wait(5)
+    assert [e[3] for e in synth.events if e[1] == 'note_on'] == [67, 69]
@@ -0,0 +1,74 @@
+from composition.application import Observable
+from gui.highlighter import NowPlayingHighlighter, TAG
+from gui.tk_dispatcher import TkDispatcher
+from test_tk_dispatcher import FakeWidget, set_on_other_thread
+
+
+class FakeText():
+    """Records the ranges of each tag. The highlight must be removed from the whole text, wherever edits moved it."""
+
+    def __init__(self):
+        self.tags = {}
+
+    def tag_config(self, tag, **options):
+        self.tags.setdefault(tag, [])
+
+    def tag_add(self, tag, start, end):
+        self.tags[tag].append((start, end))
+
+    def tag_remove(self, tag, start, end):
+        assert (start, end) == ('1.0', 'end')
+        self.tags[tag] = []
+
+
+class FakeFrame():
+    def __init__(self, y, height):
+        self.y = y
+        self.height = height
+
+    def winfo_y(self):
+        return self.y
+
+    def winfo_height(self):
+        return self.height
+
+
+class FakeCanvas():
+    def __init__(self, top, height):
+        self.top = top
+        self.height = height
+
+    def canvasy(self, y):
+        return self.top + y
+
+    def winfo_height(self):
+        return self.height
+
+
+def test_highlights_move_once_per_frame():
+    widget = FakeWidget()
+    canvas = FakeCanvas(0, 100)
+    highlighter = NowPlayingHighlighter(TkDispatcher(widget), canvas)
+    on_items = [Observable(None), Observable(None)]
+    texts = [FakeText(), FakeText()]
+    frames = [FakeFrame(0, 50), FakeFrame(200, 50)]
+    for on_item, text, frame in zip(on_items, texts, frames):
+        highlighter.connect(on_item, text, frame)
+
+    for location in [(1, 1, 1, 2), (1, 3, 1, 4), (2, 1, 2, 6)]:
+        set_on_other_thread(on_items[0], location)
+    set_on_other_thread(on_items[1], (1, 1, 1, 2))
+    widget.run_after()
+    assert texts[0].tags[TAG] == [('2.0', '2.5')]
+    # the second track is scrolled out of view: left alone until it comes back
+    assert texts[1].tags[TAG] == []
+    assert (highlighter.moves, highlighter.frames) == (1, 1)
+
+    canvas.top = 180
+    widget.run_after()
+    assert texts[1].tags[TAG] == [('1.0', '1.1')]
+
+    set_on_other_thread(on_items[1], None)
+    widget.run_after()
+    assert texts[1].tags[TAG] == []
+    assert highlighter.moves == 3
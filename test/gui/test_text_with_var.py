@@ -0,0 +1,23 @@
+from gui.text_with_var import token_edits
+
+
+def apply_edits(text, edits):
+    for pos, removed, inserted in edits:
+        assert text[pos:pos + len(removed)] == removed
+        text = text[:pos] + inserted + text[pos + len(removed):]
+    return text
+
+
+def test_token_edits_touch_only_changed_tokens():
+    old = "C D E F\nG A B c"
+    new = "C# D E F\nG A B- c"
+    edits = token_edits(old, new)
+    assert edits == [(12, 'B', 'B-'), (1, '', '#')]
+    assert apply_edits(old, edits) == new
+
+
+def test_token_edits_round_trip():
+    cases = [("", "C D"), ("C D", ""), ("C D E", "C D E"), ("[c e g]h v:80 A", "[c e- g]h v:90 A B"),
+             ("C\n\nD", "C\nD\n")]
+    for old, new in cases:
+        assert apply_edits(old, token_edits(old, new)) == new
@@ -0,0 +1,72 @@
+import threading
+
+from composition.application import Observable
+from gui.tk_dispatcher import TkDispatcher
+
+
+class FakeWidget():
+    """Just enough of a Tk widget for TkDispatcher: ``run_after`` runs the callbacks scheduled so far."""
+
+    def __init__(self):
+        self.scheduled = []
+
+    def after(self, ms, fn):
+        self.scheduled.append(fn)
+
+    def run_after(self):
+        scheduled, self.scheduled = self.scheduled, []
+        for fn in scheduled:
+            fn()
+
+
+def set_on_other_thread(obs, *values):
+    def run():
+        for value in values:
+            obs.value = value
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+
+
+def test_changes_from_other_threads_collapse_per_frame():
+    widget = FakeWidget()
+    dispatcher = TkDispatcher(widget)
+    obs = Observable(0)
+    calls = []
+    frames = []
+    dispatcher.observe(obs)(lambda old_value, new_value: calls.append((old_value, new_value)))
+    dispatcher.on_frame(lambda: frames.append(list(calls)))
+
+    set_on_other_thread(obs, 1, 2, 3)
+    assert calls == []
+    widget.run_after()
+    assert calls == [(0, 3)]
+    assert frames == [[(0, 3)]]
+    assert (dispatcher.dispatched, dispatcher.collapsed) == (1, 2)
+
+    # on the Tk thread a change is handled at once, taking over a queued one
+    set_on_other_thread(obs, 4)
+    obs.value = 5
+    assert calls == [(0, 3), (3, 5)]
+    widget.run_after()
+    assert calls == [(0, 3), (3, 5)]
+
+
+def test_failing_callback_does_not_drop_the_frame():
+    widget = FakeWidget()
+    dispatcher = TkDispatcher(widget)
+    a, b = Observable(0), Observable(0)
+    calls = []
+
+    @dispatcher.observe(a)
+    def fail(old_value, new_value):
+        raise RuntimeError('callback failed')
+
+    dispatcher.observe(b)(lambda old_value, new_value: calls.append(new_value))
+    dispatcher.on_frame(lambda: calls.append('frame'))
+    set_on_other_thread(a, 1)
+    set_on_other_thread(b, 1)
+    widget.run_after()
+    assert calls == [1, 'frame']
+    assert widget.scheduled  # the pump keeps going
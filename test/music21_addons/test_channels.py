@@ -0,0 +1,51 @@
+from music21_addons.channels import allocate_channels, split_channel
+from music21_addons.onetrack import parse_onetrack, to_events
+
+
+def test_every_track_gets_a_channel_while_the_port_has_some():
+    cmap = allocate_channels([(0, to_events(parse_onetrack("C D"))), (40, to_events(parse_onetrack("E F"))),
+                              (0, to_events(parse_onetrack("G A"))), (40, [])])
+    assert cmap.track_channels == [0, 1, 2, -1]
+    assert cmap.num_ports == 1
+
+
+def filled_port(tracks):
+    """The 15 tracks of programs 0 to 14 that fill the first port from beat 0 to 2, then ``tracks``."""
+    return [(program, to_events(parse_onetrack("C D"))) for program in range(15)] + tracks
+
+
+def test_same_program_shares_a_channel_once_the_port_is_full():
+    cmap = allocate_channels(filled_port([(0, to_events(parse_onetrack("E F"))),
+                                          (0, to_events(parse_onetrack("G A")))]))
+    assert cmap.track_channels[15] == cmap.track_channels[16] == cmap.track_channels[0]
+    assert cmap.num_ports == 1
+
+
+def test_same_pitch_at_the_same_time_never_shares():
+    cmap = allocate_channels(filled_port([(0, to_events(parse_onetrack("Ch")))]))
+    assert split_channel(cmap.track_channels[15]) == (1, 0)
+
+
+def test_tracks_that_never_overlap_reuse_a_channel():
+    cmap = allocate_channels(filled_port([(40, to_events(parse_onetrack("rh E F"))),
+                                          (41, to_events(parse_onetrack("rh Eh")))]))
+    assert cmap.track_channels[15:] == [cmap.track_channels[0], cmap.track_channels[1]]
+
+
+def test_spill_to_next_port():
+    cmap = allocate_channels([(program, to_events(parse_onetrack("C D"))) for program in range(20)])
+    assert [split_channel(c) for c in cmap.track_channels[14:17]] == [(0, 15), (1, 0), (1, 1)]
+    assert 9 not in cmap.track_channels
+    assert cmap.num_ports == 2
+    assert 'port 1 ch  4 program 19' in cmap.report()
+
+
+def test_with_track():
+    cmap = allocate_channels([(program, to_events(parse_onetrack("C D"))) for program in range(15)] +
+                             [(40, to_events(parse_onetrack("rh E F"))), (0, to_events(parse_onetrack("E")))])
+    assert cmap.track_channels[16] == cmap.track_channels[0] == cmap.track_channels[15]
+    assert cmap.with_track(0, 0, to_events(parse_onetrack("Ch"))).track_notes[0] == {60: [(0.0, 2.0)]}
+    assert cmap.with_track(0, 0, to_events(parse_onetrack("C D E"))) is None  # runs into the other program
+    assert cmap.with_track(0, 0, to_events(parse_onetrack("E"))) is None  # sounds the same note as track 16
+    assert cmap.with_track(0, 1, to_events(parse_onetrack("C"))) is None
+    assert cmap.with_track(1, 40, []) is cmap
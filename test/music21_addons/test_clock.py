@@ -0,0 +1,19 @@
+import threading
+
+from music21_addons.clock import MonotonicClock, NS_PER_MS
+
+
+def test_sleep_until_deadline():
+    clock = MonotonicClock()
+    deadline = clock.now_ns() + 20 * NS_PER_MS
+    assert clock.sleep_until(deadline)
+    assert clock.now_ns() >= deadline
+
+
+def test_sleep_until_interrupted():
+    clock = MonotonicClock()
+    interrupt = threading.Event()
+    threading.Timer(0.01, interrupt.set).start()
+    start = clock.now_ns()
+    assert not clock.sleep_until(start + 5000 * NS_PER_MS, interrupt)
+    assert clock.now_ns() - start < 1000 * NS_PER_MS
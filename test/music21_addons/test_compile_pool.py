@@ -0,0 +1,34 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from music21_addons.compile_pool import compile_onetrack, compile_tracks, onetrack_prefix
+from music21_addons.onetrack import parse_onetrack, to_events, to_tempo_changes
+
+
+def test_compiled_track_round_trip():
+    text = "C D:90 [e g]h v:80 r\ntempo:90 A-3s"
+    items = parse_onetrack(text)
+    compiled = compile_onetrack(text)
+    events = compiled.events()
+    assert [(ev.offset, ev.duration, ev.pitches, ev.velocity) for ev in events] == \
+        [(ev.offset, ev.duration, ev.pitches, ev.velocity) for ev in to_events(items)]
+    assert [ev.source.location() for ev in events] == [ev.source.location() for ev in to_events(items)]
+    assert compiled.tempo_changes == to_tempo_changes(items)
+
+
+def test_compile_tracks_in_worker_processes():
+    texts = ["C D E", "[c e g]w", "", "tempo:100 Gh", "C ]"]
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        compiled, errors = zip(*compile_tracks(texts, executor))
+    assert [len(c) for c in compiled[:4]] == [3, 1, 0, 1]
+    assert errors[:4] == (None,) * 4
+    assert compiled[4] is None and ']' in errors[4]
+    assert compiled[1].events()[0].pitches == (60, 64, 67)
+    assert compiled[3].tempo_changes == [(0.0, 100.0)]
+
+
+def test_onetrack_prefix():
+    assert onetrack_prefix("C D E", 10) == "C D E"
+    assert onetrack_prefix("C D E F\nG A", 9) == "C D E F"
+    assert onetrack_prefix("C D E F G A", 8) == "C D E F"
+    # never cuts a chord in two
+    assert onetrack_prefix("C [c e g] A", 7) == "C "
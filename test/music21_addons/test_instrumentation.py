@@ -0,0 +1,47 @@
+import logging
+
+from music21_addons.instrumentation import PlaybackStats
+
+
+def test_summary_per_backend_and_channel():
+    stats = PlaybackStats()
+    fluid = stats.backend_id('PyFluidSynth')
+    mido = stats.backend_id('MidoSynth')
+    for i in range(100):
+        stats.record(i * 1000000, i * 1000000 + 200000, 5000, 0, fluid)
+        stats.record(i * 1000000, i * 1000000 + 3000000, 5000, 1, mido)
+    summary = stats.summary()
+    assert summary[('PyFluidSynth', 0)]['events'] == 100
+    assert summary[('PyFluidSynth', 0)]['lateness_p50'] == 200
+    assert summary[('MidoSynth', 1)]['lateness_max'] == 3000
+    assert summary[('MidoSynth', 1)]['jitter'] == 0
+
+    hists = stats.histograms()
+    assert hists[('PyFluidSynth', 0)]['lateness'].tolist() == [0, 0, 100, 0, 0, 0, 0, 0, 0, 0]
+    assert hists[('MidoSynth', 1)]['call'].tolist() == [100, 0, 0, 0, 0, 0, 0, 0, 0, 0]
+    assert 'MidoSynth ch 1' in stats.report()
+
+
+def test_ring_buffer_keeps_recent_events():
+    stats = PlaybackStats(capacity=16)
+    backend = stats.backend_id('TextSynth')
+    for i in range(40):
+        stats.record(0, i * 1000, 0, 2, backend)
+    assert stats.count == 40
+    assert len(stats.recent()) == 16
+    assert sorted(stats.recent()['sent'].tolist()) == [i * 1000 for i in range(24, 40)]
+
+
+def test_dump_builds_report_only_when_logged(monkeypatch, caplog):
+    stats = PlaybackStats()
+    stats.record(0, 1000, 0, 0, stats.backend_id('TextSynth'))
+    reports = []
+    report = stats.report
+    monkeypatch.setattr(stats, 'report', lambda: reports.append(1) or report())
+    with caplog.at_level(logging.WARNING, logger='music21_addons.instrumentation'):
+        stats.dump()
+    assert reports == []
+    with caplog.at_level(logging.INFO, logger='music21_addons.instrumentation'):
+        stats.dump()
+    assert reports == [1]
+    assert 'TextSynth ch 0' in caplog.text
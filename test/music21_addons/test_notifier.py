@@ -0,0 +1,81 @@
+import threading
+import time
+
+from music21_addons.notifier import PlaybackNotifier
+
+
+def test_updates_are_coalesced():
+    delivered = []
+    gate = threading.Event()
+
+    def deliver(pos):
+        gate.wait()
+        delivered.append(pos)
+
+    notifier = PlaybackNotifier(deliver, max_rate=1000)
+    for pos in range(100):
+        notifier.post(pos)
+    gate.set()
+    done = threading.Event()
+    notifier.call(done.set)
+    assert done.wait(5)
+    notifier.close()
+
+    assert delivered[-1] == 99
+    stats = notifier.stats()
+    assert stats['posted'] == 100
+    assert stats['delivered'] == len(delivered)
+    assert stats['delivered'] + stats['coalesced'] + stats['dropped'] == 100
+    assert stats['coalesced'] > 0
+
+
+def test_full_queue_drops_without_blocking():
+    gate = threading.Event()
+    notifier = PlaybackNotifier(lambda pos: gate.wait(), maxsize=4)
+    start = time.perf_counter()
+    for pos in range(50):
+        notifier.post(pos)
+    assert time.perf_counter() - start < 0.5
+    assert notifier.stats()['dropped'] > 0
+    gate.set()
+    notifier.close()
+
+
+def test_rate_limited():
+    delivered = []
+    notifier = PlaybackNotifier(delivered.append, max_rate=10)
+    end = time.perf_counter() + 0.5
+    pos = 0
+    while time.perf_counter() < end:
+        notifier.post(pos)
+        pos += 1
+        time.sleep(0.001)
+    notifier.close()
+    assert len(delivered) <= 8
+    assert delivered[-1] == pos - 1
+
+
+def test_calls_follow_earlier_updates():
+    order = []
+    notifier = PlaybackNotifier(lambda pos: order.append(('update', pos)))
+    notifier.post(1)
+    notifier.call(order.append, 'finished')
+    notifier.close()
+    assert order == [('update', 1), 'finished']
+
+
+def test_call_never_blocks():
+    gate = threading.Event()
+    notifier = PlaybackNotifier(lambda pos: gate.wait(), maxsize=4)
+    calls = []
+    start = time.perf_counter()
+    for pos in range(10):
+        notifier.post(pos)
+        notifier.call(calls.append, pos)
+    assert time.perf_counter() - start < 0.5
+    gate.set()
+    done = threading.Event()
+    notifier.call(done.set)
+    assert done.wait(5)
+    notifier.close()
+    assert calls == list(range(10))
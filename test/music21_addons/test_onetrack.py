@@ -1,4 +1,11 @@
-from music21_addons.onetrack import to_text, parse_onetrack
+import random
+
+from lark.exceptions import LarkError
+from music21 import note
+from music21_addons.events import part_to_events
+
+from music21_addons.onetrack import to_text, parse_onetrack, onetrack_parser, OneTrackTransformer, OneTrackDocument, \
+    pitch_to_midi, to_events, to_part, PNote, to_tempo_changes, part_to_onetrack, text_diff
 
 
 def test_note():
@@ -29,3 +36,105 @@ def test_list():
     rs = to_text(parse_onetrack(s))
     print(rs)
     assert rs == s
+
+
+def test_parser_is_shared():
+    assert onetrack_parser() is onetrack_parser()
+    uncached = onetrack_parser(cache=False)
+    assert uncached is not onetrack_parser() and uncached is onetrack_parser(cache=False)
+    assert onetrack_parser(parser='earley').options.parser == 'earley'
+
+
+def test_lalr_matches_earley():
+    s = "C-3 Aq A:100 Aq:100 [a b4]q [c d]q:100 v:60\nr Rw Ah. bs [C# e-5]t.:80"
+    earley = OneTrackTransformer().transform(onetrack_parser(parser='earley').parse(s))
+    lalr = OneTrackTransformer().transform(onetrack_parser().parse(s))
+    assert repr(earley) == repr(lalr)
+
+
+def assert_same_as_full_parse(doc):
+    full = OneTrackDocument(doc.text)
+    assert repr(doc.items) == repr(full.items)
+    assert doc.spans == full.spans
+    assert doc.velocities == full.velocities
+
+
+def test_incremental_edit():
+    doc = OneTrackDocument("C D v:80 E\n[a b]q F:100 G")
+    doc.apply_edit(2, 'D', 'Dh')
+    assert doc.text == "C Dh v:80 E\n[a b]q F:100 G"
+    assert doc.partial_parses == 1
+    assert_same_as_full_parse(doc)
+
+
+def test_incremental_duration_after_note():
+    doc = OneTrackDocument("C D E")
+    doc.update("C D q E")
+    assert str(doc.items[1]) == 'Dq'
+    assert_same_as_full_parse(doc)
+
+
+def test_incremental_setvol_carried_across_splice():
+    doc = OneTrackDocument("C v:80 D E F\nG A B")
+    assert doc.velocities[-1] == 80
+    doc.update("C v:90 D E F\nG A B")
+    assert doc.velocities[-1] == 90
+    assert_same_as_full_parse(doc)
+    doc.update("C D E F\nG A B")
+    assert doc.velocities == [60] * 7
+    assert_same_as_full_parse(doc)
+
+
+def test_incremental_line_shift():
+    doc = OneTrackDocument("C D\nE F\nG")
+    doc.update("C\n\nD\nE F\nG")
+    assert doc.items[-1].location() == (5, 1, 5, 2)
+    assert_same_as_full_parse(doc)
+
+
+def test_incremental_random_edits():
+    rnd = random.Random(0)
+    fragments = ['A', 'q', ' ', '[a b]', 'v:70', ':90', '\n', 'C#5h.', ' Bt', 'r']
+    text = ' '.join(['C', 'Dq', '[e g]h', 'v:90', 'F:100', 'G\nA', 'B-t.', 'r', 'c5'] * 4)
+    doc = OneTrackDocument(text)
+    for _ in range(200):
+        pos = rnd.randint(0, len(doc.text))
+        new_text = doc.text[:pos] + rnd.choice(fragments) + doc.text[pos + rnd.randint(0, 4):]
+        try:
+            doc.update(new_text)
+        except LarkError:
+            continue
+        assert_same_as_full_parse(doc)
+
+
+def test_pitch_to_midi():
+    for p in ['C', 'C-3', 'a', 'b4', 'E#', 'B#8', 'g-2', 'F#']:
+        assert pitch_to_midi(p) == note.Note(p).pitch.midi
+
+
+def test_to_events_matches_part():
+    s = "C-3 Aq A:100 r Aq:100 v:80 [a b4]q [c d]q:100 v:60 Rh Eh. [C E G]t."
+    items = parse_onetrack(s)
+    events = to_events(items)
+    from_part = part_to_events(to_part(items)[0])
+    assert len(events) == len(from_part) == 8
+    for ev, pev in zip(events, from_part):
+        assert (ev.offset, ev.duration, ev.pitches, ev.velocity) == \
+               (pev.offset, pev.duration, pev.pitches, pev.velocity)
+    assert isinstance(events[0].source, PNote)
+
+
+def test_tempo_changes():
+    items = parse_onetrack("C tempo:90 Dh [e g]t tempo:120 A")
+    assert to_text(items) == "C tempo:90 Dh [e g]t tempo:120 A"
+    assert to_tempo_changes(items) == [(1.0, 90.0), (3.5, 120.0)]
+    assert 'tempo:90' in part_to_onetrack(to_part(items)[0])
+    assert parse_onetrack("At")[0].duration == 't'
+
+
+def test_text_diff():
+    assert text_diff("C D E", "C D E") == (5, '', '')
+    assert text_diff("C D E", "C Dh E") == (3, '', 'h')
+    assert text_diff("C D E", "E") == (0, 'C D ', '')
+    assert text_diff("aaa", "aaaa") == (3, '', 'a')
+    assert text_diff("", "C") == (0, '', 'C')
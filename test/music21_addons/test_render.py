@@ -0,0 +1,59 @@
+import wave
+
+import numpy as np
+
+from music21_addons.onetrack import parse_onetrack, to_events
+from music21_addons.render import BlockSynth, render_wav, stem_path
+from music21_addons.tempo_map import TempoMap
+from music21_addons.timeline import build_timeline
+
+
+class CountingSynth(BlockSynth):
+    """Outputs the number of sounding notes as every sample, on the left channel, and the last program on the right."""
+
+    def __init__(self):
+        self.on = set()
+        self.program = 0
+
+    def note_on(self, notenum, chan, velocity):
+        self.on.add((chan, notenum))
+
+    def note_off(self, notenum, chan, velocity):
+        self.on.discard((chan, notenum))
+
+    def program_change(self, chan, inst):
+        self.program = inst
+
+    def render(self, frames):
+        samples = np.empty((frames, 2), dtype=np.int16)
+        samples[:, 0] = len(self.on)
+        samples[:, 1] = self.program
+        return samples
+
+
+def read_wav(path):
+    with wave.open(path, 'rb') as f:
+        assert (f.getnchannels(), f.getsampwidth(), f.getframerate()) == (2, 2, 100)
+        return np.frombuffer(f.readframes(f.getnframes()), dtype='<i2').reshape(-1, 2)
+
+
+def test_render_wav(tmp_path):
+    timeline = build_timeline([(3, to_events(parse_onetrack("C D [e g]"))), (7, to_events(parse_onetrack("rh Gh")))])
+    path = str(tmp_path / 'out.wav')
+    result = render_wav(timeline, TempoMap(120), path, CountingSynth, samplerate=100, tail_sec=0.25)
+    assert result['seconds'] == 2.25
+    assert result['realtime_factor'] > 0
+    left = read_wav(path)[:, 0]
+    assert len(left) == 225
+    assert list(left[[0, 99, 100, 149, 150, 199, 200, 224]]) == [1, 1, 3, 3, 1, 1, 0, 0]
+
+
+def test_render_stems(tmp_path):
+    timeline = build_timeline([(3, to_events(parse_onetrack("C D [e g]"))), (7, to_events(parse_onetrack("rh Gh")))])
+    path = str(tmp_path / 'out.wav')
+    render_wav(timeline, TempoMap(120), path, CountingSynth, samplerate=100, stems=True, tail_sec=0)
+    stems = [read_wav(stem_path(path, track)) for track in range(2)]
+    assert stem_path(path, 1).endswith('out-track2.wav')
+    assert list(stems[0][:, 1][[0, 199]]) == [3, 3]
+    assert list(stems[1][:, 1][[0, 99, 100, 199]]) == [0, 0, 7, 7]
+    assert (read_wav(path) == stems[0] + stems[1]).all()
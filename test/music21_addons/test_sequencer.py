@@ -1,7 +1,14 @@
+import threading
+from collections import Counter
+
 from music21 import stream, instrument
 
-from music21_addons.onetrack import parse_onetrack, to_part
-from music21_addons.sequencer import MySequencer, MidoSynth
+from music21_addons.clock import VirtualClock, NS_PER_SEC
+from music21_addons.onetrack import parse_onetrack, to_part, to_events, to_tempo_changes
+from music21_addons import sequencer
+from music21_addons.sequencer import MySequencer, RecordingSynth, MidoSynth, CMD_REPLACE_TIMELINE, noop
+from music21_addons.tempo_map import TempoMap
+from music21_addons.timeline import build_timeline
 
 
 def now_playing_fn(pl=None):
@@ -12,14 +19,334 @@ def pupdate(pos, length):
     print("pupdate:", pos, length)
 
 
+def headless_sequencer():
+    clock = VirtualClock()
+    synth = RecordingSynth(clock)
+    return MySequencer(synth, clock=clock), synth
+
+
+def play_and_wait(seq, *args, **kwargs):
+    finished = threading.Event()
+    seq.play_events(*args, finished_cb=lambda *a: finished.set(), **kwargs)
+    assert finished.wait(5)
+
+
 def test_one():
     s = "C-6 Aq A:100 Aq:100 [a b4]q [c d]q:100 v:60"
     p, map = to_part(parse_onetrack(s))
     p.insert(0, instrument.instrumentFromMidiProgram(0))
     score = stream.Score()
     score.insert(0, p)
-    # print(map)
-    # score.show('text')
-    # TODO: use textsynth and check output
-    seq = MySequencer(MidoSynth())
-    seq.play(score, 120, now_playing=now_playing_fn, progress_update=pupdate)
+    seq, synth = headless_sequencer()
+    finished = threading.Event()
+    seq.play(score, 120, now_playing=now_playing_fn, progress_update=pupdate,
+             finished_cb=lambda *a: finished.set())
+    assert finished.wait(5)
+    ons = [e for e in synth.events if e[1] == 'note_on']
+    assert [e[3] for e in ons] == [83, 69, 69, 69, 69, 71, 60, 62]
+    assert [e[4] for e in ons] == [60, 60, 100, 100, 30, 30, 50, 50]
+    assert ons[-1][0] == 5 * NS_PER_SEC // 2
+    seq.close()
+
+
+def test_events_timing():
+    seq, synth = headless_sequencer()
+    play_and_wait(seq, [(5, to_events(parse_onetrack("C D [e g] v:90 As")))], 120)
+    assert synth.events == [
+        (0, 'program_change', 0, 5),
+        (0, 'note_on', 0, 60, 60),
+        (NS_PER_SEC // 2, 'note_off', 0, 60, 60),
+        (NS_PER_SEC // 2, 'note_on', 0, 62, 60),
+        (NS_PER_SEC, 'note_off', 0, 62, 60),
+        (NS_PER_SEC, 'note_on', 0, 64, 30),
+        (NS_PER_SEC, 'note_on', 0, 67, 30),
+        (3 * NS_PER_SEC // 2, 'note_off', 0, 64, 30),
+        (3 * NS_PER_SEC // 2, 'note_off', 0, 67, 30),
+        (3 * NS_PER_SEC // 2, 'note_on', 0, 69, 90),
+        (13 * NS_PER_SEC // 8, 'note_off', 0, 69, 90),
+    ]
+    seq.close()
+
+
+def test_seek_before_play():
+    seq, synth = headless_sequencer()
+    seq.seek(1500)
+    play_and_wait(seq, [(5, to_events(parse_onetrack("C D E F G")))], 120)
+    assert [e[1:] for e in synth.events] == [
+        ('program_change', 0, 5),
+        ('note_off', 0, 64, 60),
+        ('note_on', 0, 65, 60),
+        ('note_off', 0, 65, 60),
+        ('note_on', 0, 67, 60),
+        ('note_off', 0, 67, 60),
+    ]
+    seq.close()
+
+
+def test_pos_resets_after_finish():
+    seq, synth = headless_sequencer()
+    play_and_wait(seq, [(0, to_events(parse_onetrack("C D")))], 60)
+    seq.sync()
+    assert seq.get_pos() == 0
+    assert seq.on_items == {}
+    seq.close()
+
+
+def test_timing_stats():
+    seq, synth = headless_sequencer()
+    play_and_wait(seq, [(0, to_events(parse_onetrack("C D [e g]"))), (1, to_events(parse_onetrack("Ah")))], 60)
+    summary = seq.stats.summary()
+    assert summary[('RecordingSynth', 0)]['events'] == 8
+    assert summary[('RecordingSynth', 1)]['events'] == 2
+    assert summary[('RecordingSynth', 0)]['lateness_max'] == 0
+    seq.close()
+
+
+def test_tempo_changes_in_text():
+    seq, synth = headless_sequencer()
+    items = parse_onetrack("C D tempo:120 E F")
+    play_and_wait(seq, [(0, to_events(items))], TempoMap(60, to_tempo_changes(items)))
+    ons = [e[0] for e in synth.events if e[1] == 'note_on']
+    assert ons == [0, NS_PER_SEC, 2 * NS_PER_SEC, 5 * NS_PER_SEC // 2]
+    seq.close()
+
+
+def test_set_tempo_keeps_beat_position():
+    seq, synth = headless_sequencer()
+    seq.send(CMD_REPLACE_TIMELINE, build_timeline([(0, to_events(parse_onetrack("C D E F")))]), TempoMap(60),
+             noop, noop, noop, seq.generation)
+    seq.seek(2000)
+    seq.set_tempo(120)
+    seq.sync()
+    assert seq.get_pos() == 1000
+    assert seq.length == 2000
+    finished = threading.Event()
+    seq.finished_cb = lambda *a: finished.set()
+    seq.start()
+    assert finished.wait(5)
+    assert [(e[0], e[3]) for e in synth.events if e[1] == 'note_on'] == [(0, 64), (NS_PER_SEC // 2, 65)]
+    seq.close()
+
+
+class TriggerSynth(RecordingSynth):
+    """Calls ``actions[note]`` from the playback thread whenever that note starts.
+
+    ``started`` counts the starts of every note so far.
+    """
+
+    def __init__(self, clock, actions):
+        super().__init__(clock)
+        self.actions = actions
+        self.started = Counter()
+
+    def note_on(self, notenum, chan, velocity):
+        super().note_on(notenum, chan, velocity)
+        self.started[notenum] += 1
+        if notenum in self.actions:
+            self.actions[notenum]()
+
+
+def swapping_sequencer(at_note, replacement):
+    clock = VirtualClock()
+    synth = TriggerSynth(clock, {at_note: lambda: seq.replace_track(*replacement)})
+    seq = MySequencer(synth, clock=clock)
+    return seq, synth
+
+
+def test_replace_track_while_playing():
+    seq, synth = swapping_sequencer(62, (0, 5, to_events(parse_onetrack("C D A B"))))
+    play_and_wait(seq, [(5, to_events(parse_onetrack("C D E F"))), (7, to_events(parse_onetrack("Gw")))], 60)
+    ons = [(e[0] // NS_PER_SEC, e[2], e[3]) for e in synth.events if e[1] == 'note_on']
+    assert ons == [(0, 0, 60), (0, 1, 67), (1, 0, 62), (2, 0, 69), (3, 0, 71)]
+    offs = [(e[0] // NS_PER_SEC, e[3]) for e in synth.events if e[1] == 'note_off']
+    assert offs == [(1, 60), (2, 62), (3, 69), (4, 71), (4, 67)]
+    assert len(seq.to_play.sources) == 5
+    seq.close()
+
+
+def test_replace_track_stops_removed_notes():
+    seq, synth = swapping_sequencer(62, (0, 5, to_events(parse_onetrack("C Dh A"))))
+    play_and_wait(seq, [(5, to_events(parse_onetrack("C D E F")))], 60)
+    # the sounding D is not in the new events (which have a longer D), so it stops at once
+    assert [(e[0] // NS_PER_SEC, e[1], e[3]) for e in synth.events if e[1] != 'program_change'] == [
+        (0, 'note_on', 60), (1, 'note_off', 60), (1, 'note_on', 62), (1, 'note_off', 62),
+        (3, 'note_on', 69), (4, 'note_off', 69)]
+    assert seq.on_items == {}
+    seq.close()
+
+
+def test_loop_region():
+    def stop_third_time():
+        if synth.started[64] == 3:
+            seq.stop()
+
+    clock = VirtualClock()
+    synth = TriggerSynth(clock, {64: stop_third_time})
+    seq = MySequencer(synth, clock=clock)
+    seq.set_loop(1000, 3000)
+    play_and_wait(seq, [(0, to_events(parse_onetrack("C D Eh G")))], 60)
+    ons = [(e[0] // NS_PER_SEC, e[3]) for e in synth.events if e[1] == 'note_on']
+    assert ons == [(0, 60), (1, 62), (2, 64), (3, 62), (4, 64), (5, 62), (6, 64)]
+    # the half note hanging over the loop end is cut off there, and the loop starts again straight away
+    at_wrap = [e[1:] for e in synth.events if e[0] == 3 * NS_PER_SEC]
+    assert at_wrap[0] == ('note_off', 0, 64, 0) and at_wrap[-1] == ('note_on', 0, 62, 60)
+    seq.close()
+
+
+class BatchRecordingSynth(RecordingSynth):
+    def __init__(self, clock):
+        super().__init__(clock)
+        self.batches = []
+
+    def send_batch(self, events):
+        self.batches.append(list(events))
+        super().send_batch(events)
+
+
+def test_batched_synth_gets_one_call_per_time():
+    tracks = [(5, to_events(parse_onetrack("C D [e g] v:90 As"))), (7, to_events(parse_onetrack("Gh Ah")))]
+    seq, unbatched = headless_sequencer()
+    play_and_wait(seq, tracks, 120)
+    seq.close()
+
+    clock = VirtualClock()
+    synth = BatchRecordingSynth(clock)
+    seq = MySequencer(synth, clock=clock)
+    assert seq.batching
+    play_and_wait(seq, tracks, 120)
+    seq.close()
+    assert len(synth.batches) == 6
+    assert synth.batches[0] == [(0xC0, 5, 0), (0x90, 60, 60), (0xC1, 7, 0), (0x91, 67, 60)]
+    assert sorted(synth.events) == sorted(unbatched.events)
+    assert seq.stats.count == len([e for e in synth.events if e[1] != 'program_change'])
+
+
+def test_more_tracks_than_channels():
+    seq, synth = headless_sequencer()
+    play_and_wait(seq, [(program, to_events(parse_onetrack("C D"))) for program in range(20)], 60)
+    programs = {e[2]: e[3] for e in synth.events if e[1] == 'program_change'}
+    assert programs == {chan: program for program, chan in enumerate([c for c in range(21) if c != 9])}
+    assert len([e for e in synth.events if e[1] == 'note_on' and e[2] >= 16]) == 10
+    seq.close()
+
+
+def test_replace_track_with_new_program():
+    seq, synth = swapping_sequencer(62, (1, 41, to_events(parse_onetrack("Gh Ah"))))
+    play_and_wait(seq, [(5, to_events(parse_onetrack("C D E F"))), (7, to_events(parse_onetrack("Gw")))], 60)
+    ons = [(e[0] // NS_PER_SEC, e[2], e[3]) for e in synth.events if e[1] == 'note_on']
+    assert ons == [(0, 0, 60), (0, 1, 67), (1, 0, 62), (2, 0, 64), (2, 1, 69), (3, 0, 65)]
+    assert (2 * NS_PER_SEC, 'program_change', 1, 41) in synth.events
+    seq.close()
+
+
+def test_mute_tracks_while_playing():
+    clock = VirtualClock()
+    synth = TriggerSynth(clock, {62: lambda: seq.set_muted_tracks([1]), 65: lambda: seq.set_muted_tracks([])})
+    seq = MySequencer(synth, clock=clock)
+    play_and_wait(seq, [(5, to_events(parse_onetrack("C D E F"))), (7, to_events(parse_onetrack("Gh Ah Gh")))], 60)
+    # track 1 is cut off as soon as it is muted, and comes back at its next note once unmuted
+    assert [(e[0] // NS_PER_SEC, e[1], e[3]) for e in synth.events if e[2] == 1 and e[1] != 'program_change'][:2] == [
+        (0, 'note_on', 67), (1, 'note_off', 67)]
+    assert [(e[0] // NS_PER_SEC, e[3]) for e in synth.events if e[1] == 'note_on' and e[2] == 1] == [(0, 67), (4, 67)]
+    assert [e[3] for e in synth.events if e[1] == 'note_on' and e[2] == 0] == [60, 62, 64, 65]
+    seq.close()
+
+
+def test_worker_survives_synth_errors():
+    def fail():
+        raise RuntimeError('synth failed')
+
+    clock = VirtualClock()
+    synth = TriggerSynth(clock, {62: fail})
+    seq = MySequencer(synth, clock=clock)
+    play_and_wait(seq, [(0, to_events(parse_onetrack("C D E")))], 60)
+    assert [e[3] for e in synth.events if e[1] == 'note_on'] == [60, 62, 64]
+    play_and_wait(seq, [(0, to_events(parse_onetrack("C D")))], 60)
+    assert seq.sync(5)
+    seq.close()
+
+
+def test_stale_finished_callbacks_are_dropped():
+    seq, synth = headless_sequencer()
+    release = threading.Event()
+    seq.notifier.call(release.wait)
+    finished = []
+    second_finished = threading.Event()
+
+    def second():
+        finished.append('second')
+        second_finished.set()
+
+    events = to_events(parse_onetrack("C D"))
+    seq.play_events([(0, events)], 60, finished_cb=lambda: finished.append('first'))
+    seq.stop()
+    seq.play_events([(0, events)], 60, finished_cb=second)
+    release.set()
+    assert second_finished.wait(5)
+    assert finished == ['second']
+    seq.close()
+
+
+def test_replace_track_with_new_program_keeps_other_tracks_sounding():
+    seq, synth = swapping_sequencer(62, (0, 6, to_events(parse_onetrack("C D A B"))))
+    play_and_wait(seq, [(5, to_events(parse_onetrack("C D E F"))), (7, to_events(parse_onetrack("Gw")))], 60)
+    assert [(e[0] // NS_PER_SEC, e[1]) for e in synth.events if e[3] == 67 and e[1] != 'program_change'] == [
+        (0, 'note_on'), (4, 'note_off')]
+    assert [(e[0] // NS_PER_SEC, e[3]) for e in synth.events if e[1] == 'note_on' and e[3] != 67] == [
+        (0, 60), (1, 62), (2, 69), (3, 71)]
+    seq.close()
+
+
+class FakeOutput():
+    """A mido output with only the public API."""
+
+    def __init__(self, name):
+        self.name = name
+        self.messages = []
+
+    def send(self, msg):
+        self.messages.append(msg)
+
+    def close(self):
+        pass
+
+
+class FakePygameOutput(FakeOutput):
+    """A mido output on the pygame backend, whose pygame.midi Output writes many messages at once."""
+
+    def __init__(self, name):
+        super().__init__(name)
+        self._lock = threading.RLock()
+        self._port = self
+        self.writes = []
+
+    def write(self, messages):
+        self.writes.append(messages)
+
+
+def test_mido_synth_opens_more_ports(monkeypatch):
+    outputs = []
+
+    def open_output(name):
+        outputs.append(FakeOutput(name))
+        return outputs[-1]
+
+    monkeypatch.setattr(sequencer.mido, 'set_backend', noop)
+    monkeypatch.setattr(sequencer.mido, 'get_output_names', lambda: ['first', 'second'])
+    monkeypatch.setattr(sequencer.mido, 'open_output', open_output)
+    seq = MySequencer(MidoSynth(), clock=VirtualClock())
+    play_and_wait(seq, [(program, to_events(parse_onetrack("C D"))) for program in range(20)], 60)
+    seq.close()
+    assert [out.name for out in outputs] == ['first', 'second']
+    assert {msg.program for msg in outputs[1].messages if msg.type == 'program_change'} == {15, 16, 17, 18, 19}
+    assert len([msg for msg in outputs[1].messages if msg.type == 'note_on']) == 10
+
+
+def test_mido_synth_batches_on_pygame(monkeypatch):
+    monkeypatch.setattr(sequencer.mido, 'set_backend', noop)
+    monkeypatch.setattr(sequencer.mido, 'get_output_names', lambda: ['first'])
+    monkeypatch.setattr(sequencer.mido, 'open_output', FakePygameOutput)
+    synth = MidoSynth()
+    synth.send_batch([(0xC0, 5, 0), (0x90, 60, 100), (0x80, 60, 0)])
+    assert synth.output.writes == [[[[0xC0, 5, 0], 0], [[0x90, 60, 100], 0], [[0x80, 60, 0], 0]]]
+    assert synth.output.messages == []
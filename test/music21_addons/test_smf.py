@@ -0,0 +1,71 @@
+import mido
+
+from music21_addons.onetrack import parse_onetrack, to_events, to_tempo_changes
+from music21_addons.smf import write_smf, read_smf, notes_to_onetrack, pitch_name
+from music21_addons.tempo_map import TempoMap
+from music21_addons.timeline import build_timeline
+
+
+def test_pitch_name():
+    assert [pitch_name(n) for n in [60, 61, 63, 71, 72, 23, 5, 127]] == ['C', 'C#', 'E-', 'B', 'C5', 'B0', 'F0', 'G8']
+
+
+def test_notes_to_onetrack():
+    # grid units are sixteenths: a quarter note is 4
+    notes = [(0, 4, 60, 60), (4, 9, 62, 80), (12, 14, 64, 40), (12, 14, 67, 40)]
+    assert notes_to_onetrack(notes, [(0, 90), (6, 120)]) == 'tempo:90 v:60 C v:80 D tempo:120 r [E G]t:80'
+
+
+def test_round_trip(tmp_path):
+    texts = ["tempo:90 C D [e g] v:90 As r Gh. c5 B-3t", "v:100 Cw Dh [C E G]q F#2s rs A-8", "rw rw rw C D"]
+    items = [parse_onetrack(text) for text in texts]
+    # the fourth track has no notes
+    tracks = [(5, to_events(items[0])), (33, to_events(items[1])), (48, to_events(items[2])), (40, [])]
+    timeline = build_timeline(tracks)
+    assert timeline.channels.track_channels == [0, 1, 2, -1]
+    path = str(tmp_path / 'out.mid')
+    write_smf(timeline, TempoMap(120, to_tempo_changes(items[0])), path)
+
+    mid = mido.MidiFile(path)
+    assert len(mid.tracks) == 5
+    assert [msg.tempo for msg in mid.tracks[0] if msg.type == 'set_tempo'] == [mido.bpm2tempo(90)]
+    program_changes = []
+    for track in mid.tracks[1:]:
+        tick = 0
+        changes = []
+        for msg in track:
+            tick += msg.time
+            if msg.type == 'program_change':
+                changes.append((tick, msg.channel, msg.program))
+        program_changes.append(changes)
+    assert program_changes == [[(0, 0, 5)], [(0, 1, 33)], [(12 * mid.ticks_per_beat, 2, 48)], []]
+
+    channels = read_smf(path)
+    assert [(vchan, program) for vchan, program, text in channels] == [(0, 5), (1, 33), (2, 48)]
+    for (_, events), (vchan, _, text) in zip(tracks, channels):
+        imported = parse_onetrack(text)
+        assert [(ev.offset, ev.duration, ev.pitches, ev.velocity) for ev in to_events(imported)] == \
+            [(ev.offset, ev.duration, ev.pitches, ev.velocity) for ev in events]
+    assert to_tempo_changes(parse_onetrack(channels[0][2])) == [(0.0, 90.0)]
+
+
+def test_read_smf_splits_by_track_and_program(tmp_path):
+    beat = 480
+    first = mido.MidiTrack([
+        mido.Message('program_change', channel=0, program=5),
+        mido.Message('note_on', channel=0, note=60, velocity=60),
+        mido.Message('note_off', channel=0, note=60, time=beat),
+        mido.Message('program_change', channel=0, program=48),
+        mido.Message('note_on', channel=0, note=62, velocity=60),
+        mido.Message('note_off', channel=0, note=62, time=beat),
+    ])
+    # the same channel in another track: its program at that time is 48, set by the first track
+    second = mido.MidiTrack([
+        mido.Message('note_on', channel=0, note=64, velocity=60, time=2 * beat),
+        mido.Message('note_off', channel=0, note=64, time=beat),
+    ])
+    mid = mido.MidiFile(ticks_per_beat=beat)
+    mid.tracks.extend([first, second])
+    path = str(tmp_path / 'in.mid')
+    mid.save(path)
+    assert read_smf(path) == [(0, 5, 'v:60 C'), (0, 48, 'r v:60 D'), (0, 48, 'rh v:60 E')]
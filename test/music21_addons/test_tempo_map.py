@@ -0,0 +1,32 @@
+from music21_addons.tempo_map import TempoMap
+
+
+def test_constant_tempo():
+    tm = TempoMap(120)
+    assert tm.beat_to_seconds(0) == 0
+    assert tm.beat_to_seconds(3) == 1.5
+    assert tm.seconds_to_beat(1.5) == 3
+
+
+def test_tempo_changes():
+    tm = TempoMap(60, [(4, 120), (8, 30)])
+    assert list(tm.seconds) == [0, 4, 6]
+    assert tm.beat_to_seconds(4) == 4
+    assert tm.beat_to_seconds(6) == 5
+    assert tm.beat_to_seconds(9) == 8
+    for beat in [0, 1.5, 4, 7.25, 8, 12]:
+        assert tm.seconds_to_beat(tm.beat_to_seconds(beat)) == beat
+    assert list(tm.beat_to_seconds([0, 6, 9])) == [0, 5, 8]
+
+
+def test_change_at_start_overrides_base():
+    tm = TempoMap(60, [(0, 120), (2, 60)])
+    assert tm.beat_to_seconds(2) == 1
+    assert tm.beat_to_seconds(3) == 2
+    assert tm.with_base_tempo(30).beat_to_seconds(3) == 2
+
+
+def test_with_base_tempo_keeps_changes():
+    tm = TempoMap(60, [(4, 120)]).with_base_tempo(120)
+    assert tm.beat_to_seconds(4) == 2
+    assert tm.beat_to_seconds(6) == 3
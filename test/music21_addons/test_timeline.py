@@ -0,0 +1,91 @@
+import numpy as np
+
+from music21_addons.onetrack import parse_onetrack, to_events
+from music21_addons.timeline import build_timeline, NOTE_ON, NOTE_OFF, SNAPSHOT_INTERVAL
+
+
+def test_build_timeline():
+    tracks = [(5, to_events(parse_onetrack("C D [e g] v:90 As"))),
+              (40, to_events(parse_onetrack("Ch Eh")))]
+    tl = build_timeline(tracks)
+    assert len(tl.events) == 14
+    assert tl.length == 4.0
+    assert list(tl.group_times) == [0.0, 1.0, 2.0, 3.0, 3.25, 4.0]
+
+    first = tl.group(0)
+    assert first['note'].tolist() == [60, 60]
+    assert set(first['chan'].tolist()) == {0, 1}
+    assert set(first['program'].tolist()) == {5, 40}
+
+    # at beat 2 the chord starts and the half notes change: note-offs go first
+    types = tl.group(2)['type'].tolist()
+    assert types == sorted(types) and types[0] == NOTE_OFF and types[-1] == NOTE_ON
+
+    chord_rows = tl.events[tl.events['note'] == 67]
+    assert chord_rows['velocity'].tolist() == [30, 30]
+    assert tl.sources[chord_rows['source'][0]].pitches == (64, 67)
+
+
+def test_empty_timeline():
+    tl = build_timeline([(0, [])])
+    assert len(tl) == 0
+    assert tl.length == 0.0
+
+
+def test_group_at():
+    tl = build_timeline([(0, to_events(parse_onetrack("C D E F")))])
+    assert tl.group_at(0) == 0
+    assert tl.group_at(1.5) == 2
+    assert tl.group_at(2) == 2
+    assert tl.group_at(10) == len(tl)
+
+
+def test_programs_at_matches_replay():
+    tracks = [(i + 1, to_events(parse_onetrack(' '.join(['C', 'D', '[e g]', 'Fs'] * (i + 20)))))
+              for i in range(6)]
+    tl = build_timeline(tracks)
+    assert len(tl.events) > 3 * SNAPSHOT_INTERVAL
+    programs = [-1] * 16
+    for row, (chan, program) in enumerate(tl.events[['chan', 'program']].tolist()):
+        assert tl.programs_at(row) == programs
+        programs[chan] = program
+    assert tl.programs_at(len(tl.events)) == programs
+
+
+def test_with_track():
+    tracks = [(5, to_events(parse_onetrack("C D E F"))), (40, to_events(parse_onetrack("Gw")))]
+    tl = build_timeline(tracks)
+    d_source = int(tl.events[tl.events['note'] == 62]['source'][0])
+    g_source = int(tl.events[tl.events['note'] == 67]['source'][0])
+
+    new_events = to_events(parse_onetrack("C D A B"))
+    swap = tl.with_track(0, 5, new_events)
+    new = swap.timeline
+    fields = ['time', 'type', 'chan', 'note', 'velocity', 'program', 'track']
+    assert new.events[fields].tolist() == build_timeline([(5, new_events), tracks[1]]).events[fields].tolist()
+    # the old events of the track are dropped, so editing does not grow the timeline
+    assert len(new.sources) == len(tl.sources)
+    assert new.sources[swap.carry(tl, g_source, 67)] is tl.sources[g_source]
+    # the D sounding at beat 1 carries on as the D of the new events
+    assert new.sources[swap.carry(tl, d_source, 62)] is new_events[1]
+    assert swap.unstarted(1.5, [(swap.carry(tl, d_source, 62), 62)]).tolist() == []
+
+    swap = tl.with_track(0, 5, to_events(parse_onetrack("C Eh")))
+    assert swap.carry(tl, d_source, 62) is None
+    # the half note E was skipped over: its note-off is not to be played
+    e_source = int(swap.timeline.events[swap.timeline.events['note'] == 64]['source'][0])
+    assert swap.unstarted(1.5, []).tolist() == [e_source << 8 | 64]
+    assert swap.remap_keys(np.array([d_source << 8 | 62, g_source << 8 | 67])).tolist() == [
+        swap.carry(tl, g_source, 67) << 8 | 67]
+
+    # a new program needs a new channel allocation
+    swap = tl.with_track(0, 6, to_events(parse_onetrack("C D A B")))
+    assert swap.rebuilt
+    assert swap.timeline.channels.track_programs == [6, 40]
+    # the other track's notes carry on, on their channel
+    assert swap.timeline.sources[swap.carry(tl, g_source, 67)] is tl.sources[g_source]
+
+
+def test_tracks_round_trip():
+    tracks = [(5, to_events(parse_onetrack("C D [e g] v:90 As"))), (40, []), (5, to_events(parse_onetrack("Gw")))]
+    assert build_timeline(tracks).tracks() == tracks